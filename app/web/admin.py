@@ -0,0 +1,125 @@
+# app/web/admin.py
+# Flask-Admin и WTForms импортируются только отсюда, чтобы при
+# ADMIN_ENABLED=0 они не попадали в процесс вообще.
+from flask import current_app, g, redirect, request, url_for
+from flask_admin import Admin
+from flask_admin.contrib.sqla import ModelView
+from flask_login import current_user
+from sqlalchemy import false, literal, text
+from sqlalchemy.orm import joinedload
+
+from .models import db, Users, Roles, Products, Characteristics, ProductCharacteristics, Carts, CartItems, Favorites, Orders, OrderStatuses
+
+
+# =========================
+# Планы жадной загрузки
+# =========================
+# Связи, которые список рисует в каждой строке. Многие-к-одному грузим
+# joinedload (один запрос), чтобы не было ленивой подгрузки на строку.
+EAGER_LOADS = {
+    Users: (joinedload(Users.role),),
+    Carts: (joinedload(Carts.user),),
+    Orders: (joinedload(Orders.user), joinedload(Orders.status), joinedload(Orders.cart)),
+    CartItems: (joinedload(CartItems.cart), joinedload(CartItems.product)),
+    Favorites: (joinedload(Favorites.user), joinedload(Favorites.product)),
+    ProductCharacteristics: (joinedload(ProductCharacteristics.product),
+                             joinedload(ProductCharacteristics.characteristic)),
+}
+
+
+def estimated_rows(table_name):
+    # оценка планировщика вместо COUNT(*); есть только в Postgres
+    if db.engine.dialect.name != "postgresql":
+        return None
+    estimate = db.session.execute(
+        text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": table_name},
+    ).scalar()
+    # reltuples = -1, пока таблицу ни разу не анализировали
+    return estimate if estimate is not None and estimate >= 0 else None
+
+
+# Flask-Admin
+class AdminModelView(ModelView):
+    column_default_sort = ("id", True)
+
+    def is_accessible(self):
+        return current_user.is_authenticated
+
+    def inaccessible_callback(self, name, **kwargs):
+        return redirect(url_for("login"))
+
+    def get_query(self):
+        return super().get_query().options(*EAGER_LOADS.get(self.model, ()))
+
+    # Большие таблицы без поиска и фильтров: оценочный count и keyset по id.
+    # Ссылка на следующую страницу несет after - id последней строки
+    # текущей, и следующая страница читает page_size строк от него. Переход
+    # на произвольную страницу (и назад) берет границу из индекса
+    # первичного ключа: это OFFSET по индексу, а не по широким строкам.
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        g._admin_large_list = None
+        g._admin_next_after = None
+        if not search and not filters:
+            estimate = estimated_rows(self.model.__tablename__)
+            threshold = current_app.config.get("ADMIN_ESTIMATED_COUNT_THRESHOLD", 100000)
+            if estimate is not None and estimate >= threshold:
+                g._admin_large_list = {"count": estimate, "seek": sort_column is None}
+        try:
+            count, data = super().get_list(page, sort_column, sort_desc, search, filters,
+                                           execute=execute, page_size=page_size)
+            large = g.get("_admin_large_list")
+            if execute and large and large["seek"] and data:
+                g._admin_next_after = ((page or 0) + 1, data[-1].id)
+            return count, data
+        finally:
+            g.pop("_admin_large_list", None)
+
+    def _get_list_url(self, view_args):
+        extra_args = {key: value for key, value in view_args.extra_args.items() if key != "after"}
+        next_after = g.get("_admin_next_after")
+        if (next_after and view_args.page == next_after[0] and view_args.sort is None
+                and not view_args.search and not view_args.filters):
+            extra_args["after"] = next_after[1]
+        return super()._get_list_url(view_args.clone(extra_args=extra_args))
+
+    def get_count_query(self):
+        large = g.get("_admin_large_list")
+        if large:
+            return self.session.query(literal(large["count"]))
+        return super().get_count_query()
+
+    def _apply_pagination(self, query, page, page_size):
+        large = g.get("_admin_large_list")
+        if page_size is None:
+            page_size = self.page_size
+        if not (large and large["seek"] and page and page_size):
+            return super()._apply_pagination(query, page, page_size)
+
+        # порядок по умолчанию - id по убыванию
+        pk = self.model.id
+        after = request.args.get("after", type=int)
+        if after is not None:
+            return query.filter(pk < after).limit(page_size)
+        # без after граница страницы берется из индекса первичного ключа,
+        # сами строки читаются от нее
+        boundary = (self.session.query(pk).order_by(pk.desc())
+                    .offset(page * page_size).limit(1).scalar())
+        if boundary is None:
+            return query.filter(false()).limit(page_size)
+        return query.filter(pk <= boundary).limit(page_size)
+
+
+def init_admin(app):
+    admin = Admin(app, name="Shop Admin")
+    admin.add_view(AdminModelView(Users, db.session))
+    admin.add_view(AdminModelView(Roles, db.session))
+    admin.add_view(AdminModelView(Products, db.session))
+    admin.add_view(AdminModelView(Characteristics, db.session))
+    admin.add_view(AdminModelView(ProductCharacteristics, db.session))
+    admin.add_view(AdminModelView(Carts, db.session))
+    admin.add_view(AdminModelView(CartItems, db.session))
+    admin.add_view(AdminModelView(Favorites, db.session))
+    admin.add_view(AdminModelView(Orders, db.session))
+    admin.add_view(AdminModelView(OrderStatuses, db.session))
+    return admin
@@ -0,0 +1,70 @@
+# app/web/after_commit.py
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+
+# =========================
+# Изменения после фиксации
+# =========================
+# События маппера срабатывают на flush, когда транзакция еще может
+# откатиться. Кэши и индексы процесса откладывают свои изменения в
+# session.info и применяют их в after_commit; откат их выбрасывает, откат
+# точки сохранения - только накопленные внутри нее.
+PENDING = "after_commit_pending"
+
+_handlers = {}  # имя -> handler(items)
+
+
+def register(name, handler):
+    _handlers[name] = handler
+    if not event.contains(Session, "after_commit", _after_commit):
+        event.listen(Session, "after_commit", _after_commit)
+    if not event.contains(Session, "after_soft_rollback", _after_soft_rollback):
+        event.listen(Session, "after_soft_rollback", _after_soft_rollback)
+
+
+def defer(target, name, item):
+    session = object_session(target)
+    if session is None:
+        _handlers[name]([item])
+        return
+    transaction = session.get_nested_transaction() or session.get_transaction()
+    session.info.setdefault(PENDING, []).append((transaction, name, item))
+
+
+# есть ли в текущей транзакции сессии неприменённые изменения name
+def pending(session, name):
+    return any(entry[1] == name for entry in session.info.get(PENDING, ()))
+
+
+def _after_commit(session):
+    # фиксация точки сохранения - еще не фиксация в базе
+    if session.in_nested_transaction():
+        return
+    entries = session.info.pop(PENDING, None)
+    if not entries:
+        return
+    grouped = {}
+    for _, name, item in entries:
+        grouped.setdefault(name, []).append(item)
+    for name, items in grouped.items():
+        _handlers[name](items)
+
+
+def _inside(transaction, boundary):
+    while transaction is not None:
+        if transaction is boundary:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+def _after_soft_rollback(session, previous_transaction):
+    entries = session.info.get(PENDING)
+    if not entries:
+        return
+    if not previous_transaction.nested:
+        session.info.pop(PENDING, None)
+        return
+    session.info[PENDING] = [entry for entry in entries
+                             if not _inside(entry[0], previous_transaction)]
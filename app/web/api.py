@@ -0,0 +1,328 @@
+# app/web/api.py
+import datetime
+import decimal
+import json
+
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from flask_login import current_user, login_required
+from werkzeug.exceptions import TooManyRequests
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import db, Products, Orders, Favorites
+from .pagination import encode_cursor, decode_cursor
+from .http_cache import conditional, catalog_validator
+from .checkout import checkout as checkout_cart, CheckoutError
+from .carts import cart_summary, CartError, InvalidQuantity, NotEnoughStock
+from .replicas import use_primary
+from .rollups import sales_summary
+from .ratelimit import rate_limit
+from .catalog_cache import PRODUCT_FIELDS, snapshot_to_dict
+
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+MAX_LIMIT = 200
+
+
+# =========================
+# Ресурсы API
+# =========================
+# columns - поля, которые можно запросить через ?fields=,
+# sorts - допустимые ключи сортировки: имя -> (колонка, по убыванию, тип значения)
+RESOURCES = {
+    "products": {
+        "model": Products,
+        "columns": ("id", "name", "price", "stock", "description", "image_url",
+                    "created_at", "updated_at", "is_active"),
+        "default_fields": ("id", "name", "price", "stock", "image_url"),
+        "sorts": {
+            "created_at": (Products.created_at, True, datetime.datetime.fromisoformat),
+            "price": (Products.price, False, decimal.Decimal),
+        },
+    },
+    "orders": {
+        "model": Orders,
+        "columns": ("id", "cart_id", "status_id", "total_amount", "created_at", "updated_at"),
+        "default_fields": ("id", "status_id", "total_amount", "created_at"),
+        "sorts": {
+            "created_at": (Orders.created_at, True, datetime.datetime.fromisoformat),
+        },
+    },
+    "favorites": {
+        "model": Favorites,
+        "columns": ("id", "product_id", "added_at"),
+        "default_fields": ("id", "product_id", "added_at"),
+        "sorts": {
+            "added_at": (Favorites.added_at, True, datetime.datetime.fromisoformat),
+        },
+    },
+}
+
+
+def _json_default(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Не сериализуется: {type(value).__name__}")
+
+
+class ApiError(ValueError):
+    pass
+
+
+def _parse_fields(resource):
+    raw = request.args.get("fields")
+    if not raw:
+        return list(resource["default_fields"])
+    fields = [field.strip() for field in raw.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in resource["columns"]]
+    if unknown:
+        raise ApiError(f"Неизвестные поля: {', '.join(unknown)}")
+    return fields
+
+
+def _keyset_page(name, where=()):
+    resource = RESOURCES[name]
+    model = resource["model"]
+    sort_name = request.args.get("sort", next(iter(resource["sorts"])))
+    if sort_name not in resource["sorts"]:
+        raise ApiError(f"Сортировка недоступна: {sort_name}")
+    sort_column, descending, parse = resource["sorts"][sort_name]
+    fields = _parse_fields(resource)
+    limit = max(1, min(request.args.get("limit", 50, type=int), MAX_LIMIT))
+
+    # ключ сортировки всегда выбирается, чтобы построить курсор
+    columns = [getattr(model, field) for field in fields]
+    query = select(*columns, sort_column.label("_sort"), model.id.label("_id")).where(*where)
+
+    try:
+        cursor = decode_cursor(request.args.get("cursor"))
+    except ValueError as e:
+        raise ApiError(str(e))
+    if cursor is not None:
+        if len(cursor) != 2:
+            raise ApiError("Некорректный курсор")
+        try:
+            key = (parse(cursor[0]), int(cursor[1]))
+        except (TypeError, ValueError, decimal.InvalidOperation):
+            raise ApiError("Некорректный курсор")
+        if descending:
+            query = query.where(tuple_(sort_column, model.id) < key)
+        else:
+            query = query.where(tuple_(sort_column, model.id) > key)
+
+    if descending:
+        query = query.order_by(sort_column.desc(), model.id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), model.id.asc())
+    # лишняя строка показывает, есть ли следующая страница
+    rows = db.session.execute(query.limit(limit + 1))
+
+    def generate():
+        yield '{"items":['
+        last = None
+        for index, row in enumerate(rows):
+            if index == limit:
+                last = (row_sort, row_id)
+                break
+            *values, row_sort, row_id = row
+            if index:
+                yield ","
+            yield json.dumps(dict(zip(fields, values)), default=_json_default, ensure_ascii=False)
+        next_cursor = encode_cursor(last) if last else None
+        yield '],"next_cursor":' + json.dumps(next_cursor) + "}"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+@api.errorhandler(ApiError)
+def api_error(e):
+    return jsonify(error=str(e)), 400
+
+
+@api.errorhandler(TooManyRequests)
+def too_many_requests(e):
+    return jsonify(error=e.description), 429, {"Retry-After": str(e.retry_after)}
+
+
+# =========================
+# Роуты
+# =========================
+@api.route("/products")
+@conditional(catalog_validator)
+def products():
+    return _keyset_page("products", where=(Products.is_active.isnot(False),))
+
+
+@api.route("/products/<int:product_id>/recommendations")
+def product_recommendations(product_id):
+    limit = min(request.args.get("limit", 10, type=int), 50)
+    neighbor_ids = current_app.extensions["recommendations"].get(product_id, limit=limit)
+    snapshots = current_app.extensions["catalog_cache"].get_many(neighbor_ids)
+    # выключенные после расчета товары отбрасываем при выдаче
+    items = [snapshot_to_dict(snapshots[pid]) for pid in neighbor_ids
+             if pid in snapshots and snapshots[pid][PRODUCT_FIELDS.index("is_active")] is not False]
+    return jsonify(items=items)
+
+
+@api.route("/products/popular")
+def popular_products():
+    limit = min(request.args.get("limit", 20, type=int), 100)
+    ranked = current_app.extensions["popularity"].top(limit)
+    snapshots = current_app.extensions["catalog_cache"].get_many([pid for pid, _ in ranked])
+    items = []
+    for product_id, score in ranked:
+        snapshot = snapshots.get(product_id)
+        if snapshot is None or snapshot[PRODUCT_FIELDS.index("is_active")] is False:
+            continue
+        item = snapshot_to_dict(snapshot)
+        item["score"] = round(score, 3)
+        items.append(item)
+    return Response(json.dumps({"items": items}, default=_json_default, ensure_ascii=False),
+                    mimetype="application/json")
+
+
+@api.route("/products/<int:product_id>/popularity")
+def product_popularity(product_id):
+    return jsonify(current_app.extensions["popularity"].counts(product_id))
+
+
+@api.route("/products/<int:product_id>/availability")
+@use_primary()
+def product_availability(product_id):
+    availability = current_app.extensions["reservations"].available([product_id]).get(product_id)
+    if availability is None:
+        return jsonify(error="Товар не найден"), 404
+    return jsonify(availability)
+
+
+@api.route("/orders")
+@login_required
+@use_primary()
+def orders():
+    return _keyset_page("orders", where=(Orders.user_id == int(current_user.id),))
+
+
+@api.route("/favorites")
+@login_required
+def favorites():
+    return _keyset_page("favorites", where=(Favorites.user_id == int(current_user.id),))
+
+
+@api.route("/favorites", methods=["POST"])
+@rate_limit("write")
+@login_required
+def favorite_add():
+    data = request.get_json(silent=True) or request.form
+    try:
+        product_id = int(data["product_id"])
+    except (KeyError, TypeError, ValueError):
+        raise ApiError("Нужен product_id")
+    if db.session.get(Products, product_id) is None:
+        return jsonify(error="Товар не найден"), 404
+    insert = postgresql.insert if db.engine.dialect.name == "postgresql" else sqlite.insert
+    result = db.session.execute(
+        insert(Favorites.__table__)
+        .values(user_id=int(current_user.id), product_id=product_id,
+                added_at=datetime.datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=["user_id", "product_id"])
+    )
+    db.session.commit()
+    if result.rowcount:
+        current_app.extensions["popularity"].record(product_id, favorites=1)
+        return "", 201
+    return "", 200
+
+
+@api.route("/favorites/<int:product_id>", methods=["DELETE"])
+@rate_limit("write")
+@login_required
+def favorite_remove(product_id):
+    result = db.session.execute(
+        delete(Favorites.__table__)
+        .where(Favorites.user_id == int(current_user.id), Favorites.product_id == product_id)
+    )
+    db.session.commit()
+    if result.rowcount:
+        current_app.extensions["popularity"].record(product_id, favorites=-result.rowcount)
+    return "", 204
+
+
+@api.route("/checkout", methods=["POST"])
+@rate_limit("write")
+@login_required
+def checkout():
+    try:
+        order_id = checkout_cart(int(current_user.id))
+    except CheckoutError as e:
+        return jsonify(error=str(e)), 409
+    return jsonify(order_id=order_id), 201
+
+
+@api.route("/cart")
+@login_required
+@use_primary()
+def cart():
+    summary = cart_summary(int(current_user.id))
+    return Response(json.dumps(summary, default=_json_default, ensure_ascii=False),
+                    mimetype="application/json")
+
+
+@api.route("/cart/badge")
+@login_required
+@use_primary()
+def cart_badge():
+    carts = current_app.extensions["cart_service"]
+    return jsonify(count=carts.badge_count(int(current_user.id)))
+
+
+@api.route("/cart/items", methods=["POST"])
+@rate_limit("write")
+@login_required
+def cart_add():
+    data = request.get_json(silent=True) or request.form
+    try:
+        product_id = int(data["product_id"])
+        quantity = int(data.get("quantity", 1))
+    except (KeyError, TypeError, ValueError):
+        raise ApiError("Нужны product_id и quantity")
+    carts = current_app.extensions["cart_service"]
+    try:
+        cart_id = carts.add(int(current_user.id), product_id, quantity)
+    except NotEnoughStock as e:
+        return jsonify(error=str(e)), 409
+    except InvalidQuantity as e:
+        return jsonify(error=str(e)), 400
+    except CartError as e:
+        return jsonify(error=str(e)), 404
+    return jsonify(cart_id=cart_id), 201
+
+
+@api.route("/cart/items/<int:product_id>", methods=["DELETE"])
+@rate_limit("write")
+@login_required
+def cart_remove(product_id):
+    current_app.extensions["cart_service"].remove(int(current_user.id), product_id)
+    return "", 204
+
+
+@api.route("/sales/summary")
+@login_required
+def sales():
+    if current_user.role_name != "admin":
+        return jsonify(error="Недостаточно прав"), 403
+    try:
+        end = datetime.datetime.fromisoformat(request.args["end"]) if "end" in request.args \
+            else datetime.datetime.utcnow()
+        start = datetime.datetime.fromisoformat(request.args["start"]) if "start" in request.args \
+            else end - datetime.timedelta(days=30)
+        rows = sales_summary(start, end,
+                             granularity=request.args.get("granularity", "day"),
+                             status_id=request.args.get("status_id", type=int),
+                             cohort=request.args.get("cohort"))
+    except ValueError as e:
+        raise ApiError(str(e))
+    return Response(json.dumps({"items": rows}, default=_json_default, ensure_ascii=False),
+                    mimetype="application/json")
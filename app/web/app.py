@@ -1,103 +1,304 @@
 # app/web/app.py
 import os
-from flask import Flask, render_template, redirect, url_for, request, flash
-from flask_sqlalchemy import SQLAlchemy
+import click
+from flask.cli import with_appcontext
+from flask import Flask, render_template, redirect, url_for, request, flash, jsonify
 from flask_migrate import Migrate
-from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
-from flask_admin import Admin
-from flask_admin.contrib.sqla import ModelView
+from flask_login import LoginManager, login_user, logout_user, current_user, login_required
 from dotenv import load_dotenv
-from .models import db
+from .models import db, Users, Roles
+from .catalog_cache import CatalogCache, snapshot_to_dict
+from .facets import FacetIndex
+from .search import ProductSearch, decode_search_cursor
+from .pagination import encode_cursor
+from .principals import AuthUser, PrincipalCache
+from .api import api
+from .catalog_import import catalog_cli
+from .metrics import SQLMetrics
+from .hashing import PasswordHasher, HasherBusy
+from .carts import CartService
+from .outbox import Outbox, outbox_cli
+from .rollups import rollups_cli
+from .recommendations import Recommendations, recommendations_cli
+from .popularity import Popularity, popularity_cli
+from .reservations import Reservations, reservations_cli
+from .replicas import ReplicaRouter
+from .retention import retention_cli
+from .plans import plans_cli
+from .seed import seed_command
+from .loadtest import loadtest_cli, simulate_db_latency
+from .assets import Assets, assets_cli
+from .images import images_cli
+from .ratelimit import RateLimiter, ratelimit_cli
+from .bench import bench_cli
+from .http_cache import HttpCache, conditional, product_validator
 
 
-dotenv_path = os.path.join(os.path.dirname(__file__), "..", ".env")
-load_dotenv(dotenv_path)
+# Расширения создаются один раз, к приложению привязываются в create_app
+catalog_cache = CatalogCache()
+facet_index = FacetIndex()
+product_search = ProductSearch()
+principal_cache = PrincipalCache()
+sql_metrics = SQLMetrics()
+password_hasher = PasswordHasher()
+http_cache = HttpCache()
+cart_service = CartService()
+outbox = Outbox()
+recommendations = Recommendations()
+popularity = Popularity()
+reservations = Reservations()
+rate_limiter = RateLimiter()
+assets = Assets()
+replica_router = ReplicaRouter()
+migrate = Migrate()
+login_manager = LoginManager()
+login_manager.login_view = "login"
+
+
+def _env_flag(name, default):
+    return os.getenv(name, default).strip().lower() not in ("0", "false", "no", "")
+
 
 # Конфигурация
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError("DATABASE_URL не задан!")
+def default_config():
+    dotenv_path = os.path.join(os.path.dirname(__file__), "..", ".env")
+    load_dotenv(dotenv_path)
+    return {
+        "SECRET_KEY": os.getenv("FLASK_SECRET", "super-secret-change-me"),
+        "SQLALCHEMY_DATABASE_URI": os.getenv("DATABASE_URL"),
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        "SQLALCHEMY_REPLICA_URIS": [uri.strip() for uri in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if uri.strip()],
+        "REPLICA_STICKY_SECONDS": int(os.getenv("REPLICA_STICKY_SECONDS", 5)),
+        "REPLICA_RETRY_AFTER": int(os.getenv("REPLICA_RETRY_AFTER", 30)),
+        "REPLICA_CHECK_INTERVAL": int(os.getenv("REPLICA_CHECK_INTERVAL", 10)),
+        "REPLICA_MAX_LAG": float(os.getenv("REPLICA_MAX_LAG", 10)),
+        "ASYNC_DATABASE_URL": os.getenv("ASYNC_DATABASE_URL"),
+        "ASYNC_POOL_SIZE": int(os.getenv("ASYNC_POOL_SIZE", 10)),
+        "ASYNC_WSGI_FALLBACK": _env_flag("ASYNC_WSGI_FALLBACK", "0"),
+        "DB_SIMULATED_LATENCY": float(os.getenv("DB_SIMULATED_LATENCY", 0)),
+        "ADMIN_ENABLED": _env_flag("ADMIN_ENABLED", "1"),
+        "ADMIN_ESTIMATED_COUNT_THRESHOLD": int(os.getenv("ADMIN_ESTIMATED_COUNT_THRESHOLD", 100000)),
+        "CATALOG_CACHE_MAX_ITEMS": int(os.getenv("CATALOG_CACHE_MAX_ITEMS", 10000)),
+        "CATALOG_CACHE_TTL": int(os.getenv("CATALOG_CACHE_TTL", 300)),
+        "CATALOG_CACHE_MAX_BYTES": int(os.getenv("CATALOG_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+        "USER_CACHE_TTL": int(os.getenv("USER_CACHE_TTL", 60)),
+        "USER_CACHE_MAX_ITEMS": int(os.getenv("USER_CACHE_MAX_ITEMS", 10000)),
+        "FACET_INDEX_MAX_AGE": int(os.getenv("FACET_INDEX_MAX_AGE", 300)),
+        "SEARCH_INDEX_MAX_AGE": int(os.getenv("SEARCH_INDEX_MAX_AGE", 300)),
+        "HASH_POOL_WORKERS": int(os.getenv("HASH_POOL_WORKERS", 2)),
+        "HASH_POOL_MAX_PENDING": int(os.getenv("HASH_POOL_MAX_PENDING", 8)),
+        "HASH_TIMEOUT": float(os.getenv("HASH_TIMEOUT", 5.0)),
+        "HASH_METHOD": os.getenv("HASH_METHOD", "scrypt"),
+        "CART_BADGE_TTL": int(os.getenv("CART_BADGE_TTL", 60)),
+        "OUTBOX_BATCH_SIZE": int(os.getenv("OUTBOX_BATCH_SIZE", 100)),
+        "OUTBOX_WORKERS": int(os.getenv("OUTBOX_WORKERS", 4)),
+        "OUTBOX_MAX_ATTEMPTS": int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8)),
+        "OUTBOX_LEASE": int(os.getenv("OUTBOX_LEASE", 60)),
+        "OUTBOX_POLL_INTERVAL": float(os.getenv("OUTBOX_POLL_INTERVAL", 1.0)),
+        "OUTBOX_WEBHOOK_URL": os.getenv("OUTBOX_WEBHOOK_URL"),
+        "OUTBOX_WEBHOOK_TIMEOUT": float(os.getenv("OUTBOX_WEBHOOK_TIMEOUT", 10.0)),
+        "OUTBOX_RETENTION_DAYS": int(os.getenv("OUTBOX_RETENTION_DAYS", 7)),
+        "RECOMMENDATIONS_CACHE_SIZE": int(os.getenv("RECOMMENDATIONS_CACHE_SIZE", 10000)),
+        "RECOMMENDATIONS_TTL": int(os.getenv("RECOMMENDATIONS_TTL", 600)),
+        "POPULARITY_FLUSH_INTERVAL": int(os.getenv("POPULARITY_FLUSH_INTERVAL", 5)),
+        "POPULARITY_MAX_PENDING": int(os.getenv("POPULARITY_MAX_PENDING", 1000)),
+        "POPULARITY_HALF_LIFE": int(os.getenv("POPULARITY_HALF_LIFE", 86400)),
+        "POPULARITY_MAX_AGE": int(os.getenv("POPULARITY_MAX_AGE", 600)),
+        "RESERVATION_TTL": int(os.getenv("RESERVATION_TTL", 900)),
+        "RESERVATION_SHARDS": int(os.getenv("RESERVATION_SHARDS", 8)),
+        "RESERVATION_SWEEP_BATCH": int(os.getenv("RESERVATION_SWEEP_BATCH", 1000)),
+        "RESERVATION_SWEEP_INTERVAL": int(os.getenv("RESERVATION_SWEEP_INTERVAL", 5)),
+        "RESERVATION_RESYNC_INTERVAL": int(os.getenv("RESERVATION_RESYNC_INTERVAL", 60)),
+        "ASSETS_URL_PREFIX": os.getenv("ASSETS_URL_PREFIX", "/assets"),
+        "ASSETS_BUILD_PATH": os.getenv("ASSETS_BUILD_PATH"),
+        "USE_X_SENDFILE": _env_flag("USE_X_SENDFILE", "0"),
+        "IMAGE_STORE_PATH": os.getenv("IMAGE_STORE_PATH"),
+        "IMAGE_URL_PREFIX": os.getenv("IMAGE_URL_PREFIX", "/media"),
+        "IMAGE_SIZES": os.getenv("IMAGE_SIZES", "thumb=160,card=480,large=1200"),
+        "IMAGE_FORMATS": os.getenv("IMAGE_FORMATS", "webp,jpeg"),
+        "IMAGE_QUALITY": int(os.getenv("IMAGE_QUALITY", 80)),
+        "IMAGE_DEFAULT_VARIANT": os.getenv("IMAGE_DEFAULT_VARIANT", "card"),
+        "IMAGE_MAX_SOURCE_BYTES": int(os.getenv("IMAGE_MAX_SOURCE_BYTES", 20 * 1024 * 1024)),
+        "RATELIMIT_ENABLED": _env_flag("RATELIMIT_ENABLED", "1"),
+        "RATELIMIT_STORAGE": os.getenv("RATELIMIT_STORAGE"),
+        "RATELIMIT_SLOTS": int(os.getenv("RATELIMIT_SLOTS", 65536)),
+        "RATELIMIT_TRUSTED_PROXIES": int(os.getenv("RATELIMIT_TRUSTED_PROXIES", 0)),
+        "RATELIMIT_LOGIN_IP": os.getenv("RATELIMIT_LOGIN_IP", "20/minute"),
+        "RATELIMIT_LOGIN_ACCOUNT": os.getenv("RATELIMIT_LOGIN_ACCOUNT", "5/minute"),
+        "RATELIMIT_WRITE_IP": os.getenv("RATELIMIT_WRITE_IP", "300/minute"),
+        "RATELIMIT_WRITE_ACCOUNT": os.getenv("RATELIMIT_WRITE_ACCOUNT", "120/minute"),
+        "HTTP_FRAGMENT_CACHE_SIZE": int(os.getenv("HTTP_FRAGMENT_CACHE_SIZE", 0)),
+        "METRICS_SAMPLE_RATE": float(os.getenv("METRICS_SAMPLE_RATE", 1.0)),
+        "METRICS_N_PLUS_ONE_THRESHOLD": int(os.getenv("METRICS_N_PLUS_ONE_THRESHOLD", 5)),
+        "METRICS_TOKEN": os.getenv("METRICS_TOKEN"),
+        "METRICS_ALLOWED_IPS": [ip.strip() for ip in os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",") if ip.strip()],
+    }
 
-app = Flask(__name__)
-app.secret_key = os.getenv("FLASK_SECRET", "super-secret-change-me")
-app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
-# SQLAlchemy + Migrate
-db.init_app(app)
+# Фабрика приложения: на импорте модуля нет ни подключения к базе,
+# ни create_all, ни Flask-Admin
+def create_app(config=None):
+    # статика лежит в app/static, рядом с пакетом web
+    app = Flask(__name__, static_folder=os.path.join("..", "static"))
+    app.config.update(default_config())
+    if config:
+        app.config.update(config)
+    if not app.config.get("SQLALCHEMY_DATABASE_URI"):
+        raise RuntimeError("DATABASE_URL не задан!")
 
-from .models import Users, Roles, Products, Characteristics, ProductCharacteristics, Carts, CartItems, Favorites, Orders, OrderStatuses
+    # SQLAlchemy + Migrate; реплики регистрируются как binds до init_app
+    replica_router.init_app(app)
+    db.init_app(app)
+    migrate.init_app(app, db)
+    sql_metrics.init_app(app)
+    # искусственная задержка базы - только для сравнительных прогонов
+    if app.config["DB_SIMULATED_LATENCY"]:
+        simulate_db_latency(app.config["DB_SIMULATED_LATENCY"])
 
-# Flask-Admin
-class AdminModelView(ModelView):
-    def is_accessible(self):
-        return current_user.is_authenticated
+    # Кэши и индексы каталога
+    catalog_cache.init_app(app)
+    facet_index.init_app(app)
+    product_search.init_app(app)
+    http_cache.init_app(app)
+    cart_service.init_app(app)
+    outbox.init_app(app)
+    recommendations.init_app(app)
+    popularity.init_app(app)
+    reservations.init_app(app)
+    assets.init_app(app)
+    rate_limiter.init_app(app)
 
-    def inaccessible_callback(self, name, **kwargs):
-        return redirect(url_for("login"))
+    # Login
+    login_manager.init_app(app)
+    password_hasher.init_app(app)
+    principal_cache.init_app(app)
 
-with app.app_context():
-    db.create_all()
-    admin = Admin(app, name="Shop Admin")
-    admin.add_view(AdminModelView(Users, db.session))
-    admin.add_view(AdminModelView(Roles, db.session))
-    admin.add_view(AdminModelView(Products, db.session))
-    admin.add_view(AdminModelView(Characteristics, db.session))
-    admin.add_view(AdminModelView(ProductCharacteristics, db.session))
-    admin.add_view(AdminModelView(Carts, db.session))
-    admin.add_view(AdminModelView(CartItems, db.session))
-    admin.add_view(AdminModelView(Favorites, db.session))
-    admin.add_view(AdminModelView(Orders, db.session))
-    admin.add_view(AdminModelView(OrderStatuses, db.session))
-
-migrate = Migrate(app, db)
-
-# Login
-login_manager = LoginManager(app)
-login_manager.login_view = "login"
+    # Flask-Admin подключается только по флагу
+    if app.config["ADMIN_ENABLED"]:
+        from .admin import init_admin
+        init_admin(app)
 
+    # JSON API
+    app.register_blueprint(api)
 
-# UserMixin обертка
-class AuthUser(UserMixin):
-    def __init__(self, user):
-        self.id = str(user.id)
-        self.username = user.username
-        self.email = user.email
-        self.role_name = getattr(user.role, "name", None)
-        self._row = user
+    app.add_url_rule("/", "index", index)
+    app.add_url_rule("/products/<int:product_id>", "product_detail", product_detail)
+    app.add_url_rule("/catalog/filter", "catalog_filter", catalog_filter)
+    app.add_url_rule("/search", "search", search)
+    app.add_url_rule("/login", "login", login, methods=["GET", "POST"])
+    app.add_url_rule("/logout", "logout", logout)
 
+    app.cli.add_command(catalog_cli)
+    app.cli.add_command(outbox_cli)
+    app.cli.add_command(rollups_cli)
+    app.cli.add_command(recommendations_cli)
+    app.cli.add_command(popularity_cli)
+    app.cli.add_command(reservations_cli)
+    app.cli.add_command(retention_cli)
+    app.cli.add_command(plans_cli)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(images_cli)
+    app.cli.add_command(ratelimit_cli)
+    app.cli.add_command(seed_command)
+    app.cli.add_command(loadtest_cli)
+    app.cli.add_command(bench_cli)
+    app.cli.add_command(create_db_command)
+    app.cli.add_command(create_admin_command)
+    return app
+
+
+# Кэш пользователей для load_user
 @login_manager.user_loader
 def load_user(user_id):
-    user = Users.query.get(int(user_id))
-    return AuthUser(user) if user else None
+    return principal_cache.get(user_id)
 
 # Роуты
-@app.route("/")
 def index():
     return render_template("index.html")
 
-@app.route("/login", methods=["GET", "POST"])
+@conditional(product_validator)
+def product_detail(product_id):
+    snapshot = catalog_cache.get(product_id)
+    if snapshot is None:
+        return jsonify(error="Товар не найден"), 404
+    return jsonify(snapshot_to_dict(snapshot))
+
+# Фильтр каталога: /catalog/filter?<characteristic_id>=<value>&...
+@conditional()
+def catalog_filter():
+    filters = {}
+    for key in request.args:
+        if key.isdigit():
+            filters[int(key)] = request.args.getlist(key)
+    limit = min(request.args.get("limit", 50, type=int), 200)
+    offset = max(request.args.get("offset", 0, type=int), 0)
+
+    result = facet_index.search(filters, offset=offset, limit=limit)
+    products = catalog_cache.get_many(result["product_ids"])
+    return jsonify(
+        total=result["total"],
+        products=[snapshot_to_dict(products[pid]) for pid in result["product_ids"] if pid in products],
+        facets={str(cid): values for cid, values in result["facets"].items()},
+    )
+
+@conditional()
+def search():
+    query = request.args.get("q", "").strip()
+    limit = min(request.args.get("limit", 20, type=int), 100)
+    try:
+        after = decode_search_cursor(request.args.get("cursor"))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    ranked = product_search.search(query, after=after, limit=limit)
+    products = catalog_cache.get_many([pid for _, pid in ranked])
+    next_cursor = encode_cursor(ranked[-1]) if len(ranked) == limit else None
+    return jsonify(
+        products=[snapshot_to_dict(products[pid]) for _, pid in ranked if pid in products],
+        next_cursor=next_cursor,
+    )
+
 def login():
     if request.method == "POST":
+        # лимит проверяется до поиска пользователя и хэширования пароля
+        retry_after = rate_limiter.check("login")
+        if retry_after:
+            flash("Слишком много попыток входа, попробуйте позже")
+            return render_template("login.html"), 429, {"Retry-After": str(retry_after)}
+
         email = request.form["email"]
         password = request.form["password"]
 
         user = Users.query.filter_by(email=email).first()
 
-        if user and user.check_password(password):
-            login_user(AuthUser(user))
+        try:
+            valid = user is not None and password_hasher.verify(user.password_hash, password)
+        except HasherBusy:
+            flash("Сервис временно перегружен, попробуйте позже")
+            return render_template("login.html"), 503, {"Retry-After": "1"}
+
+        if valid:
+            # хэш со старыми параметрами пересчитываем прозрачно
+            try:
+                if password_hasher.needs_rehash(user.password_hash):
+                    user.password_hash = password_hasher.hash(password)
+                    db.session.commit()
+            except HasherBusy:
+                pass
+            principal = AuthUser.from_user(user)
+            principal_cache.put(principal)
+            login_user(principal)
             return redirect(url_for("index"))
         else:
             flash("Неверный email или пароль")
     return render_template("login.html")
 
-@app.route("/logout")
 @login_required
 def logout():
     logout_user()
     return redirect(url_for("index"))
 
-# Создание админа (выполнять вручную)
+# Создание админа (flask create-admin)
 def create_admin():
     admin_role = Roles.query.filter_by(name="admin").first()
     if not admin_role:
@@ -116,5 +317,21 @@ def create_admin():
         db.session.commit()
         print(f"Created admin {admin_user.email}")
 
+
+@click.command("create-db")
+@with_appcontext
+def create_db_command():
+    """Создать таблицы по моделям (для локальной разработки; в проде - flask db upgrade)."""
+    db.create_all()
+    click.echo("Таблицы созданы")
+
+
+@click.command("create-admin")
+@with_appcontext
+def create_admin_command():
+    """Создать роль admin и администратора из ADMIN_* переменных окружения."""
+    create_admin()
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), debug=True)
+    create_app().run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), debug=True)
@@ -0,0 +1,178 @@
+# app/web/assets.py
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+assets_cli = AppGroup("assets", help="Сборка статических файлов.")
+
+MANIFEST = "manifest.json"
+IMMUTABLE = "public, max-age=31536000, immutable"
+YEAR = 31536000
+COMPRESSIBLE = (".css", ".js", ".mjs", ".json", ".map", ".svg", ".html", ".txt", ".xml", ".ico")
+# предпочтение при выборе предсжатого варианта
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def write_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp создает 0600, а файлы читает и веб-сервер
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def fingerprint(name, data):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+# =========================
+# Сборка
+# =========================
+# Каждый файл статики копируется под именем с хэшем содержимого и, если
+# сжимается, рядом кладутся .gz и .br. Имя меняется вместе с содержимым,
+# поэтому такие файлы отдаются с immutable и не перепроверяются клиентом.
+# Старые версии не удаляются: их еще могут запрашивать открытые страницы.
+def build_assets(source, output, exclude=(), echo=None):
+    excluded = {os.path.abspath(path) for path in (output, *exclude)}
+    manifest = {}
+    totals = {"files": 0, "bytes": 0, "gzip": 0, "br": 0}
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames[:] = sorted(d for d in dirnames
+                             if os.path.abspath(os.path.join(dirpath, d)) not in excluded)
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            logical = os.path.relpath(path, source).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            name = fingerprint(logical, data)
+            target = os.path.join(output, name)
+            manifest[logical] = name
+            totals["files"] += 1
+            totals["bytes"] += len(data)
+            if os.path.exists(target):
+                continue
+            write_atomic(target, data)
+            if not filename.endswith(COMPRESSIBLE):
+                continue
+            # сжатый вариант нужен, только если он меньше оригинала
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < len(data):
+                write_atomic(target + ".gz", compressed)
+                totals["gzip"] += len(compressed)
+            if brotli is not None:
+                compressed = brotli.compress(data, quality=11)
+                if len(compressed) < len(data):
+                    write_atomic(target + ".br", compressed)
+                    totals["br"] += len(compressed)
+            if echo is not None:
+                echo(f"  {logical} -> {name}")
+    write_atomic(os.path.join(output, MANIFEST),
+                 json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest, totals
+
+
+# =========================
+# Отдача
+# =========================
+# Файл отдается send_from_directory: под gunicorn/uwsgi это wsgi.file_wrapper
+# и sendfile без копирования через Python, с USE_X_SENDFILE - заголовок
+# X-Sendfile для nginx/apache.
+def send_immutable(directory, filename):
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    response = None
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] <= 0:
+            continue
+        path = safe_join(directory, filename + suffix)
+        if path is not None and os.path.isfile(path):
+            response = send_from_directory(directory, filename + suffix,
+                                           mimetype=mimetype, max_age=YEAR)
+            response.headers["Content-Encoding"] = encoding
+            break
+    if response is None:
+        response = send_from_directory(directory, filename, mimetype=mimetype, max_age=YEAR)
+    response.headers["Cache-Control"] = IMMUTABLE
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+class Assets:
+    def __init__(self, url_prefix="/assets", media_prefix="/media"):
+        self.url_prefix = url_prefix
+        self.media_prefix = media_prefix
+        self.build_path = None
+        self.media_path = None
+        self.manifest = {}
+
+    def init_app(self, app):
+        self.url_prefix = app.config.get("ASSETS_URL_PREFIX", self.url_prefix)
+        self.media_prefix = app.config.get("IMAGE_URL_PREFIX", self.media_prefix)
+        self.build_path = app.config.get("ASSETS_BUILD_PATH") or os.path.join(app.static_folder, "dist")
+        self.media_path = app.config.get("IMAGE_STORE_PATH") or os.path.join(app.static_folder, "media")
+        self.load_manifest()
+        app.extensions["assets"] = self
+        app.add_url_rule(f"{self.url_prefix}/<path:filename>", "assets", self.serve_asset)
+        app.add_url_rule(f"{self.media_prefix}/<path:filename>", "media", self.serve_media)
+        app.add_template_global(self.url, "asset_url")
+
+    def load_manifest(self):
+        path = os.path.join(self.build_path, MANIFEST)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {}
+
+    # {{ asset_url("css/style.css") }}; до сборки - обычный /static
+    def url(self, filename):
+        name = self.manifest.get(filename)
+        if name is None:
+            return url_for("static", filename=filename)
+        return f"{self.url_prefix}/{name}"
+
+    def serve_asset(self, filename):
+        return send_immutable(self.build_path, filename)
+
+    # производные изображений адресуются хэшем содержимого - тоже immutable
+    def serve_media(self, filename):
+        return send_immutable(self.media_path, filename)
+
+
+# =========================
+# Команды
+# =========================
+@assets_cli.command("build")
+@click.option("--verbose", is_flag=True, help="Печатать каждый собранный файл.")
+def build_command(verbose):
+    """Собрать статику: имена с хэшем, предсжатые .gz/.br, manifest.json."""
+    assets = current_app.extensions["assets"]
+    if brotli is None:
+        click.echo("Пакет brotli не установлен, собираются только .gz")
+    manifest, totals = build_assets(current_app.static_folder, assets.build_path,
+                                    exclude=(assets.media_path,),
+                                    echo=click.echo if verbose else None)
+    assets.manifest = manifest
+    click.echo(f"Файлов: {totals['files']}, {totals['bytes']} байт; новых сжатых: "
+               f"gzip {totals['gzip']} байт, br {totals['br']} байт -> {assets.build_path}")
@@ -0,0 +1,390 @@
+# app/web/async_catalog.py
+import asyncio
+import datetime
+import decimal
+import json
+import logging
+import re
+import time
+import uuid
+from urllib.parse import parse_qs
+
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import make_url
+from werkzeug.http import http_date, parse_etags, quote_etag
+
+from .models import Products, Characteristics, ProductCharacteristics
+from .catalog_cache import PRODUCT_FIELDS, snapshot_to_dict
+from .http_cache import UPDATED_AT, body_etag, version_etag
+from .pagination import encode_cursor
+from .search import PG_SEARCH_SQL, InvertedIndex, decode_search_cursor, tokenize
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:  # нужен greenlet
+    create_async_engine = None
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+PRODUCT_RE = re.compile(r"^/products/(\d+)$")
+
+
+def async_database_url(url):
+    url = make_url(url)
+    if url.get_dialect().is_async:
+        return url
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise RuntimeError(f"Нет асинхронного драйвера для {url.get_backend_name()}")
+    return url.set(drivername=driver)
+
+
+# =========================
+# JSON как у Flask
+# =========================
+def _default(value):
+    if isinstance(value, datetime.date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# байт в байт как jsonify (DefaultJSONProvider без DEBUG): ключи
+# отсортированы, без пробелов, \u-экранирование и перевод строки в конце -
+# иначе ETag по телу у фильтра и поиска не совпадет с синхронным
+def _json(status, payload):
+    body = json.dumps(payload, default=_default, ensure_ascii=True, sort_keys=True,
+                      separators=(",", ":")) + "\n"
+    return status, body.encode(), []
+
+
+# =========================
+# Условные ответы как в http_cache
+# =========================
+# ETag и Last-Modified те же, что у синхронных маршрутов: клиент получает
+# 304 независимо от того, какой процесс ему ответил.
+def _finish(response, etag, etags, last_modified=None):
+    status, body, headers = response
+    headers = headers + [(b"etag", quote_etag(etag).encode()), (b"cache-control", b"no-cache")]
+    if last_modified is not None:
+        headers.append((b"last-modified", http_date(last_modified).encode()))
+    if etags.contains(etag):
+        return 304, b"", headers
+    return status, body, headers
+
+
+# ETag по готовому телу - для фильтра и поиска
+def _conditional_body(response, etags):
+    if response[0] != 200:
+        return response
+    return _finish(response, body_etag(response[1]), etags)
+
+
+# =========================
+# Асинхронный каталог
+# =========================
+# Отдельное ASGI-приложение для чтения каталога: товар, фильтр и поиск.
+# Ответы совпадают с синхронными маршрутами, но ожидание базы не занимает
+# поток: независимые запросы идут параллельно (asyncio.gather), каждый на
+# своем соединении из пула. Остальные маршруты обслуживает Flask - через
+# asgiref в этом же процессе либо отдельным WSGI-сервером за прокси.
+class AsyncCatalog:
+    def __init__(self, database_url, pool_size=10, simulated_latency=0.0,
+                 search_max_age=300, fallback=None):
+        if create_async_engine is None:
+            raise RuntimeError("Для асинхронного режима нужен пакет greenlet")
+        self.database_url = async_database_url(database_url)
+        self.pool_size = pool_size
+        self.simulated_latency = simulated_latency
+        self.search_max_age = search_max_age
+        self.fallback = fallback
+        self.engine = None
+        self._index = None
+        self._index_built_at = 0.0
+        self._index_lock = None
+
+    @property
+    def postgres(self):
+        return self.database_url.get_backend_name() == "postgresql"
+
+    # движок создается внутри цикла событий, в котором будет работать
+    async def startup(self):
+        options = {"pool_size": self.pool_size, "max_overflow": self.pool_size} if self.postgres else {}
+        self.engine = create_async_engine(self.database_url, **options)
+        self._index_lock = asyncio.Lock()
+
+    async def shutdown(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+
+    async def _fetch(self, statement, params=None):
+        if self.simulated_latency:
+            await asyncio.sleep(self.simulated_latency)
+        async with self.engine.connect() as connection:
+            result = await connection.execute(statement, params or {})
+            return result.all()
+
+    # ---------- ASGI ----------
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        handler, args = self._route(scope)
+        if handler is None:
+            if self.fallback is not None:
+                await self.fallback(scope, receive, send)
+                return
+            status, body, headers = _json(404, {"error": "Не найдено"})
+        else:
+            if self.engine is None:
+                await self.startup()
+            etags = parse_etags(_header(scope, b"if-none-match"))
+            try:
+                status, body, headers = await handler(*args, etags)
+            except Exception:
+                logger.exception("Ошибка асинхронного каталога: %s", scope["path"])
+                status, body, headers = _json(500, {"error": "Внутренняя ошибка"})
+        if status != 304:
+            headers = [(b"content-type", b"application/json"),
+                       (b"content-length", str(len(body)).encode())] + headers
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        # на HEAD - только заголовки, Content-Length как у GET
+        await send({"type": "http.response.body",
+                    "body": b"" if scope["method"] == "HEAD" else body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _route(self, scope):
+        if scope["method"] not in ("GET", "HEAD"):
+            return None, ()
+        path = scope["path"]
+        args = parse_qs(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+        match = PRODUCT_RE.match(path)
+        if match:
+            return self.product_detail, (int(match.group(1)), args)
+        if path == "/catalog/filter":
+            return self.catalog_filter, (args,)
+        if path == "/search":
+            return self.search, (args,)
+        return None, ()
+
+    # ---------- Товары ----------
+    def _characteristics_query(self, product_ids):
+        return (
+            select(ProductCharacteristics.product_id, Characteristics.id,
+                   Characteristics.name, ProductCharacteristics.value)
+            .join(Characteristics, Characteristics.id == ProductCharacteristics.characteristic_id)
+            .where(ProductCharacteristics.product_id.in_(product_ids))
+            .order_by(ProductCharacteristics.product_id, ProductCharacteristics.id)
+        )
+
+    def _products_query(self, product_ids):
+        columns = [getattr(Products, field) for field in PRODUCT_FIELDS]
+        return select(*columns).where(Products.id.in_(product_ids))
+
+    @staticmethod
+    def _snapshots(rows, char_rows):
+        characteristics = {row.id: [] for row in rows}
+        for product_id, char_id, name, value in char_rows:
+            if product_id in characteristics:
+                characteristics[product_id].append((char_id, name, value))
+        return {row.id: tuple(row) + (tuple(characteristics[row.id]),) for row in rows}
+
+    async def load_products(self, product_ids):
+        if not product_ids:
+            return {}
+        rows, char_rows = await asyncio.gather(
+            self._fetch(self._products_query(product_ids)),
+            self._fetch(self._characteristics_query(product_ids)),
+        )
+        return self._snapshots(rows, char_rows)
+
+    # Как product_validator: версия - (id, updated_at), 304 отдается по
+    # одному запросу updated_at, без загрузки товара и характеристик
+    async def product_detail(self, product_id, args, etags):
+        updated = await self._fetch(select(Products.updated_at).where(Products.id == product_id))
+        if updated and etags:
+            updated_at = updated[0][0]
+            etag = version_etag("product_detail", _items(args), (product_id, updated_at))
+            if etags.contains(etag):
+                return _finish((304, b"", []), etag, etags, updated_at)
+        rows, char_rows = await asyncio.gather(
+            self._fetch(self._products_query([product_id])),
+            self._fetch(self._characteristics_query([product_id])),
+        )
+        if not rows:
+            return _json(404, {"error": "Товар не найден"})
+        snapshot = self._snapshots(rows, char_rows)[product_id]
+        # версия в ETag - та, из которой собрано тело
+        updated_at = snapshot[UPDATED_AT]
+        etag = version_etag("product_detail", _items(args), (product_id, updated_at))
+        return _finish(_json(200, snapshot_to_dict(snapshot)), etag, etags, updated_at)
+
+    # ---------- Фильтр ----------
+    # Та же семантика, что у FacetIndex.search, но в SQL: значения одной
+    # характеристики - ИЛИ, разных - И; счетчики фасета без его фильтра.
+    @staticmethod
+    def _matching(filters, skip=None):
+        query = select(Products.id).where(Products.is_active.isnot(False))
+        for characteristic_id, values in filters.items():
+            if characteristic_id != skip:
+                query = query.where(Products.id.in_(
+                    select(ProductCharacteristics.product_id)
+                    .where(ProductCharacteristics.characteristic_id == characteristic_id,
+                           ProductCharacteristics.value.in_(values))
+                ))
+        return query
+
+    @staticmethod
+    def _facet_counts(matching, characteristic_filter):
+        return (
+            select(ProductCharacteristics.characteristic_id, ProductCharacteristics.value,
+                   func.count(ProductCharacteristics.product_id.distinct()))
+            .where(ProductCharacteristics.product_id.in_(matching), characteristic_filter)
+            .group_by(ProductCharacteristics.characteristic_id, ProductCharacteristics.value)
+        )
+
+    async def catalog_filter(self, args, etags):
+        filters = {int(key): values for key, values in args.items() if key.isdigit()}
+        limit = min(_int_arg(args, "limit", 50), 200)
+        offset = max(_int_arg(args, "offset", 0), 0)
+
+        matching = self._matching(filters)
+        queries = [
+            self._fetch(select(func.count()).select_from(matching.subquery())),
+            self._fetch(matching.order_by(Products.id).offset(offset).limit(limit)),
+            self._fetch(self._facet_counts(
+                matching, ProductCharacteristics.characteristic_id.notin_(list(filters)))),
+        ]
+        for characteristic_id in filters:
+            queries.append(self._fetch(self._facet_counts(
+                self._matching(filters, skip=characteristic_id),
+                ProductCharacteristics.characteristic_id == characteristic_id)))
+        total_rows, id_rows, *facet_rows = await asyncio.gather(*queries)
+
+        product_ids = [row[0] for row in id_rows]
+        products = await self.load_products(product_ids)
+        facets = {}
+        for rows in facet_rows:
+            for characteristic_id, value, count in rows:
+                facets.setdefault(str(characteristic_id), {})[value] = count
+        return _conditional_body(_json(200, {
+            "total": total_rows[0][0],
+            "products": [snapshot_to_dict(products[pid]) for pid in product_ids if pid in products],
+            "facets": facets,
+        }), etags)
+
+    # ---------- Поиск ----------
+    async def _ensure_index(self):
+        async with self._index_lock:
+            if self._index is not None and time.monotonic() - self._index_built_at <= self.search_max_age:
+                return self._index
+            rows = await self._fetch(
+                select(Products.id, Products.name, Products.description)
+                .where(Products.is_active.isnot(False))
+            )
+            index = InvertedIndex()
+            for product_id, name, description in rows:
+                index.add(product_id, name, description)
+            self._index = index
+            self._index_built_at = time.monotonic()
+            return index
+
+    async def search(self, args, etags):
+        query = (args.get("q") or [""])[0].strip()
+        limit = min(_int_arg(args, "limit", 20), 100)
+        try:
+            after = decode_search_cursor((args.get("cursor") or [None])[0])
+        except ValueError as e:
+            return _json(400, {"error": str(e)})
+
+        tokens = tokenize(query)
+        ranked = []
+        if tokens and self.postgres:
+            after_score, after_id = after if after else (None, None)
+            rows = await self._fetch(text(PG_SEARCH_SQL), {
+                "tsquery": " & ".join(token + ":*" for token in tokens),
+                "raw": query,
+                "after_score": after_score,
+                "after_id": after_id,
+                "limit": limit,
+            })
+            ranked = [(row.score, row.id) for row in rows]
+        elif tokens:
+            ranked = (await self._ensure_index()).search(query)
+            if after:
+                ranked = [item for item in ranked if item < tuple(after)]
+            ranked = ranked[:limit]
+
+        products = await self.load_products([pid for _, pid in ranked])
+        next_cursor = encode_cursor(ranked[-1]) if len(ranked) == limit else None
+        return _conditional_body(_json(200, {
+            "products": [snapshot_to_dict(products[pid]) for _, pid in ranked if pid in products],
+            "next_cursor": next_cursor,
+        }), etags)
+
+
+def _header(scope, name):
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+# параметры запроса парами, как request.args.items(multi=True)
+def _items(args):
+    return [(key, value) for key, values in args.items() for value in values]
+
+
+def _int_arg(args, name, default):
+    try:
+        return int(args[name][0])
+    except (KeyError, IndexError, ValueError):
+        return default
+
+
+# =========================
+# Фабрика
+# =========================
+# uvicorn app.asgi:app - рядом с WSGI-процессами (app/wsgi.py). С asgiref
+# и ASYNC_WSGI_FALLBACK остальные маршруты Flask отдаются из этого же
+# процесса, иначе их направляет на WSGI обратный прокси.
+def create_asgi_app(config=None):
+    from .app import create_app, default_config
+
+    settings = default_config()
+    if config:
+        settings.update(config)
+    url = settings.get("ASYNC_DATABASE_URL") or settings.get("SQLALCHEMY_DATABASE_URI")
+    if not url:
+        raise RuntimeError("DATABASE_URL не задан!")
+    fallback = None
+    if settings.get("ASYNC_WSGI_FALLBACK"):
+        if WsgiToAsgi is None:
+            raise RuntimeError("ASYNC_WSGI_FALLBACK требует пакет asgiref")
+        fallback = WsgiToAsgi(create_app(config))
+    return AsyncCatalog(url, pool_size=settings.get("ASYNC_POOL_SIZE", 10),
+                        simulated_latency=settings.get("DB_SIMULATED_LATENCY", 0.0),
+                        search_max_age=settings.get("SEARCH_INDEX_MAX_AGE", 300),
+                        fallback=fallback)
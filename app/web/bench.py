@@ -0,0 +1,468 @@
+# app/web/bench.py
+import csv
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import Engine
+
+from .models import (db, Roles, Users, Products, ProductCharacteristics, Carts, CartItems,
+                     Orders)
+from .carts import active_cart_id
+from .checkout import checkout, OutOfStock
+from .catalog_import import PRODUCT_COLUMNS, import_catalog
+from .seed import DEFAULT_PASSWORD, SEED_EMAIL_DOMAIN, seed_dataset
+
+
+bench_cli = AppGroup("bench", help="Бенчмарки подсистем (не на проде).")
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def _report(name, latencies):
+    click.echo(f"{name:<24} n={len(latencies):<6} "
+               f"p50={statistics.median(latencies) * 1000:8.2f} мс  "
+               f"p95={_percentile(latencies, 0.95) * 1000:8.2f} мс  "
+               f"p99={_percentile(latencies, 0.99) * 1000:8.2f} мс")
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, "before_cursor_execute", self._on_execute)
+
+
+def _seed(products=0, users=0):
+    if not (products or users):
+        return
+    started = time.monotonic()
+    # избранное и корзины ссылаются на товары этого же засева
+    counts = seed_dataset(users=users, products=products or max(users // 2, 1), seed=1)
+    click.echo(f"Засеяно за {time.monotonic() - started:.1f} с: "
+               + ", ".join(f"{key}={value}" for key, value in counts.items()))
+
+
+# =========================
+# Фасеты
+# =========================
+# Тот же ответ, что у FacetIndex.search, чистым SQL по EAV: по подзапросу
+# на каждую характеристику фильтра и группировка для счетчиков.
+def sql_facet_search(filters, offset=0, limit=50):
+    pc = ProductCharacteristics
+
+    def matching(exclude=None):
+        query = select(Products.id).where(Products.is_active.isnot(False))
+        for characteristic_id, values in filters.items():
+            if characteristic_id != exclude:
+                query = query.where(Products.id.in_(
+                    select(pc.product_id)
+                    .where(pc.characteristic_id == characteristic_id, pc.value.in_(values))
+                ))
+        return query
+
+    def counts(product_ids, characteristic_filter):
+        return db.session.execute(
+            select(pc.characteristic_id, pc.value, func.count(pc.product_id.distinct()))
+            .where(pc.product_id.in_(product_ids), characteristic_filter)
+            .group_by(pc.characteristic_id, pc.value)
+        ).all()
+
+    result = matching()
+    total = db.session.execute(select(func.count()).select_from(result.subquery())).scalar()
+    product_ids = db.session.execute(
+        result.order_by(Products.id).offset(offset).limit(limit)
+    ).scalars().all()
+    rows = counts(result, pc.characteristic_id.notin_(list(filters)) if filters else True)
+    for characteristic_id in filters:
+        rows += counts(matching(exclude=characteristic_id), pc.characteristic_id == characteristic_id)
+    facets = {}
+    for characteristic_id, value, count in rows:
+        facets.setdefault(characteristic_id, {})[value] = count
+    return {"total": total, "product_ids": product_ids, "facets": facets}
+
+
+@bench_cli.command("facets")
+@click.option("--seed", "seed_products", type=int, default=0,
+              help="Сначала засеять N товаров, например 500000 (только не в проде).")
+@click.option("--queries", default=200, show_default=True)
+@click.option("--characteristics", default=2, show_default=True, help="Характеристик в фильтре.")
+def facets_command(seed_products, queries, characteristics):
+    """Фильтр каталога: индекс FacetIndex против SQL по EAV."""
+    _seed(products=seed_products)
+    index = current_app.extensions["facet_index"]
+    started = time.monotonic()
+    index.build()
+    click.echo(f"Товаров: {db.session.execute(select(func.count(Products.id))).scalar()}, "
+               f"построение индекса: {time.monotonic() - started:.2f} с")
+
+    values = {}
+    for characteristic_id, value in db.session.execute(
+            select(ProductCharacteristics.characteristic_id, ProductCharacteristics.value).distinct()):
+        values.setdefault(characteristic_id, []).append(value)
+    if not values:
+        raise click.ClickException("Нет характеристик: запустите с --seed")
+    rng = random.Random(1)
+    workload = []
+    for _ in range(queries):
+        chosen = rng.sample(sorted(values), min(characteristics, len(values)))
+        workload.append({cid: rng.sample(values[cid], min(2, len(values[cid]))) for cid in chosen})
+
+    timings = {"index": [], "sql": []}
+    mismatches = 0
+    for filters in workload:
+        started = time.perf_counter()
+        expected = index.search(filters)
+        timings["index"].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        actual = sql_facet_search(filters)
+        timings["sql"].append(time.perf_counter() - started)
+        if (expected["total"], expected["product_ids"], expected["facets"]) != \
+                (actual["total"], actual["product_ids"], actual["facets"]):
+            mismatches += 1
+    _report("facet index", timings["index"])
+    _report("sql", timings["sql"])
+    click.echo(f"Ускорение по медиане: "
+               f"{statistics.median(timings['sql']) / statistics.median(timings['index']):.1f}x")
+    if mismatches:
+        raise click.ClickException(f"Ответы индекса и SQL разошлись: {mismatches} из {queries}")
+
+
+# =========================
+# Кэш пользователей
+# =========================
+# load_user на каждом запросе: прежний путь через ORM (строка пользователя
+# плюс ленивая загрузка роли) против PrincipalCache, холодного и теплого.
+@bench_cli.command("principals")
+@click.option("--seed", "seed_users", type=int, default=0,
+              help="Сначала засеять N пользователей (только не в проде).")
+@click.option("--users", default=1000, show_default=True, help="Разных пользователей в прогоне.")
+@click.option("--rounds", default=5, show_default=True, help="Теплых проходов по тем же пользователям.")
+def principals_command(seed_users, users, rounds):
+    """Запросов к базе и время load_user: ORM, холодный и теплый кэш."""
+    _seed(users=seed_users)
+    cache = current_app.extensions["principal_cache"]
+    user_ids = db.session.execute(select(Users.id).order_by(Users.id).limit(users)).scalars().all()
+    if not user_ids:
+        raise click.ClickException("Нет пользователей: запустите с --seed")
+
+    def orm_load(user_id):
+        user = db.session.get(Users, user_id)
+        name = getattr(user.role, "name", None)
+        # как в конце запроса: сессия закрывается, identity map пуста
+        db.session.expunge_all()
+        return name
+
+    def run(name, load, passes=1):
+        with QueryCounter() as counter:
+            started = time.perf_counter()
+            for _ in range(passes):
+                for user_id in user_ids:
+                    load(user_id)
+            elapsed = time.perf_counter() - started
+        loads = len(user_ids) * passes
+        click.echo(f"{name:<12} запросов на load_user: {counter.count / loads:.2f}, "
+                   f"{elapsed / loads * 1e6:.1f} мкс")
+        return counter.count
+
+    run("orm", orm_load)
+    cache.clear()
+    run("cache cold", cache.get)
+    warm = run("cache warm", cache.get, passes=rounds)
+    if warm:
+        raise click.ClickException(f"Теплый кэш ходил в базу: {warm} запросов")
+
+
+# =========================
+# Оформление заказа
+# =========================
+# Горячий товар с ограниченным остатком, buyers потоков покупают его по
+# одной штуке, пока не кончится. Это и нагрузочная проверка: в конце
+# сверяется, что продано ровно столько, сколько было, и что остаток не
+# ушел в минус; иначе команда завершается с ошибкой.
+@bench_cli.command("checkout")
+@click.option("--buyers", default=64, show_default=True, help="Параллельных покупателей.")
+@click.option("--stock", default=2000, show_default=True, help="Остаток горячего товара.")
+@click.option("--quantity", default=1, show_default=True, help="Штук в одном заказе.")
+def checkout_command(buyers, stock, quantity):
+    """Оформление заказов на один горячий товар: заказов/с и проверка на перепродажу."""
+    app = current_app._get_current_object()
+    now = datetime.datetime.utcnow()
+    role = db.session.execute(select(Roles).where(Roles.name == "user")).scalar()
+    if role is None:
+        role = Roles(name="user")
+        db.session.add(role)
+    product = Products(name="Горячий товар (бенчмарк)", price=100, stock=stock, created_at=now)
+    db.session.add(product)
+    db.session.flush()
+    stamp = f"{product.id}-{int(time.time())}"
+    users = [Users(username=f"buyer{n}", email=f"buyer{n}-{stamp}@bench.test",
+                   password_hash="!", role=role) for n in range(buyers)]
+    db.session.add_all(users)
+    db.session.commit()
+    product_id = product.id
+    user_ids = [user.id for user in users]
+
+    latencies, results, lock = [], {"orders": 0, "sold_out": 0, "errors": 0}, threading.Lock()
+    start = threading.Barrier(buyers)
+
+    def buyer(user_id):
+        with app.app_context():
+            start.wait()
+            while True:
+                # новая корзина с одной строкой, как после добавления в корзину
+                cart_id = active_cart_id(user_id, create=True)
+                db.session.add(CartItems(cart_id=cart_id, product_id=product_id, quantity=quantity))
+                db.session.commit()
+                started = time.perf_counter()
+                try:
+                    checkout(user_id)
+                except OutOfStock:
+                    outcome = "sold_out"
+                except Exception:
+                    db.session.rollback()
+                    outcome = "errors"
+                else:
+                    outcome = "orders"
+                with lock:
+                    results[outcome] += 1
+                    if outcome == "orders":
+                        latencies.append(time.perf_counter() - started)
+                if outcome == "sold_out":
+                    # неоформленная корзина не должна мешать следующему прогону
+                    db.session.execute(Carts.__table__.update()
+                                       .where(Carts.__table__.c.id == cart_id).values(is_active=False))
+                    db.session.commit()
+                    return
+                if outcome == "errors" and results["errors"] > buyers * 10:
+                    return
+
+    threads = [threading.Thread(target=buyer, args=(user_id,)) for user_id in user_ids]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    db.session.expire_all()
+    left = db.session.execute(select(Products.stock).where(Products.id == product_id)).scalar()
+    ordered = db.session.execute(
+        select(func.coalesce(func.sum(CartItems.quantity), 0))
+        .join(Orders, Orders.cart_id == CartItems.cart_id)
+        .where(CartItems.product_id == product_id)
+    ).scalar()
+    click.echo(f"Покупателей: {buyers}, заказов: {results['orders']}, отказов 'нет на складе': "
+               f"{results['sold_out']}, ошибок: {results['errors']}")
+    click.echo(f"{results['orders'] / elapsed:.1f} заказов/с за {elapsed:.2f} с")
+    if latencies:
+        _report("checkout", latencies)
+    failures = []
+    if left < 0:
+        failures.append(f"остаток ушел в минус: {left}")
+    if ordered != stock - left:
+        failures.append(f"в заказах {ordered} шт., а остаток уменьшился на {stock - left}")
+    if results["orders"] * quantity != ordered:
+        failures.append(f"успешных оформлений {results['orders']}, а заказано {ordered} шт.")
+    if left >= quantity and results["sold_out"]:
+        failures.append(f"отказ 'нет на складе' при остатке {left}")
+    if failures:
+        raise click.ClickException("Перепродажа или потеря заказов: " + "; ".join(failures))
+    click.echo(f"Перепродажи нет: продано {ordered} из {stock}, остаток {left}")
+
+
+# =========================
+# Импорт каталога
+# =========================
+def _write_feed(path, fmt, first_id, rows, characteristics, rng):
+    names = [f"Параметр {n}" for n in range(characteristics)]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer is not None:
+            writer.writerow(PRODUCT_COLUMNS + tuple(names))
+        for product_id in range(first_id, first_id + rows):
+            product = {"id": product_id, "name": f"Импорт {product_id}",
+                       "price": f"{rng.lognormvariate(7, 1):.2f}", "stock": rng.randrange(500),
+                       "description": f"Описание {product_id}", "image_url": None, "is_active": True}
+            chars = {name: str(rng.randrange(12)) for name in names}
+            if writer is not None:
+                writer.writerow([product[key] for key in PRODUCT_COLUMNS] + [chars[n] for n in names])
+            else:
+                f.write(json.dumps(dict(product, characteristics=chars), ensure_ascii=False) + "\n")
+
+
+# Синтетический фид пишется во временный файл и грузится командой
+# catalog import дважды: первый проход вставляет новые товары, второй -
+# тот же фид поверх, т.е. обновление существующих.
+@bench_cli.command("import")
+@click.option("--rows", default=100000, show_default=True, help="Товаров в фиде.")
+@click.option("--characteristics", default=8, show_default=True, help="Характеристик у товара.")
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), default="csv", show_default=True)
+@click.option("--batch-size", default=5000, show_default=True)
+@click.pass_context
+def import_command(ctx, rows, characteristics, fmt, batch_size):
+    """Импорт каталога: строк/с на вставке и на повторном upsert."""
+    first_id = (db.session.execute(select(func.max(Products.id))).scalar() or 0) + 1
+    db.session.rollback()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"feed.{fmt}")
+        _write_feed(path, fmt, first_id, rows, characteristics, random.Random(1))
+        click.echo(f"Фид: {rows} товаров, {os.path.getsize(path) / 1e6:.1f} МБ")
+        for label in ("вставка", "обновление"):
+            started = time.perf_counter()
+            ctx.invoke(import_catalog, source=path, fmt=fmt, batch_size=batch_size, checkpoint=None)
+            results.append((label, time.perf_counter() - started))
+    for label, elapsed in results:
+        click.echo(f"{label:<12} {rows / elapsed:10.0f} товаров/с  "
+                   f"{rows * (1 + characteristics) / elapsed:10.0f} строк/с  ({elapsed:.1f} с)")
+
+
+# =========================
+# Холодный старт
+# =========================
+# Каждый замер - отдельный интерпретатор: в этом процессе модули уже
+# импортированы. Время делится на импорт пакета и create_app().
+COLD_START_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from app.web.app import create_app
+imported = time.perf_counter()
+create_app()
+created = time.perf_counter()
+print(json.dumps({"import": imported - started, "create_app": created - imported,
+                  "modules": len(sys.modules), "flask_admin": "flask_admin" in sys.modules}))
+"""
+
+
+@bench_cli.command("cold-start")
+@click.option("--runs", default=5, show_default=True)
+@click.option("--output", type=click.Path(dir_okay=False), default=None,
+              help="Дописать результаты JSON-строкой в файл.")
+def cold_start_command(runs, output):
+    """Холодный старт процесса с Flask-Admin и без него."""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    results = {}
+    for enabled in ("1", "0"):
+        env = dict(os.environ, ADMIN_ENABLED=enabled,
+                   PYTHONPATH=os.pathsep.join(filter(None, (root, os.environ.get("PYTHONPATH")))))
+        samples = []
+        for _ in range(runs):
+            completed = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], env=env, cwd=root,
+                                       capture_output=True, text=True)
+            if completed.returncode:
+                raise click.ClickException(completed.stderr.strip().splitlines()[-1])
+            samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        label = "admin" if enabled == "1" else "no_admin"
+        results[label] = {
+            "import_ms": statistics.median(s["import"] for s in samples) * 1000,
+            "create_app_ms": statistics.median(s["create_app"] for s in samples) * 1000,
+            "modules": samples[-1]["modules"],
+            "flask_admin": samples[-1]["flask_admin"],
+        }
+        row = results[label]
+        click.echo(f"ADMIN_ENABLED={enabled}: импорт {row['import_ms']:7.1f} мс  "
+                   f"create_app {row['create_app_ms']:7.1f} мс  "
+                   f"итого {row['import_ms'] + row['create_app_ms']:7.1f} мс  "
+                   f"модулей {row['modules']}  flask_admin={row['flask_admin']}  (медиана {runs})")
+    if output:
+        record = dict(results, at=datetime.datetime.utcnow().isoformat(timespec="seconds"))
+        with open(output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        click.echo(f"Записано в {output}")
+
+
+# =========================
+# Вход под нагрузкой
+# =========================
+# Читатели крутят легкие роуты каталога, сначала одни, потом вместе с
+# потоками, которые непрерывно входят под засеянными пользователями.
+# Хэширование идет в пуле процессов, поэтому p99 чтения не должен
+# заметно расти от логинов. Ограничитель частоты на время замера выключен.
+LOGIN_BENCH_ROUTES = ("/api/products?limit=20", "/catalog/filter?limit=20")
+
+
+def _read_loop(app, stop, latencies):
+    client = app.test_client()
+    n = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        client.get(LOGIN_BENCH_ROUTES[n % len(LOGIN_BENCH_ROUTES)])
+        latencies.append(time.perf_counter() - started)
+        n += 1
+
+
+def _login_loop(app, stop, emails, statuses, rng):
+    client = app.test_client()
+    while not stop.is_set():
+        response = client.post("/login", data={"email": rng.choice(emails), "password": DEFAULT_PASSWORD})
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        client.get("/logout")
+
+
+def _run_phase(app, readers, logins, duration, emails):
+    stop = threading.Event()
+    latencies, statuses = [], {}
+    threads = [threading.Thread(target=_read_loop, args=(app, stop, latencies)) for _ in range(readers)]
+    threads += [threading.Thread(target=_login_loop, args=(app, stop, emails, statuses, random.Random(n)))
+                for n in range(logins)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+
+@bench_cli.command("login")
+@click.option("--seed", "seed_users", default=0, show_default=True, help="Сначала засеять пользователей.")
+@click.option("--readers", default=4, show_default=True)
+@click.option("--logins", default=8, show_default=True, help="Потоков входа.")
+@click.option("--duration", default=10.0, show_default=True, help="Секунд на фазу.")
+def login_command(seed_users, readers, logins, duration):
+    """p99 чтения каталога без входов и на фоне непрерывных входов."""
+    _seed(users=seed_users)
+    emails = db.session.execute(
+        select(Users.email).where(Users.email.like(f"%@{SEED_EMAIL_DOMAIN}")).limit(1000)
+    ).scalars().all()
+    db.session.rollback()
+    if not emails:
+        raise click.ClickException("Нет засеянных пользователей: запустите с --seed N")
+    app = current_app._get_current_object()
+    limiter = app.extensions["rate_limiter"]
+    enabled, limiter.enabled = limiter.enabled, False
+    try:
+        # прогрев: кэши каталога и процессы пула хэширования
+        _run_phase(app, readers, 1, 1.0, emails)
+        latencies, _ = _run_phase(app, readers, 0, duration, emails)
+        _report("чтение без входов", latencies)
+        latencies, statuses = _run_phase(app, readers, logins, duration, emails)
+        _report("чтение на фоне входов", latencies)
+    finally:
+        limiter.enabled = enabled
+    total = sum(statuses.values())
+    click.echo(f"Входов: {total / duration:.1f}/с, ответы: "
+               + ", ".join(f"{code}={count}" for code, count in sorted(statuses.items())))
@@ -0,0 +1,246 @@
+# app/web/carts.py
+import datetime
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import delete, event, func, literal_column, select, true, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import db, Products, Carts, CartItems
+
+
+class CartError(Exception):
+    pass
+
+
+class NotEnoughStock(CartError):
+    pass
+
+
+class InvalidQuantity(CartError):
+    pass
+
+
+# потолок количества одной строки; без него сумма повторных добавлений
+# переполняет integer в базе
+MAX_QUANTITY = 999
+
+
+def _insert():
+    return postgresql.insert if db.engine.dialect.name == "postgresql" else sqlite.insert
+
+
+# =========================
+# Сводка корзины
+# =========================
+# Строки, подытоги, количество и общая сумма - одним запросом: итоги
+# считаются оконными функциями поверх тех же строк.
+def cart_summary(user_id):
+    cart_id = (
+        select(func.max(Carts.id))
+        .where(Carts.user_id == user_id, Carts.is_active == true())
+        .scalar_subquery()
+    )
+    subtotal = (CartItems.quantity * Products.price).label("subtotal")
+    rows = db.session.execute(
+        select(
+            Carts.id.label("cart_id"),
+            CartItems.product_id,
+            Products.name,
+            Products.price,
+            Products.image_url,
+            CartItems.quantity,
+            subtotal,
+            func.sum(CartItems.quantity).over().label("item_count"),
+            func.sum(CartItems.quantity * Products.price).over().label("total"),
+        )
+        .join(CartItems, CartItems.cart_id == Carts.id)
+        .join(Products, Products.id == CartItems.product_id)
+        .where(Carts.id == cart_id)
+        .order_by(CartItems.added_at, CartItems.id)
+    ).all()
+    if not rows:
+        return {"cart_id": None, "lines": [], "item_count": 0, "total": 0}
+    return {
+        "cart_id": rows[0].cart_id,
+        "lines": [{
+            "product_id": row.product_id,
+            "name": row.name,
+            "price": row.price,
+            "image_url": row.image_url,
+            "quantity": row.quantity,
+            "subtotal": row.subtotal,
+        } for row in rows],
+        "item_count": int(rows[0].item_count),
+        "total": rows[0].total,
+    }
+
+
+def active_cart_id(user_id, create=False):
+    cart_id = db.session.execute(
+        select(Carts.id)
+        .where(Carts.user_id == user_id, Carts.is_active == true())
+        .order_by(Carts.id.desc())
+        .limit(1)
+    ).scalar()
+    if cart_id is None and create:
+        if db.engine.dialect.name in ("postgresql", "sqlite"):
+            # активная корзина у пользователя одна (частичный уникальный
+            # индекс): из двух параллельных запросов вставит только один,
+            # второй дождется его и прочитает ту же корзину
+            now = datetime.datetime.utcnow()
+            db.session.execute(
+                _insert()(Carts.__table__)
+                .values(user_id=user_id, is_active=True, created_at=now, updated_at=now)
+                .on_conflict_do_nothing(index_elements=["user_id"],
+                                        index_where=Carts.__table__.c.is_active)
+            )
+            return active_cart_id(user_id)
+        cart = Carts(user_id=user_id)
+        db.session.add(cart)
+        db.session.flush()
+        cart_id = cart.id
+    return cart_id
+
+
+def _record(product_id, delta):
+    popularity = current_app.extensions.get("popularity")
+    if popularity is not None:
+        popularity.record(product_id, carts=delta)
+
+
+# =========================
+# Корзина пользователя
+# =========================
+class CartService:
+    def __init__(self, badge_ttl=60):
+        self.badge_ttl = badge_ttl
+        self._badges = {}  # user_id -> (expires_at, cart_id, count)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.badge_ttl = app.config.get("CART_BADGE_TTL", self.badge_ttl)
+        app.extensions["cart_service"] = self
+        for name in ("after_insert", "after_update", "after_delete"):
+            if not event.contains(CartItems, name, self._on_cart_item):
+                event.listen(CartItems, name, self._on_cart_item)
+
+    def _on_cart_item(self, mapper, connection, target):
+        self.invalidate_cart(target.cart_id)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._badges.pop(user_id, None)
+
+    def invalidate_cart(self, cart_id):
+        with self._lock:
+            for user_id, (_, badge_cart_id, _) in list(self._badges.items()):
+                if badge_cart_id == cart_id:
+                    del self._badges[user_id]
+
+    def badge_count(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._badges.get(user_id)
+            if entry is not None and entry[0] > now:
+                return entry[2]
+        row = db.session.execute(
+            select(Carts.id, func.coalesce(func.sum(CartItems.quantity), 0))
+            .outerjoin(CartItems, CartItems.cart_id == Carts.id)
+            .where(Carts.user_id == user_id, Carts.is_active == true())
+            .group_by(Carts.id)
+            .order_by(Carts.id.desc())
+            .limit(1)
+        ).first()
+        cart_id, count = row if row else (None, 0)
+        with self._lock:
+            self._badges[user_id] = (now + self.badge_ttl, cart_id, int(count))
+        return int(count)
+
+    def add(self, user_id, product_id, quantity=1):
+        if not 1 <= quantity <= MAX_QUANTITY:
+            raise InvalidQuantity(f"Количество должно быть от 1 до {MAX_QUANTITY}")
+        exists = db.session.execute(
+            select(Products.id).where(Products.id == product_id, Products.is_active.isnot(False))
+        ).scalar()
+        if exists is None:
+            raise CartError("Товар не найден")
+        cart_id = active_cart_id(user_id, create=True)
+        # резерв - в той же транзакции, что и строка корзины
+        reservations = current_app.extensions.get("reservations")
+        if reservations is not None and not reservations.reserve(cart_id, product_id, quantity):
+            db.session.rollback()
+            raise NotEnoughStock("Недостаточно товара на складе")
+        dialect = db.engine.dialect.name
+        items = CartItems.__table__
+        values = {"cart_id": cart_id, "product_id": product_id, "quantity": quantity,
+                  "added_at": datetime.datetime.utcnow()}
+        if dialect in ("postgresql", "sqlite"):
+            stmt = _insert()(items).values(**values)
+            # повторное добавление увеличивает количество, а не плодит строки;
+            # сверх MAX_QUANTITY строка не обновляется и не возвращается
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["cart_id", "product_id"],
+                set_={"quantity": items.c.quantity + stmt.excluded.quantity},
+                where=items.c.quantity + stmt.excluded.quantity <= MAX_QUANTITY,
+            )
+            if dialect == "postgresql":
+                # xmax = 0 только у строки, вставленной этим запросом
+                row = db.session.execute(stmt.returning(literal_column("(xmax = 0)"))).first()
+                created = row[0] if row else False
+            else:
+                created = db.session.execute(
+                    select(items.c.id).where(items.c.cart_id == cart_id, items.c.product_id == product_id)
+                ).first() is None
+                row = db.session.execute(stmt.returning(items.c.quantity)).first()
+        else:
+            row = db.session.execute(
+                select(items.c.quantity)
+                .where(items.c.cart_id == cart_id, items.c.product_id == product_id)
+            ).first()
+            created = row is None
+            if created:
+                db.session.execute(items.insert().values(**values))
+            elif row.quantity + quantity <= MAX_QUANTITY:
+                db.session.execute(
+                    update(items)
+                    .where(items.c.cart_id == cart_id, items.c.product_id == product_id)
+                    .values(quantity=items.c.quantity + quantity)
+                )
+            else:
+                row = None
+        if row is None:
+            db.session.rollback()
+            raise InvalidQuantity(f"В корзине не может быть больше {MAX_QUANTITY} шт. товара")
+        self._touch(cart_id)
+        db.session.commit()
+        self.invalidate_user(user_id)
+        if created:
+            _record(product_id, 1)
+        return cart_id
+
+    def remove(self, user_id, product_id):
+        cart_id = active_cart_id(user_id)
+        if cart_id is None:
+            return
+        result = db.session.execute(
+            delete(CartItems.__table__)
+            .where(CartItems.__table__.c.cart_id == cart_id,
+                   CartItems.__table__.c.product_id == product_id)
+        )
+        reservations = current_app.extensions.get("reservations")
+        if reservations is not None:
+            reservations.release(cart_id, product_id)
+        self._touch(cart_id)
+        db.session.commit()
+        self.invalidate_user(user_id)
+        if result.rowcount:
+            _record(product_id, -result.rowcount)
+
+    def _touch(self, cart_id):
+        db.session.execute(
+            update(Carts.__table__)
+            .where(Carts.__table__.c.id == cart_id)
+            .values(updated_at=datetime.datetime.utcnow())
+        )
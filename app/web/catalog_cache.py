@@ -0,0 +1,211 @@
+# app/web/catalog_cache.py
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+
+from . import after_commit
+from .models import db, Products, Characteristics, ProductCharacteristics
+from .replicas import use_primary
+
+
+PRODUCT_FIELDS = ("id", "name", "price", "stock", "description", "image_url",
+                  "created_at", "updated_at", "is_active")
+
+
+# =========================
+# Снимок товара
+# =========================
+# Товар хранится кортежем (поля PRODUCT_FIELDS..., характеристики), где
+# характеристики - кортеж троек (characteristic_id, name, value).
+# Никаких ORM-объектов в кэше не живет.
+def snapshot_to_dict(snapshot):
+    data = dict(zip(PRODUCT_FIELDS, snapshot))
+    data["characteristics"] = [
+        {"id": char_id, "name": name, "value": value}
+        for char_id, name, value in snapshot[-1]
+    ]
+    return data
+
+
+def _sizeof(snapshot):
+    size = sys.getsizeof(snapshot)
+    for item in snapshot[:-1]:
+        size += sys.getsizeof(item)
+    size += sys.getsizeof(snapshot[-1])
+    for triple in snapshot[-1]:
+        size += sys.getsizeof(triple) + sum(sys.getsizeof(x) for x in triple)
+    return size
+
+
+# =========================
+# Кэш каталога
+# =========================
+class CatalogCache:
+    def __init__(self, max_items=10000, ttl=300, max_bytes=64 * 1024 * 1024):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # product_id -> (expires_at, size, snapshot)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        self.max_items = app.config.get("CATALOG_CACHE_MAX_ITEMS", self.max_items)
+        self.ttl = app.config.get("CATALOG_CACHE_TTL", self.ttl)
+        self.max_bytes = app.config.get("CATALOG_CACHE_MAX_BYTES", self.max_bytes)
+        app.extensions["catalog_cache"] = self
+        self._listen()
+
+    def _listen(self):
+        after_commit.register("catalog_cache", self._apply)
+        for name in ("after_insert", "after_update", "after_delete"):
+            if not event.contains(Products, name, self._on_product):
+                event.listen(Products, name, self._on_product)
+            if not event.contains(ProductCharacteristics, name, self._on_product_characteristic):
+                event.listen(ProductCharacteristics, name, self._on_product_characteristic)
+            if not event.contains(Characteristics, name, self._on_characteristic):
+                event.listen(Characteristics, name, self._on_characteristic)
+
+    # ---------- Инвалидация ----------
+    # события приходят на flush, а кэш чистится после commit: иначе чтение
+    # между flush и rollback положило бы в кэш так и не зафиксированные данные
+    def _on_product(self, mapper, connection, target):
+        after_commit.defer(target, "catalog_cache", ("product", target.id))
+
+    def _on_product_characteristic(self, mapper, connection, target):
+        after_commit.defer(target, "catalog_cache", ("product", target.product_id))
+        # при переносе характеристики на другой товар чистим и старый
+        history = db.inspect(target).attrs.product_id.history
+        for product_id in history.deleted or ():
+            after_commit.defer(target, "catalog_cache", ("product", product_id))
+
+    def _on_characteristic(self, mapper, connection, target):
+        after_commit.defer(target, "catalog_cache", ("characteristic", target.id))
+
+    def _apply(self, items):
+        product_ids = {key for kind, key in items if kind == "product"}
+        characteristic_ids = {key for kind, key in items if kind == "characteristic"}
+        if characteristic_ids:
+            # имя характеристики денормализовано во все снимки, где она есть
+            with self._lock:
+                product_ids.update(
+                    pid for pid, (_, _, snap) in self._items.items()
+                    if any(char_id in characteristic_ids for char_id, _, _ in snap[-1])
+                )
+        for product_id in product_ids:
+            self.invalidate(product_id)
+
+    def invalidate(self, product_id):
+        with self._lock:
+            self._generation += 1
+            entry = self._items.pop(product_id, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._items.clear()
+            self._bytes = 0
+
+    # ---------- Чтение ----------
+    # снимок, если он уже в кэше; промах ничего не загружает
+    def peek(self, product_id):
+        with self._lock:
+            entry = self._items.get(product_id)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[2]
+            return None
+
+    def get(self, product_id):
+        return self.get_many([product_id]).get(product_id)
+
+    def get_many(self, product_ids):
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation
+            for product_id in product_ids:
+                entry = self._items.get(product_id)
+                if entry is not None and entry[0] > now:
+                    self._items.move_to_end(product_id)
+                    found[product_id] = entry[2]
+                    self.hits += 1
+                else:
+                    if entry is not None:
+                        self._items.pop(product_id)
+                        self._bytes -= entry[1]
+                    missing.append(product_id)
+                    self.misses += 1
+        if missing:
+            loaded = self._load(missing)
+            # незафиксированные изменения своей транзакции в кэш не попадают
+            if not after_commit.pending(db.session, "catalog_cache"):
+                self._store(loaded, generation)
+            found.update(loaded)
+        return found
+
+    # кэш общий для всех пользователей процесса: заполняется только с
+    # основной базы, иначе первый запрос после инвалидации вернул бы в него
+    # строку с отстающей реплики на весь ttl
+    def _load(self, product_ids):
+        columns = [getattr(Products, field) for field in PRODUCT_FIELDS]
+        with use_primary():
+            rows = db.session.execute(
+                select(*columns).where(Products.id.in_(product_ids))
+            ).all()
+            characteristics = {row.id: [] for row in rows}
+            char_rows = db.session.execute(
+                select(ProductCharacteristics.product_id, Characteristics.id,
+                       Characteristics.name, ProductCharacteristics.value)
+                .join(Characteristics, Characteristics.id == ProductCharacteristics.characteristic_id)
+                .where(ProductCharacteristics.product_id.in_(list(characteristics)))
+                .order_by(ProductCharacteristics.product_id, ProductCharacteristics.id)
+            ).all()
+        for product_id, char_id, name, value in char_rows:
+            characteristics[product_id].append((char_id, name, value))
+        return {
+            row.id: tuple(row) + (tuple(characteristics[row.id]),)
+            for row in rows
+        }
+
+    def _store(self, snapshots, generation):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            # пока шла загрузка, чужой commit мог инвалидировать эти товары:
+            # прочитанное тогда могло уже устареть
+            if generation != self._generation:
+                return
+            for product_id, snapshot in snapshots.items():
+                old = self._items.pop(product_id, None)
+                if old is not None:
+                    self._bytes -= old[1]
+                size = _sizeof(snapshot)
+                self._items[product_id] = (expires_at, size, snapshot)
+                self._bytes += size
+            while self._items and (len(self._items) > self.max_items
+                                   or self._bytes > self.max_bytes):
+                _, (_, size, _) = self._items.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,279 @@
+# app/web/catalog_import.py
+import csv
+import datetime
+import io
+import json
+import os
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, text, update, insert, delete, tuple_, bindparam
+
+from .models import db, Products, Characteristics, ProductCharacteristics
+
+
+catalog_cli = AppGroup("catalog", help="Работа с каталогом товаров.")
+
+PRODUCT_COLUMNS = ("id", "name", "price", "stock", "description", "image_url", "is_active")
+REQUIRED_COLUMNS = ("id", "name", "price", "stock")
+
+
+# =========================
+# Чтение фида
+# =========================
+# Каждая запись - (поля товара, {имя характеристики: значение}).
+# В CSV характеристиками считаются все колонки вне PRODUCT_COLUMNS,
+# в JSONL - объект "characteristics".
+def _read_csv(stream):
+    for row in csv.DictReader(stream):
+        product = {key: row.get(key) or None for key in PRODUCT_COLUMNS}
+        characteristics = {key: value for key, value in row.items()
+                           if key not in PRODUCT_COLUMNS and key and value not in (None, "")}
+        yield product, characteristics
+
+
+def _read_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        row = json.loads(line)
+        product = {key: row.get(key) for key in PRODUCT_COLUMNS}
+        characteristics = {key: str(value) for key, value in (row.get("characteristics") or {}).items()}
+        yield product, characteristics
+
+
+def _normalize(product):
+    missing = [key for key in REQUIRED_COLUMNS if product.get(key) in (None, "")]
+    if missing:
+        raise click.ClickException(f"Нет обязательных полей {missing} в записи {product}")
+    is_active = product.get("is_active")
+    if isinstance(is_active, str):
+        is_active = is_active.strip().lower() not in ("0", "false", "no", "")
+    return {
+        "id": int(product["id"]),
+        "name": product["name"],
+        "price": str(product["price"]),
+        "stock": int(product["stock"]),
+        "description": product.get("description"),
+        "image_url": product.get("image_url"),
+        "is_active": True if is_active is None else bool(is_active),
+    }
+
+
+# =========================
+# Чекпоинты
+# =========================
+def _load_checkpoint(path, source):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("source") != os.path.abspath(source):
+        return 0
+    return int(data.get("records", 0))
+
+
+def _save_checkpoint(path, source, records):
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"source": os.path.abspath(source), "records": records}, f)
+    os.replace(tmp_path, path)
+
+
+# =========================
+# Справочник характеристик
+# =========================
+class CharacteristicMap:
+    def __init__(self):
+        self._ids = dict(
+            (name, char_id) for char_id, name in
+            db.session.execute(select(Characteristics.id, Characteristics.name))
+        )
+
+    def resolve(self, names):
+        new_names = sorted(set(names) - set(self._ids))
+        if new_names:
+            result = db.session.execute(
+                insert(Characteristics).returning(Characteristics.id, Characteristics.name),
+                [{"name": name} for name in new_names],
+            )
+            for char_id, name in result:
+                self._ids[name] = char_id
+        return self._ids
+
+
+# =========================
+# Загрузка пачки
+# =========================
+def _characteristic_rows(batch, characteristics):
+    ids = characteristics.resolve(
+        name for _, chars in batch.values() for name in chars
+    )
+    return [
+        {"product_id": product_id, "characteristic_id": ids[name], "value": value}
+        for product_id, (_, chars) in batch.items()
+        for name, value in chars.items()
+    ]
+
+
+def _copy(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["\\N" if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        buffer,
+    )
+
+
+def _load_batch_postgres(batch, characteristics):
+    products = [product for product, _ in batch.values()]
+    char_rows = _characteristic_rows(batch, characteristics)
+    connection = db.session.connection()
+    connection.execute(text("""
+        CREATE TEMP TABLE IF NOT EXISTS catalog_import_products (
+            id integer, name varchar, price numeric(10, 2), stock integer,
+            description text, image_url varchar, is_active boolean
+        ) ON COMMIT DELETE ROWS
+    """))
+    connection.execute(text("""
+        CREATE TEMP TABLE IF NOT EXISTS catalog_import_characteristics (
+            product_id integer, characteristic_id integer, value varchar
+        ) ON COMMIT DELETE ROWS
+    """))
+    cursor = connection.connection.cursor()
+    try:
+        _copy(cursor, "catalog_import_products", PRODUCT_COLUMNS, products)
+        _copy(cursor, "catalog_import_characteristics",
+              ("product_id", "characteristic_id", "value"), char_rows)
+    finally:
+        cursor.close()
+
+    connection.execute(text("""
+        INSERT INTO products (id, name, price, stock, description, image_url, is_active, created_at, updated_at)
+        OVERRIDING SYSTEM VALUE
+        SELECT id, name, price, stock, description, image_url, is_active, now(), now()
+        FROM catalog_import_products
+        ON CONFLICT (id) DO UPDATE SET
+            name = EXCLUDED.name,
+            price = EXCLUDED.price,
+            stock = EXCLUDED.stock,
+            description = EXCLUDED.description,
+            image_url = EXCLUDED.image_url,
+            is_active = EXCLUDED.is_active,
+            updated_at = now()
+    """))
+    connection.execute(text("""
+        DELETE FROM product_characteristics pc
+        USING catalog_import_characteristics s
+        WHERE pc.product_id = s.product_id AND pc.characteristic_id = s.characteristic_id
+    """))
+    connection.execute(text("""
+        INSERT INTO product_characteristics (product_id, characteristic_id, value)
+        SELECT product_id, characteristic_id, value FROM catalog_import_characteristics
+    """))
+
+
+def _load_batch_generic(batch, characteristics):
+    ids = list(batch)
+    existing = set(db.session.execute(
+        select(Products.id).where(Products.id.in_(ids))
+    ).scalars())
+    products = [product for product, _ in batch.values()]
+    now = datetime.datetime.utcnow()
+    updates = [dict(product, _id=product["id"], updated_at=now)
+               for product in products if product["id"] in existing]
+    inserts = [product for product in products if product["id"] not in existing]
+
+    connection = db.session.connection()
+    if updates:
+        connection.execute(
+            update(Products.__table__)
+            .where(Products.__table__.c.id == bindparam("_id"))
+            .values({key: bindparam(key) for key in PRODUCT_COLUMNS + ("updated_at",) if key != "id"}),
+            updates,
+        )
+    if inserts:
+        connection.execute(insert(Products.__table__), inserts)
+
+    char_rows = _characteristic_rows(batch, characteristics)
+    if char_rows:
+        pairs = {(row["product_id"], row["characteristic_id"]) for row in char_rows}
+        connection.execute(
+            delete(ProductCharacteristics.__table__).where(
+                tuple_(ProductCharacteristics.product_id,
+                       ProductCharacteristics.characteristic_id).in_(list(pairs))
+            )
+        )
+        connection.execute(insert(ProductCharacteristics.__table__), char_rows)
+
+
+def _fix_sequence():
+    # id пришли из фида, последовательность нужно догнать до max(id)
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('products', 'id'), "
+            "(SELECT coalesce(max(id), 1) FROM products))"
+        ))
+        db.session.commit()
+
+
+# =========================
+# Команда
+# =========================
+@catalog_cli.command("import")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), default=None,
+              help="Формат фида; по умолчанию определяется по расширению.")
+@click.option("--batch-size", default=5000, show_default=True)
+@click.option("--checkpoint", type=click.Path(dir_okay=False), default=None,
+              help="Файл чекпоинта для продолжения прерванного импорта.")
+def import_catalog(source, fmt, batch_size, checkpoint):
+    """Потоковый импорт товаров и характеристик (upsert по id товара)."""
+    fmt = fmt or ("jsonl" if source.endswith((".jsonl", ".ndjson")) else "csv")
+    reader = _read_jsonl if fmt == "jsonl" else _read_csv
+    load_batch = (_load_batch_postgres if db.engine.dialect.name == "postgresql"
+                  else _load_batch_generic)
+
+    skip = _load_checkpoint(checkpoint, source)
+    if skip:
+        click.echo(f"Продолжаем с записи {skip}")
+
+    characteristics = CharacteristicMap()
+    started = time.monotonic()
+    records = 0
+    loaded = 0
+    batch = {}
+
+    def flush():
+        nonlocal loaded
+        load_batch(batch, characteristics)
+        db.session.commit()
+        loaded += len(batch)
+        batch.clear()
+        _save_checkpoint(checkpoint, source, records)
+        elapsed = time.monotonic() - started
+        click.echo(f"{records} записей, {loaded / elapsed if elapsed else 0:.0f} строк/с")
+
+    with open(source, newline="", encoding="utf-8") as stream:
+        for product, chars in reader(stream):
+            records += 1
+            if records <= skip:
+                continue
+            product = _normalize(product)
+            # повтор id внутри пачки - побеждает последняя запись
+            batch[product["id"]] = (product, chars)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+
+    _fix_sequence()
+    elapsed = time.monotonic() - started
+    click.echo(f"Готово: {loaded} товаров за {elapsed:.1f} с")
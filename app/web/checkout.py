@@ -0,0 +1,151 @@
+# app/web/checkout.py
+import datetime
+import random
+import time
+
+from flask import current_app
+from sqlalchemy import func, select, true, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError
+
+from .models import db, Products, Carts, CartItems, Orders, OrderStatuses
+
+
+NEW_ORDER_STATUS = "new"
+
+# SQLSTATE: serialization_failure, deadlock_detected
+RETRYABLE_PGCODES = {"40001", "40P01"}
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    pass
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, product_id):
+        super().__init__(f"Недостаточно товара на складе: {product_id}")
+        self.product_id = product_id
+
+
+def _is_retryable(error):
+    code = getattr(error.orig, "pgcode", None)
+    if code in RETRYABLE_PGCODES:
+        return True
+    # SQLite под конкурентной записью
+    return "database is locked" in str(error.orig)
+
+
+# Первые оформления могут прийти одновременно: строка статуса вставляется
+# с ON CONFLICT DO NOTHING и перечитывается, проигравший не получает
+# нарушение уникальности
+def _status_id(name):
+    query = select(OrderStatuses.id).where(OrderStatuses.name == name)
+    status_id = db.session.execute(query).scalar()
+    if status_id is None:
+        insert = postgresql.insert if db.engine.dialect.name == "postgresql" else sqlite.insert
+        db.session.execute(
+            insert(OrderStatuses.__table__).values(name=name)
+            .on_conflict_do_nothing(index_elements=["name"])
+        )
+        status_id = db.session.execute(query).scalar()
+    return status_id
+
+
+# =========================
+# Оформление заказа
+# =========================
+def _checkout_once(user_id):
+    cart_id = db.session.execute(
+        select(Carts.id)
+        .where(Carts.user_id == user_id, Carts.is_active == true())
+        .order_by(Carts.id.desc())
+        .limit(1)
+        .with_for_update()
+    ).scalar()
+    if cart_id is None:
+        raise EmptyCart("Нет активной корзины")
+
+    # одинаковые товары в корзине схлопываем; порядок по product_id
+    # одинаков во всех транзакциях, поэтому блокировки не образуют цикл
+    lines = db.session.execute(
+        select(CartItems.product_id, func.sum(CartItems.quantity))
+        .where(CartItems.cart_id == cart_id)
+        .group_by(CartItems.product_id)
+        .order_by(CartItems.product_id)
+    ).all()
+    if not lines:
+        raise EmptyCart("Корзина пуста")
+
+    now = datetime.datetime.utcnow()
+    reservations = current_app.extensions.get("reservations")
+    for product_id, quantity in lines:
+        # сначала счетчики резервов, потом строка товара - тот же порядок
+        # блокировок, что и у пересчета резервов
+        if reservations is not None and not reservations.consume(cart_id, product_id, quantity):
+            raise OutOfStock(product_id)
+        result = db.session.execute(
+            update(Products)
+            .where(Products.id == product_id,
+                   Products.stock >= quantity,
+                   Products.is_active.isnot(False))
+            .values(stock=Products.stock - quantity, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            raise OutOfStock(product_id)
+
+    total = (
+        select(func.coalesce(func.sum(CartItems.quantity * Products.price), 0))
+        .join(Products, Products.id == CartItems.product_id)
+        .where(CartItems.cart_id == cart_id)
+        .scalar_subquery()
+    )
+    order = Orders(
+        user_id=user_id,
+        cart_id=cart_id,
+        status_id=_status_id(NEW_ORDER_STATUS),
+        total_amount=total,
+    )
+    db.session.add(order)
+    db.session.execute(
+        update(Carts)
+        .where(Carts.id == cart_id)
+        .values(is_active=False, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.flush()
+    return order.id, [product_id for product_id, _ in lines]
+
+
+def checkout(user_id, max_attempts=5, base_delay=0.01, max_delay=0.2):
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            order_id, product_ids = _checkout_once(user_id)
+            db.session.commit()
+        except CheckoutError:
+            db.session.rollback()
+            raise
+        except DBAPIError as e:
+            db.session.rollback()
+            if attempt >= max_attempts or not _is_retryable(e):
+                raise
+            # экспоненциальная задержка с джиттером
+            delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+            time.sleep(random.uniform(0, delay))
+            continue
+
+        # UPDATE в обход ORM не вызывает событий, кэш чистим сами
+        cache = current_app.extensions.get("catalog_cache")
+        if cache is not None:
+            for product_id in product_ids:
+                cache.invalidate(product_id)
+        carts = current_app.extensions.get("cart_service")
+        if carts is not None:
+            carts.invalidate_user(user_id)
+        return order_id
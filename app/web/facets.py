@@ -0,0 +1,264 @@
+# app/web/facets.py
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from sqlalchemy import event, select
+
+from . import after_commit
+from .models import db, Products, ProductCharacteristics
+from .replicas import use_primary
+
+
+# =========================
+# Множества товаров
+# =========================
+# Товары значения характеристики - отсортированный массив int32 id: память
+# пропорциональна числу товаров со значением, а не максимальному id, и
+# вставка копирует только этот массив. Активные товары и фильтры запроса -
+# плотные маски numpy по id: мощность пересечения значения с маской -
+# выборка mask[ids] без построения промежуточных множеств.
+def ids_array(product_ids):
+    return np.unique(np.asarray(product_ids, dtype=np.int32))
+
+
+def _insert_id(ids, product_id):
+    position = np.searchsorted(ids, product_id)
+    if position < len(ids) and ids[position] == product_id:
+        return ids
+    return np.insert(ids, position, product_id)
+
+
+def _delete_id(ids, product_id):
+    position = np.searchsorted(ids, product_id)
+    if position < len(ids) and ids[position] == product_id:
+        return np.delete(ids, position)
+    return ids
+
+
+# =========================
+# Индекс фасетов
+# =========================
+class FacetIndex:
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.Lock()          # состояние индекса
+        self._build_lock = threading.Lock()    # одна перестройка за раз
+        self._built = False
+        self._built_at = 0.0
+        self._building = None                  # изменения, пришедшие во время перестройки
+        self._ids = {}                         # (characteristic_id, value) -> массив id товаров
+        self._values = defaultdict(set)        # characteristic_id -> {value}
+        self._rows = {}                        # product_characteristics.id -> (product_id, characteristic_id, value)
+        self._product_rows = defaultdict(set)  # product_id -> {product_characteristics.id}
+        self._refs = Counter()                 # (product_id, characteristic_id, value) -> число строк
+        self._active = np.zeros(0, dtype=bool) # маска активных товаров; длиннее любого id в индексе
+
+    def init_app(self, app):
+        self.max_age = app.config.get("FACET_INDEX_MAX_AGE", self.max_age)
+        app.extensions["facet_index"] = self
+        after_commit.register("facet_index", self._apply)
+        # в after_delete inspect(target).deleted еще False: удаление
+        # различается по событию, а не по состоянию объекта
+        listeners = [(ProductCharacteristics, name, self._on_product_characteristic)
+                     for name in ("after_insert", "after_update")]
+        listeners += [(Products, name, self._on_product) for name in ("after_insert", "after_update")]
+        listeners += [(ProductCharacteristics, "after_delete", self._on_product_characteristic_deleted),
+                      (Products, "after_delete", self._on_product_deleted)]
+        for target, name, listener in listeners:
+            if not event.contains(target, name, listener):
+                event.listen(target, name, listener)
+
+    # ---------- Построение ----------
+    # Новый индекс собирается в локальных структурах без блокировки, читатели
+    # до подмены работают со старым. Изменения, зафиксированные за время
+    # сборки, могли не попасть в прочитанные строки - они копятся и
+    # применяются к новому индексу после подмены. Индекс общий для всех
+    # запросов процесса, поэтому читается с основной базы, а не с реплики:
+    # отстающая реплика вернула бы в него уже перезаписанные строки.
+    @use_primary()
+    def build(self):
+        with self._lock:
+            self._building = []
+        try:
+            active_ids = ids_array(db.session.execute(
+                select(Products.id).where(Products.is_active.isnot(False)),
+                execution_options={"yield_per": 10000},
+            ).scalars().all())
+
+            # собираем списки id по значениям, а массивы строим один раз в конце
+            rows, product_rows, refs, pending = {}, defaultdict(set), Counter(), defaultdict(list)
+            result = db.session.execute(
+                select(ProductCharacteristics.id, ProductCharacteristics.product_id,
+                       ProductCharacteristics.characteristic_id, ProductCharacteristics.value),
+                execution_options={"yield_per": 10000},
+            )
+            for row_id, product_id, characteristic_id, value in result:
+                rows[row_id] = (product_id, characteristic_id, value)
+                product_rows[product_id].add(row_id)
+                refs[(product_id, characteristic_id, value)] += 1
+                pending[(characteristic_id, value)].append(product_id)
+            ids, values = {}, defaultdict(set)
+            for key, product_ids in pending.items():
+                ids[key] = ids_array(product_ids)
+                values[key[0]].add(key[1])
+            size = max([int(active_ids[-1]) if len(active_ids) else 0]
+                       + [int(array[-1]) for array in ids.values()]) + 1
+            active = np.zeros(size, dtype=bool)
+            active[active_ids] = True
+        except BaseException:
+            with self._lock:
+                self._building = None
+            raise
+
+        with self._lock:
+            self._ids, self._values, self._rows, self._product_rows, self._refs, self._active = \
+                ids, values, rows, product_rows, refs, active
+            replay, self._building = self._building, None
+            for item in replay:
+                self._apply_one(item)
+            self._built = True
+            self._built_at = time.monotonic()
+
+    # события ORM видны только в своем процессе; изменения из других
+    # воркеров и массового импорта подхватываются периодической перестройкой
+    def _ensure_built(self):
+        if self._built and time.monotonic() - self._built_at <= self.max_age:
+            return
+        if self._built:
+            # устаревший индекс перестраивает один поток, остальные пока
+            # читают старый и не ждут
+            if not self._build_lock.acquire(blocking=False):
+                return
+        else:
+            self._build_lock.acquire()
+        try:
+            # пока ждали блокировку, индекс мог построить другой поток
+            if not self._built or time.monotonic() - self._built_at > self.max_age:
+                self.build()
+        finally:
+            self._build_lock.release()
+
+    # ---------- Инкрементальное обновление ----------
+    def _grow(self, product_id):
+        if product_id >= len(self._active):
+            grown = np.zeros(max(product_id + 1, len(self._active) * 2), dtype=bool)
+            grown[:len(self._active)] = self._active
+            self._active = grown
+
+    def _add(self, row_id, product_id, characteristic_id, value):
+        self._rows[row_id] = (product_id, characteristic_id, value)
+        self._product_rows[product_id].add(row_id)
+        self._refs[(product_id, characteristic_id, value)] += 1
+        self._grow(product_id)
+        key = (characteristic_id, value)
+        ids = self._ids.get(key)
+        self._ids[key] = ids_array([product_id]) if ids is None else _insert_id(ids, product_id)
+        self._values[characteristic_id].add(value)
+
+    def _remove(self, row_id):
+        old = self._rows.pop(row_id, None)
+        if old is None:
+            return
+        product_id, characteristic_id, value = old
+        product_rows = self._product_rows[product_id]
+        product_rows.discard(row_id)
+        if not product_rows:
+            del self._product_rows[product_id]
+        self._refs[old] -= 1
+        if self._refs[old] > 0:
+            return
+        del self._refs[old]
+        key = (characteristic_id, value)
+        ids = _delete_id(self._ids.get(key, ids_array([])), product_id)
+        if len(ids):
+            self._ids[key] = ids
+        else:
+            self._ids.pop(key, None)
+            self._values[characteristic_id].discard(value)
+
+    # на flush запоминаем значения строк, применяем после commit
+    def _on_product_characteristic(self, mapper, connection, target, deleted=False):
+        after_commit.defer(target, "facet_index", (
+            "row", target.id, target.product_id, target.characteristic_id, target.value, deleted,
+        ))
+
+    def _on_product_characteristic_deleted(self, mapper, connection, target):
+        self._on_product_characteristic(mapper, connection, target, deleted=True)
+
+    def _on_product(self, mapper, connection, target, deleted=False):
+        after_commit.defer(target, "facet_index", (
+            "product", target.id, target.is_active is not False, deleted,
+        ))
+
+    def _on_product_deleted(self, mapper, connection, target):
+        self._on_product(mapper, connection, target, deleted=True)
+
+    def _apply(self, items):
+        with self._lock:
+            if self._building is not None:
+                self._building.extend(items)
+            if not self._built:
+                return
+            for item in items:
+                self._apply_one(item)
+
+    # применение идемпотентно: повтор после перестройки ничего не портит
+    def _apply_one(self, item):
+        if item[0] == "row":
+            _, row_id, product_id, characteristic_id, value, deleted = item
+            self._remove(row_id)
+            if not deleted:
+                self._add(row_id, product_id, characteristic_id, value)
+            return
+        _, product_id, active, deleted = item
+        self._grow(product_id)
+        self._active[product_id] = active and not deleted
+        # строки характеристик удаляются каскадом в базе, без событий ORM
+        if deleted:
+            for row_id in list(self._product_rows.get(product_id, ())):
+                self._remove(row_id)
+
+    # ---------- Запросы ----------
+    # filters: {characteristic_id: [value, ...]}. Значения одной характеристики
+    # объединяются через ИЛИ, разные характеристики - через И. Счетчики
+    # фасета считаются без учета его собственного фильтра.
+    def search(self, filters, offset=0, limit=50):
+        self._ensure_built()
+        with self._lock:
+            size = len(self._active)
+            selected = {}
+            for characteristic_id, values in filters.items():
+                mask = np.zeros(size, dtype=bool)
+                for value in values:
+                    ids = self._ids.get((characteristic_id, value))
+                    if ids is not None:
+                        mask[ids] = True
+                selected[characteristic_id] = mask
+
+            result = self._active.copy()
+            for mask in selected.values():
+                result &= mask
+
+            # для каждой характеристики - пересечение всех остальных фильтров
+            others = {}
+            for characteristic_id in selected:
+                mask = self._active.copy()
+                for other_id, other in selected.items():
+                    if other_id != characteristic_id:
+                        mask &= other
+                others[characteristic_id] = mask
+
+            facets = defaultdict(dict)
+            for (characteristic_id, value), ids in self._ids.items():
+                count = int(np.count_nonzero(others.get(characteristic_id, result)[ids]))
+                if count:
+                    facets[characteristic_id][value] = count
+
+            matched = np.flatnonzero(result)
+            return {
+                "total": len(matched),
+                "product_ids": matched[offset:offset + limit].tolist(),
+                "facets": dict(facets),
+            }
@@ -0,0 +1,113 @@
+# app/web/hashing.py
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def _method_prefix(method):
+    # "scrypt:32768:8:1$соль$хэш" -> "scrypt:32768:8:1"
+    return generate_password_hash("", method=method).split("$", 1)[0]
+
+
+# =========================
+# Пул хэширования паролей
+# =========================
+# scrypt/pbkdf2 грузят CPU на десятки миллисекунд и держат GIL, поэтому
+# считаются в отдельных процессах. Очередь ограничена: при переполнении
+# запрос сразу получает HasherBusy, а не ждет за сотней других логинов.
+# Слот освобождается, когда задача действительно завершилась: хэш, не
+# уложившийся в таймаут, продолжает считаться и занимать очередь.
+# Процессы пула стартуют через forkserver/spawn: fork из многопоточного
+# воркера копирует чужие захваченные блокировки.
+class PasswordHasher:
+    def __init__(self, workers=2, max_pending=8, timeout=5.0, method="scrypt"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.method = method
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._current_prefix = None
+        self.rejected = 0
+
+    def init_app(self, app):
+        self.workers = app.config.get("HASH_POOL_WORKERS", self.workers)
+        self.max_pending = app.config.get("HASH_POOL_MAX_PENDING", self.max_pending)
+        self.timeout = app.config.get("HASH_TIMEOUT", self.timeout)
+        self.method = app.config.get("HASH_METHOD", self.method)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        app.extensions["password_hasher"] = self
+
+    @staticmethod
+    def _context():
+        methods = multiprocessing.get_all_start_methods()
+        return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+    def _pool(self):
+        # пул создается в каждом воркере заново: после fork чужой пул непригоден
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context())
+                self._pid = os.getpid()
+            return self._executor
+
+    def _discard(self, executor):
+        # процесс пула умер (OOM killer и т.п.) - следующий вызов создаст новый
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, future):
+        self._slots.release()
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy("Сервис проверки паролей перегружен")
+        executor = self._pool()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._discard(executor)
+            raise HasherBusy("Пул проверки паролей перезапускается")
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HasherBusy("Проверка пароля не уложилась в таймаут")
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise HasherBusy("Пул проверки паролей перезапускается")
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def needs_rehash(self, password_hash):
+        if self._current_prefix is None:
+            self._current_prefix = self._run(_method_prefix, self.method)
+        return password_hash.split("$", 1)[0] != self._current_prefix
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
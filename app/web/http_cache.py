@@ -0,0 +1,188 @@
+# app/web/http_cache.py
+import datetime
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import current_app, make_response, request
+from sqlalchemy import event, func, select, update
+
+from .catalog_cache import PRODUCT_FIELDS
+from .models import db, Products, Characteristics, ProductCharacteristics
+from .replicas import use_primary
+
+
+# =========================
+# Валидаторы
+# =========================
+# products.updated_at - версия товара вместе с его характеристиками:
+# изменения характеристик тоже сдвигают updated_at товара.
+# Тело ответа должно быть не старее версии в ETag, иначе клиент закэширует
+# старое тело под новым ETag и будет получать на него 304.
+UPDATED_AT = PRODUCT_FIELDS.index("updated_at")
+
+
+def catalog_validator():
+    # два скалярных подзапроса - по индексу каждый; max() обоих столбцов
+    # в одном SELECT заставляет SQLite сканировать весь индекс
+    max_updated, max_id = db.session.execute(
+        select(select(func.max(Products.updated_at)).scalar_subquery(),
+               select(func.max(Products.id)).scalar_subquery())
+    ).one()
+    return (max_updated, max_id), max_updated
+
+
+# Тело /products/<id> берется из кэша каталога процесса: если в кэше
+# снимок старее строки в базе (ее изменил другой процесс), он
+# выбрасывается и перечитывается.
+def product_validator(product_id):
+    updated_at = db.session.execute(
+        select(Products.updated_at).where(Products.id == product_id)
+    ).scalar()
+    catalog_cache = current_app.extensions["catalog_cache"]
+    snapshot = catalog_cache.peek(product_id)
+    if snapshot is not None and snapshot[UPDATED_AT] != updated_at:
+        catalog_cache.invalidate(product_id)
+    return (product_id, updated_at), updated_at
+
+
+def _touch_product(mapper, connection, target):
+    product_ids = {target.product_id}
+    history = db.inspect(target).attrs.product_id.history
+    product_ids.update(history.deleted or ())
+    connection.execute(
+        update(Products.__table__)
+        .where(Products.__table__.c.id.in_(product_ids))
+        .values(updated_at=datetime.datetime.utcnow())
+    )
+
+
+def _touch_characteristic_products(mapper, connection, target):
+    # имя характеристики входит в ответы всех товаров, где она есть
+    connection.execute(
+        update(Products.__table__)
+        .where(Products.__table__.c.id.in_(
+            select(ProductCharacteristics.product_id)
+            .where(ProductCharacteristics.characteristic_id == target.id)
+        ))
+        .values(updated_at=datetime.datetime.utcnow())
+    )
+
+
+# =========================
+# Кэш фрагментов
+# =========================
+class FragmentCache:
+    def __init__(self, max_items=0):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if not self.max_items:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+class HttpCache:
+    def __init__(self):
+        self.fragments = FragmentCache()
+
+    def init_app(self, app):
+        self.fragments.max_items = app.config.get("HTTP_FRAGMENT_CACHE_SIZE", 0)
+        app.extensions["http_cache"] = self
+        for name in ("after_insert", "after_update", "after_delete"):
+            if not event.contains(ProductCharacteristics, name, _touch_product):
+                event.listen(ProductCharacteristics, name, _touch_product)
+        if not event.contains(Characteristics, "after_update", _touch_characteristic_products):
+            event.listen(Characteristics, "after_update", _touch_characteristic_products)
+
+
+# ETag считается одинаково здесь и в асинхронном каталоге (async_catalog),
+# чтобы 304 работал, какой бы из процессов ни ответил
+def version_etag(endpoint, args, version):
+    raw = repr((endpoint, sorted(args), version))
+    return hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()
+
+
+def _etag(endpoint, version):
+    return version_etag(endpoint, request.args.items(multi=True), version)
+
+
+def body_etag(data):
+    return hashlib.blake2b(data, digest_size=12).hexdigest()
+
+
+# If-None-Match главнее: If-Modified-Since с точностью до секунды
+# учитывается, только если клиент ETag не прислал (RFC 9110, 13.2.2)
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return etag is not None and request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def _finish(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(tzinfo=datetime.timezone.utc)
+    response.cache_control.no_cache = True
+    return response
+
+
+# =========================
+# Декоратор условных ответов
+# =========================
+# validator(**view_args) -> (версия, last_modified). Ответ 304 отдается
+# до вызова view, т.е. без загрузки строк и рендеринга.
+# Без validator ETag считается по готовому телу: для ответов из индексов
+# процесса (фасеты, поиск), версию которых база не знает. Такой 304
+# экономит только трафик.
+def conditional(validator=None):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if validator is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                etag = body_etag(response.get_data())
+                if _not_modified(etag, None):
+                    response = make_response("", 304)
+                return _finish(response, etag, None)
+
+            # версия и тело - с основной базы: тело с отстающей реплики
+            # оказалось бы старее версии в ETag и легло бы под ним в кэш
+            # фрагментов и у клиента
+            with use_primary():
+                version, last_modified = validator(**kwargs)
+                etag = _etag(request.endpoint, version)
+                if _not_modified(etag, last_modified):
+                    return _finish(make_response("", 304), etag, last_modified)
+                cache = current_app.extensions["http_cache"].fragments
+                cached = cache.get(etag)
+                if cached is not None:
+                    response = make_response(cached[0])
+                    response.mimetype = cached[1]
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    if not response.is_streamed:
+                        cache.put(etag, (response.get_data(), response.mimetype))
+                return _finish(response, etag, last_modified)
+        return wrapper
+    return decorator
@@ -0,0 +1,222 @@
+# app/web/images.py
+import datetime
+import hashlib
+import io
+import logging
+import os
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import db, Products, ProductImages
+from .assets import write_atomic
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+images_cli = AppGroup("images", help="Производные изображений товаров.")
+
+images = ProductImages.__table__
+
+# формат -> (имя для Pillow, расширение файла)
+FORMATS = {"webp": ("WEBP", "webp"), "jpeg": ("JPEG", "jpg")}
+
+
+def parse_sizes(value):
+    # "thumb=160,card=480" -> {"thumb": 160, "card": 480}; число - длинная сторона
+    sizes = {}
+    for part in value.split(","):
+        name, _, side = part.partition("=")
+        sizes[name.strip()] = int(side)
+    return sizes
+
+
+# =========================
+# Обработка
+# =========================
+# Выполняется в процессах пула: декодирование и ресайз держат GIL.
+# Возвращает [(размер, формат, расширение, ширина, высота, байты)].
+def render(data, sizes, formats, quality):
+    results = []
+    with Image.open(io.BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ("RGB", "RGBA"):
+            alpha = "A" in source.mode or "transparency" in source.info
+            source = source.convert("RGBA" if alpha else "RGB")
+        for name, side in sizes.items():
+            image = source.copy()
+            # thumbnail только уменьшает: мелкий оригинал не растягивается
+            image.thumbnail((side, side), Image.LANCZOS)
+            for fmt in formats:
+                pil_format, ext = FORMATS[fmt]
+                frame = image
+                options = {"quality": quality}
+                if pil_format == "JPEG":
+                    if frame.mode == "RGBA":
+                        background = Image.new("RGBA", frame.size, "white")
+                        frame = Image.alpha_composite(background, frame)
+                    frame = frame.convert("RGB")
+                    options.update(optimize=True, progressive=True)
+                else:
+                    options["method"] = 4
+                buffer = io.BytesIO()
+                frame.save(buffer, pil_format, **options)
+                results.append((name, fmt, ext, image.width, image.height, buffer.getvalue()))
+    return results
+
+
+# =========================
+# Хранилище
+# =========================
+# Файл называется хэшем своего содержимого: одинаковые картинки хранятся
+# один раз, а URL никогда не меняет смысла и кэшируется навсегда.
+class ImageStore:
+    def __init__(self, root, url_prefix):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip("/")
+
+    def put(self, data, ext):
+        digest = hashlib.sha256(data).hexdigest()
+        relative = f"{digest[:2]}/{digest}.{ext}"
+        path = os.path.join(self.root, digest[:2], f"{digest}.{ext}")
+        if not os.path.exists(path):
+            write_atomic(path, data)
+        return f"{self.url_prefix}/{relative}"
+
+    def owns(self, url):
+        return url.startswith(self.url_prefix + "/")
+
+
+def read_source(url, static_root, max_bytes):
+    if url.startswith(("http://", "https://")):
+        with urllib.request.urlopen(url, timeout=30) as response:
+            data = response.read(max_bytes + 1)
+    else:
+        relative = url[len("/static/"):] if url.startswith("/static/") else url.lstrip("/")
+        root = os.path.abspath(static_root)
+        path = os.path.abspath(os.path.join(root, relative))
+        if not path.startswith(root + os.sep):
+            raise ValueError(f"Путь вне каталога статики: {url}")
+        with open(path, "rb") as f:
+            data = f.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f"Исходник больше {max_bytes} байт: {url}")
+    return data
+
+
+# Задача пула: исходник читается (и скачивается) в воркере, поэтому в
+# памяти одновременно не больше исходников, чем процессов в пуле.
+# Возвращает (sha256 исходника, результат render).
+def process(source, static_root, max_bytes, sizes, formats, quality):
+    data = read_source(source, static_root, max_bytes)
+    return hashlib.sha256(data).hexdigest(), render(data, sizes, formats, quality)
+
+
+def _insert():
+    return postgresql.insert if db.engine.dialect.name == "postgresql" else sqlite.insert
+
+
+def _save(product, source_url, source_hash, variants, image_url):
+    stmt = _insert()(images).values(product_id=product.id, source_url=source_url,
+                                    source_hash=source_hash, variants=variants,
+                                    processed_at=datetime.datetime.utcnow())
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["product_id"],
+        set_={"source_url": stmt.excluded.source_url, "source_hash": stmt.excluded.source_hash,
+              "variants": stmt.excluded.variants, "processed_at": stmt.excluded.processed_at},
+    ))
+    # через ORM: onupdate сдвигает updated_at (валидаторы HTTP-кэша), а
+    # события Products обновляют кэш каталога и индексы после фиксации
+    product.image_url = image_url
+
+
+# Товары обходятся пачками по id. Чтение исходника и ресайз - в пуле;
+# пачка фиксируется одной транзакцией. Товары, у которых
+# image_url уже указывает в хранилище, пропускаются (с force - пересобираются
+# из сохраненного исходника).
+def build(store, static_root, sizes, formats, quality, variant, workers=None,
+          batch_size=100, force=False, max_bytes=20 * 1024 * 1024, echo=None):
+    if Image is None:
+        raise click.ClickException("Для обработки изображений нужен пакет Pillow")
+    processed = failed = 0
+    after = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            rows = db.session.execute(
+                select(Products, images.c.source_url)
+                .outerjoin(images, images.c.product_id == Products.id)
+                .where(Products.id > after, Products.image_url.isnot(None))
+                .order_by(Products.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            after = rows[-1][0].id
+            jobs = []
+            for product, source_url in rows:
+                derived = store.owns(product.image_url)
+                if derived and not force:
+                    continue
+                source = source_url if derived else product.image_url
+                if source is None:
+                    continue
+                jobs.append((product, source, pool.submit(
+                    process, source, static_root, max_bytes, sizes, formats, quality)))
+            for product, source, future in jobs:
+                try:
+                    digest, results = future.result()
+                except Exception as e:
+                    logger.warning("Товар %s: не удалось обработать %s: %s", product.id, source, e)
+                    failed += 1
+                    continue
+                variants = {}
+                for name, fmt, ext, width, height, data in results:
+                    variants.setdefault(name, {"width": width, "height": height})[fmt] = store.put(data, ext)
+                # в image_url - самый совместимый формат выбранного размера
+                chosen = variants.get(variant) or next(iter(variants.values()))
+                image_url = chosen.get("jpeg") or chosen[formats[0]]
+                _save(product, source, digest, variants, image_url)
+                processed += 1
+            db.session.commit()
+            if echo is not None and jobs:
+                echo(f"  обработано {processed}, ошибок {failed}, до id {after}")
+    return processed, failed
+
+
+# =========================
+# Команды
+# =========================
+@images_cli.command("build")
+@click.option("--workers", type=int, default=None, help="Процессов пула (по умолчанию - ядер).")
+@click.option("--batch-size", default=100, show_default=True)
+@click.option("--force", is_flag=True, help="Пересобрать и уже обработанные товары.")
+def build_command(workers, batch_size, force):
+    """Сделать уменьшенные WebP/JPEG и переписать image_url на них."""
+    config = current_app.config
+    assets = current_app.extensions["assets"]
+    formats = [fmt.strip() for fmt in config.get("IMAGE_FORMATS", "webp,jpeg").split(",")]
+    unknown = [fmt for fmt in formats if fmt not in FORMATS]
+    if unknown:
+        raise click.ClickException(f"Неизвестные форматы: {', '.join(unknown)}")
+    store = ImageStore(assets.media_path, assets.media_prefix)
+    processed, failed = build(
+        store, current_app.static_folder,
+        sizes=parse_sizes(config.get("IMAGE_SIZES", "thumb=160,card=480,large=1200")),
+        formats=formats,
+        quality=config.get("IMAGE_QUALITY", 80),
+        variant=config.get("IMAGE_DEFAULT_VARIANT", "card"),
+        workers=workers, batch_size=batch_size, force=force,
+        max_bytes=config.get("IMAGE_MAX_SOURCE_BYTES", 20 * 1024 * 1024),
+        echo=click.echo,
+    )
+    click.echo(f"Обработано товаров: {processed}, ошибок: {failed}")
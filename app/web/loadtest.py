@@ -0,0 +1,508 @@
+# app/web/loadtest.py
+import http.cookiejar
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, select
+from sqlalchemy.engine import Engine
+
+from .models import db, Users, Products, ProductCharacteristics
+from .seed import DEFAULT_PASSWORD, SEED_EMAIL_DOMAIN
+
+
+loadtest_cli = AppGroup("loadtest", help="Нагрузочное тестирование по живым маршрутам.")
+
+DEFAULT_MIX = "catalog=60,cart=20,checkout=5,login=10,admin=5"
+SCENARIOS = ("catalog", "reads", "cart", "checkout", "login", "admin")
+
+_METRIC_RE = re.compile(r'^(db_queries_total|db_sampled_requests_total)\{endpoint="([^"]*)"\} (\S+)$')
+
+
+# =========================
+# Задержка базы
+# =========================
+# Имитация сетевой задержки до базы (DB_SIMULATED_LATENCY): каждый запрос
+# синхронного движка спит в своем потоке. Асинхронный каталог ждет через
+# asyncio.sleep сам, его движки здесь пропускаются.
+_simulated_latency = 0.0
+
+
+def _sleep_before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _simulated_latency and not conn.dialect.is_async:
+        time.sleep(_simulated_latency)
+
+
+def simulate_db_latency(seconds):
+    global _simulated_latency
+    _simulated_latency = seconds
+    if not event.contains(Engine, "before_cursor_execute", _sleep_before_execute):
+        event.listen(Engine, "before_cursor_execute", _sleep_before_execute)
+
+
+# =========================
+# HTTP-клиент
+# =========================
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Client:
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.last_headers = {}
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, form=None, json_body=None, headers=None):
+        data, headers = None, dict(headers or {})
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        elif json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                body = response.read()
+                status = response.status
+                self.last_headers = response.headers
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            status = e.code
+            self.last_headers = e.headers
+        except (urllib.error.URLError, OSError):
+            body, status = b"", 0
+            self.last_headers = {}
+        return status, time.perf_counter() - started, body
+
+
+# =========================
+# Сценарии
+# =========================
+# Сценарий делает несколько запросов и записывает каждый под своим именем.
+# Ожидаемые статусы: все, что ниже 400, и 409 на оформлении (кончился товар).
+class Scenarios:
+    def __init__(self, data, password, admin):
+        self.data = data
+        self.password = password
+        self.admin = admin
+
+    def login(self, client, record, rng):
+        email = rng.choice(self.data["emails"])
+        record("POST /login", *client.request("POST", "/login",
+                                                form={"email": email, "password": self.password})[:2])
+
+    def catalog(self, client, record, rng):
+        record("GET /api/products", *client.request("GET", "/api/products?limit=50")[:2])
+        self.reads(client, record, rng)
+
+    # маршруты, которые обслуживает и асинхронный каталог
+    def reads(self, client, record, rng):
+        product_id = rng.choice(self.data["product_ids"])
+        record("GET /products/<id>", *client.request("GET", f"/products/{product_id}")[:2])
+        if self.data["facets"]:
+            cid, value = rng.choice(self.data["facets"])
+            record("GET /catalog/filter", *client.request("GET", f"/catalog/filter?{cid}={value}")[:2])
+        record("GET /search", *client.request("GET", "/search?q=" + urllib.parse.quote("Товар"))[:2])
+
+    def cart(self, client, record, rng):
+        product_id = rng.choice(self.data["product_ids"])
+        record("POST /api/cart/items", *client.request("POST", "/api/cart/items",
+                                                       json_body={"product_id": product_id})[:2])
+        record("GET /api/cart", *client.request("GET", "/api/cart")[:2])
+        record("GET /api/cart/badge", *client.request("GET", "/api/cart/badge")[:2])
+
+    def checkout(self, client, record, rng):
+        product_id = rng.choice(self.data["product_ids"])
+        client.request("POST", "/api/cart/items", json_body={"product_id": product_id})
+        record("POST /api/checkout", *client.request("POST", "/api/checkout")[:2], allowed=(409,))
+
+    def admin_lists(self, client, record, rng):
+        if self.admin is None:
+            return
+        for view in ("products", "orders", "users"):
+            record(f"GET /admin/{view}/", *self.admin.request("GET", f"/admin/{view}/")[:2])
+
+
+def _sample_data(users):
+    emails = db.session.execute(
+        select(Users.email).where(Users.email.like(f"%@{SEED_EMAIL_DOMAIN}")).limit(users)
+    ).scalars().all()
+    product_ids = db.session.execute(
+        select(Products.id).where(Products.is_active.isnot(False), Products.stock > 0).limit(10000)
+    ).scalars().all()
+    facets = db.session.execute(
+        select(ProductCharacteristics.characteristic_id, ProductCharacteristics.value)
+        .distinct().limit(200)
+    ).all()
+    if not emails or not product_ids:
+        raise click.ClickException("Нет данных для нагрузки, сначала выполните flask seed")
+    return {"emails": emails, "product_ids": product_ids, "facets": [tuple(f) for f in facets]}
+
+
+def _scrape_queries(base_url):
+    status, _, body = Client(base_url).request("GET", "/metrics")
+    totals = defaultdict(lambda: [0.0, 0.0])  # endpoint -> [queries, sampled]
+    if status != 200:
+        return totals
+    for line in body.decode().splitlines():
+        match = _METRIC_RE.match(line)
+        if match:
+            name, endpoint, value = match.groups()
+            totals[endpoint][0 if name == "db_queries_total" else 1] += float(value)
+    return totals
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(q * (len(values) - 1))))
+    return values[index]
+
+
+# =========================
+# Прогон
+# =========================
+def run(base_url, clients, duration, mix, password, admin_credentials, users=1000, seed=None):
+    data = _sample_data(users)
+    admin = None
+    if admin_credentials:
+        admin = Client(base_url)
+        email, admin_password = admin_credentials
+        status, _, _ = admin.request("POST", "/login", form={"email": email, "password": admin_password})
+        if status >= 400:
+            raise click.ClickException(f"Не удалось войти администратором: HTTP {status}")
+    scenarios = Scenarios(data, password, admin)
+    names = {"catalog": scenarios.catalog, "reads": scenarios.reads, "cart": scenarios.cart, "checkout": scenarios.checkout,
+             "login": scenarios.login, "admin": scenarios.admin_lists}
+    weights = [(names[name], weight) for name, weight in mix.items()]
+    needs_login = bool({"cart", "checkout"} & set(mix))
+
+    lock = threading.Lock()
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    before = _scrape_queries(base_url)
+    deadline = time.monotonic() + duration
+
+    def worker(number):
+        rng = random.Random(None if seed is None else seed + number)
+        client = Client(base_url)
+        # каждый клиент - отдельный пользователь со своей корзиной
+        if needs_login:
+            client.request("POST", "/login", form={"email": rng.choice(data["emails"]), "password": password})
+        local_latencies, local_errors = defaultdict(list), defaultdict(int)
+
+        def record(name, status, latency, allowed=()):
+            local_latencies[name].append(latency)
+            if status == 0 or (status >= 400 and status not in allowed):
+                local_errors[name] += 1
+
+        functions, scenario_weights = zip(*weights)
+        while time.monotonic() < deadline:
+            rng.choices(functions, scenario_weights)[0](client, record, rng)
+        with lock:
+            for name, values in local_latencies.items():
+                latencies[name].extend(values)
+            for name, count in local_errors.items():
+                errors[name] += count
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(number,), daemon=True) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    after = _scrape_queries(base_url)
+
+    queries = {}
+    for endpoint, (total, sampled) in after.items():
+        delta_sampled = sampled - before[endpoint][1]
+        if delta_sampled > 0:
+            queries[endpoint] = (total - before[endpoint][0]) / delta_sampled
+
+    report = {"clients": clients, "duration": round(elapsed, 2), "requests": {},
+              "queries_per_request": {k: round(v, 2) for k, v in sorted(queries.items())}}
+    total_requests = 0
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        total_requests += len(values)
+        report["requests"][name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(_percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(_percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(_percentile(values, 0.99) * 1000, 2),
+        }
+    report["throughput_rps"] = round(total_requests / elapsed, 2)
+    return report
+
+
+def compare(report, baseline, tolerance):
+    failures = []
+    expected = baseline.get("throughput_rps")
+    if expected and report["throughput_rps"] < expected * (1 - tolerance):
+        failures.append(f"пропускная способность {report['throughput_rps']} < {expected}")
+    for name, stats in report["requests"].items():
+        base = baseline.get("requests", {}).get(name)
+        if stats["errors"]:
+            failures.append(f"{name}: ошибок {stats['errors']}")
+        if base and stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            failures.append(f"{name}: p95 {stats['p95_ms']} мс > {base['p95_ms']} мс")
+    for endpoint, value in report["queries_per_request"].items():
+        base = baseline.get("queries_per_request", {}).get(endpoint)
+        # число запросов к базе не зависит от шума, допуск - ползапроса
+        if base is not None and value > base + 0.5:
+            failures.append(f"{endpoint}: запросов к базе {value} > {base}")
+    return failures
+
+
+def _parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise click.BadParameter(f"Неизвестный сценарий: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+@loadtest_cli.command("run")
+@click.option("--base-url", default="http://127.0.0.1:5000", show_default=True)
+@click.option("--clients", default=16, show_default=True, help="Одновременных клиентов.")
+@click.option("--duration", default=30, show_default=True, help="Длительность, секунды.")
+@click.option("--mix", default=DEFAULT_MIX, show_default=True, help="Веса сценариев.")
+@click.option("--password", default=DEFAULT_PASSWORD, show_default=True,
+              help="Пароль синтетических пользователей (flask seed --password).")
+@click.option("--baseline", type=click.Path(dir_okay=False), default=None,
+              help="JSON с базовыми результатами; регрессия - код 1.")
+@click.option("--update-baseline", is_flag=True, help="Записать результат в --baseline.")
+@click.option("--tolerance", default=0.25, show_default=True, help="Допуск по p95 и пропускной способности.")
+@click.option("--seed", "random_seed", type=int, default=None)
+def run_command(base_url, clients, duration, mix, password, baseline, update_baseline,
+                tolerance, random_seed):
+    """Нагрузить запущенный сервер: вход, каталог, админка, корзина, заказ.
+
+    Все клиенты идут с одного адреса: сервер запускать с RATELIMIT_ENABLED=0.
+    """
+    admin = None
+    if os.getenv("ADMIN_EMAIL") and os.getenv("ADMIN_PASSWORD"):
+        admin = (os.getenv("ADMIN_EMAIL"), os.getenv("ADMIN_PASSWORD"))
+    mix = _parse_mix(mix)
+    if "admin" in mix and admin is None:
+        click.echo("ADMIN_EMAIL/ADMIN_PASSWORD не заданы, сценарий admin пропущен")
+    report = run(base_url, clients, duration, mix, password, admin, seed=random_seed)
+
+    click.echo(f"{'запрос':<24}{'кол-во':>8}{'ошибки':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, stats in report["requests"].items():
+        click.echo(f"{name:<24}{stats['count']:>8}{stats['errors']:>8}{stats['rps']:>9}"
+                   f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}")
+    click.echo(f"Всего: {report['throughput_rps']} запросов/с")
+    for endpoint, value in report["queries_per_request"].items():
+        click.echo(f"  {endpoint}: {value} запросов к базе на запрос")
+
+    if baseline and update_baseline:
+        with open(baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        click.echo(f"Базовый результат записан в {baseline}")
+        return
+    if baseline and os.path.exists(baseline):
+        with open(baseline, encoding="utf-8") as f:
+            failures = compare(report, json.load(f), tolerance)
+        if failures:
+            raise click.ClickException("Регрессия производительности:\n" + "\n".join(failures))
+        click.echo("Регрессий относительно базового результата нет")
+
+
+@loadtest_cli.command("compare")
+@click.option("--wsgi-url", default="http://127.0.0.1:5000", show_default=True)
+@click.option("--asgi-url", default="http://127.0.0.1:8000", show_default=True)
+@click.option("--wsgi-cores", default=1, show_default=True, help="Процессов WSGI-сервера.")
+@click.option("--asgi-cores", default=1, show_default=True, help="Процессов ASGI-сервера.")
+@click.option("--clients", default=64, show_default=True, help="Одновременных клиентов.")
+@click.option("--duration", default=30, show_default=True, help="Длительность каждого прогона, секунды.")
+@click.option("--seed", "random_seed", type=int, default=None)
+def compare_command(wsgi_url, asgi_url, wsgi_cores, asgi_cores, clients, duration, random_seed):
+    """Сравнить чтение каталога на WSGI и ASGI (запросов/с на ядро).
+
+    Оба сервера запускаются заранее с одинаковым DB_SIMULATED_LATENCY;
+    WSGI - с CATALOG_CACHE_TTL=0, чтобы чтение шло в базу, как в ASGI.
+    """
+    results = []
+    for label, url, cores in (("wsgi", wsgi_url, wsgi_cores), ("asgi", asgi_url, asgi_cores)):
+        click.echo(f"{label}: {url}, {clients} клиентов, {duration} с")
+        report = run(url, clients, duration, {"reads": 1}, DEFAULT_PASSWORD, None, seed=random_seed)
+        requests = report["requests"].values()
+        errors = sum(stats["errors"] for stats in requests)
+        p95 = max((stats["p95_ms"] for stats in requests), default=0)
+        results.append((label, report["throughput_rps"], report["throughput_rps"] / cores, p95, errors))
+
+    click.echo(f"{'сервер':<8}{'rps':>10}{'rps/ядро':>10}{'p95 max':>10}{'ошибки':>8}")
+    for label, rps, per_core, p95, errors in results:
+        click.echo(f"{label:<8}{rps:>10.1f}{per_core:>10.1f}{p95:>10.1f}{errors:>8}")
+    if results[0][2]:
+        click.echo(f"ASGI/WSGI на ядро: {results[1][2] / results[0][2]:.2f}x")
+
+
+def _parity_paths(products, facets):
+    product_ids = db.session.execute(
+        select(Products.id).where(Products.is_active.isnot(False)).order_by(Products.id).limit(products)
+    ).scalars().all()
+    pairs = db.session.execute(
+        select(ProductCharacteristics.characteristic_id, ProductCharacteristics.value)
+        .distinct().limit(facets)
+    ).all()
+    if not product_ids:
+        raise click.ClickException("Нет товаров для сравнения, сначала выполните flask seed")
+    paths = [f"/products/{product_id}" for product_id in product_ids]
+    paths.append(f"/products/{product_ids[-1] + 1000000}")
+    paths.append("/catalog/filter?limit=20")
+    paths.extend(f"/catalog/filter?{cid}={urllib.parse.quote(value)}" for cid, value in pairs)
+    paths.extend("/search?q=" + urllib.parse.quote(q) for q in ("Товар", "товар 1", "zzzz"))
+    return paths
+
+
+@loadtest_cli.command("parity")
+@click.option("--wsgi-url", default="http://127.0.0.1:5000", show_default=True)
+@click.option("--asgi-url", default="http://127.0.0.1:8000", show_default=True)
+@click.option("--products", default=20, show_default=True, help="Карточек товаров для сравнения.")
+@click.option("--facets", default=20, show_default=True, help="Значений фильтра для сравнения.")
+def parity_command(wsgi_url, asgi_url, products, facets):
+    """Проверить, что WSGI и ASGI отдают одинаковые ответы каталога.
+
+    Сравниваются статус, тело байт в байт и ETag; ETag одного сервера
+    должен давать 304 на другом. Расхождение - код 1.
+    """
+    servers = (("wsgi", Client(wsgi_url)), ("asgi", Client(asgi_url)))
+    failures = []
+    paths = _parity_paths(products, facets)
+    for path in paths:
+        responses = []
+        for label, client in servers:
+            status, _, body = client.request("GET", path)
+            if status == 0:
+                raise click.ClickException(f"{label}: сервер недоступен")
+            responses.append((status, body, client.last_headers.get("ETag")))
+        (wsgi_status, wsgi_body, wsgi_etag), (asgi_status, asgi_body, asgi_etag) = responses
+        if wsgi_status != asgi_status:
+            failures.append(f"{path}: статус {wsgi_status} / {asgi_status}")
+            continue
+        if wsgi_body != asgi_body:
+            failures.append(f"{path}: тела различаются ({len(wsgi_body)} / {len(asgi_body)} байт)")
+        if wsgi_etag != asgi_etag:
+            failures.append(f"{path}: ETag {wsgi_etag} / {asgi_etag}")
+        elif wsgi_etag:
+            for (label, client), etag in zip(servers, (asgi_etag, wsgi_etag)):
+                status, _, _ = client.request("GET", path, headers={"If-None-Match": etag})
+                if status != 304:
+                    failures.append(f"{path}: {label} на чужой ETag ответил {status}")
+    if failures:
+        raise click.ClickException("Ответы различаются:\n" + "\n".join(failures))
+    click.echo(f"Ответы совпадают: {len(paths)} запросов")
+
+
+# =========================
+# Вес страницы
+# =========================
+# Страница каталога = JSON списка товаров + их изображения + статика из
+# manifest.json. Считаются байты по сети (urllib не распаковывает ответ)
+# и сколько ответов придется перепроверять при повторном визите.
+def _page_resources(base_url, products):
+    status, _, body = Client(base_url).request("GET", f"/api/products?limit={products}&fields=id,image_url")
+    if status != 200:
+        raise click.ClickException(f"/api/products: HTTP {status}")
+    paths = [f"/api/products?limit={products}&fields=id,image_url"]
+    for item in json.loads(body)["items"]:
+        url = item.get("image_url")
+        if url:
+            paths.append(url if url.startswith("/") else urllib.parse.urlparse(url).path)
+    assets = current_app.extensions.get("assets")
+    if assets is not None:
+        paths.extend(assets.url(name) for name in sorted(assets.manifest) or ["css/style.css"])
+    return paths
+
+
+def page_weight(base_url, paths, encoding):
+    client = Client(base_url)
+    total = revalidate = errors = 0
+    for path in paths:
+        status, _, body = client.request("GET", path, headers={"Accept-Encoding": encoding})
+        if status != 200:
+            errors += 1
+            continue
+        total += len(body)
+        if "immutable" not in client.last_headers.get("Cache-Control", ""):
+            revalidate += 1
+    return {"requests": len(paths), "bytes": total, "revalidate": revalidate, "errors": errors}
+
+
+@loadtest_cli.command("page-weight")
+@click.option("--base-url", default="http://127.0.0.1:5000", show_default=True)
+@click.option("--products", default=50, show_default=True, help="Товаров на странице каталога.")
+@click.option("--clients", default=16, show_default=True, help="Клиентов в прогоне пропускной способности.")
+@click.option("--duration", default=10, show_default=True, help="Длительность прогона, секунды; 0 - без него.")
+def page_weight_command(base_url, products, clients, duration):
+    """Вес страницы каталога и пропускная способность отдачи статики и изображений."""
+    paths = _page_resources(base_url, products)
+    click.echo(f"{'кодировка':<12}{'запросов':>10}{'байт':>12}{'перепроверка':>14}{'ошибки':>8}")
+    for encoding in ("identity", "gzip", "br, gzip"):
+        weight = page_weight(base_url, paths, encoding)
+        click.echo(f"{encoding:<12}{weight['requests']:>10}{weight['bytes']:>12}"
+                   f"{weight['revalidate']:>14}{weight['errors']:>8}")
+    if not duration:
+        return
+
+    # только файлы: JSON каталога нагружается сценариями run
+    files = paths[1:]
+    if not files:
+        raise click.ClickException("На странице нет изображений и статики")
+    lock = threading.Lock()
+    totals = {"requests": 0, "bytes": 0, "errors": 0, "latencies": []}
+    deadline = time.monotonic() + duration
+
+    def worker(number):
+        rng = random.Random(number)
+        client = Client(base_url)
+        count, size, errors, latencies = 0, 0, 0, []
+        while time.monotonic() < deadline:
+            status, latency, body = client.request("GET", rng.choice(files),
+                                                   headers={"Accept-Encoding": "br, gzip"})
+            count += 1
+            size += len(body)
+            latencies.append(latency)
+            if status != 200:
+                errors += 1
+        with lock:
+            totals["requests"] += count
+            totals["bytes"] += size
+            totals["errors"] += errors
+            totals["latencies"].extend(latencies)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(number,), daemon=True) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    latencies = sorted(totals["latencies"])
+    click.echo(f"Файлы: {totals['requests'] / elapsed:.1f} запросов/с, "
+               f"{totals['bytes'] / elapsed / 1024 / 1024:.2f} МБ/с, "
+               f"p95 {(_percentile(latencies, 0.95) or 0) * 1000:.1f} мс, ошибок {totals['errors']}")
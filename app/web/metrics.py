@@ -0,0 +1,228 @@
+# app/web/metrics.py
+import hmac
+import ipaddress
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, abort, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .models import db
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_SPACES_RE = re.compile(r"\s+")
+# IN (?, ?, ?) / IN (%(p_1)s, %(p_2)s) - длина списка не влияет на отпечаток
+_IN_LIST_RE = re.compile(r"\((?:\s*(?:\?|%\([^)]*\)s|%s|:\w+)\s*,)+\s*(?:\?|%\([^)]*\)s|%s|:\w+)\s*\)")
+
+
+def fingerprint(statement):
+    statement = _SPACES_RE.sub(" ", statement).strip()
+    return _IN_LIST_RE.sub("(...)", statement)[:300]
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+# =========================
+# Статистика по эндпоинту
+# =========================
+class EndpointStats:
+    __slots__ = ("requests", "sampled", "queries", "db_time", "buckets",
+                 "latency_sum", "slowest", "slowest_time", "n_plus_one")
+
+    def __init__(self):
+        self.requests = 0
+        self.sampled = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.slowest = None
+        self.slowest_time = 0.0
+        self.n_plus_one = Counter()
+
+
+# =========================
+# Инструментирование SQL
+# =========================
+class SQLMetrics:
+    def __init__(self, sample_rate=1.0, n_plus_one_threshold=5):
+        self.sample_rate = sample_rate
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.token = None
+        self.allowed_networks = []
+        self._lock = threading.Lock()
+        self._endpoints = defaultdict(EndpointStats)
+
+    def init_app(self, app):
+        self.sample_rate = app.config.get("METRICS_SAMPLE_RATE", self.sample_rate)
+        self.n_plus_one_threshold = app.config.get("METRICS_N_PLUS_ONE_THRESHOLD",
+                                                   self.n_plus_one_threshold)
+        self.token = app.config.get("METRICS_TOKEN") or None
+        self.allowed_networks = [ipaddress.ip_network(value, strict=False)
+                                 for value in app.config.get("METRICS_ALLOWED_IPS", ("127.0.0.1", "::1"))]
+        app.extensions["sql_metrics"] = self
+        app.before_request(self._before_request)
+        # teardown вызывается и для запросов, упавших с 500, и когда
+        # after_request не доходит до нашего обработчика
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+        # слушаем класс Engine, чтобы покрыть все движки приложения
+        if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+    # ---------- Хуки запроса ----------
+    def _before_request(self):
+        g._metrics_started = time.perf_counter()
+        if self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+            g._sql = {"count": 0, "time": 0.0, "slowest": None, "slowest_time": 0.0,
+                      "fingerprints": Counter()}
+
+    def _teardown_request(self, exc=None):
+        started = g.pop("_metrics_started", None)
+        if started is None:
+            return
+        latency = time.perf_counter() - started
+        endpoint = request.endpoint or "unknown"
+        sql = g.pop("_sql", None)
+
+        repeated = []
+        if sql is not None:
+            repeated = [(fp, n) for fp, n in sql["fingerprints"].items()
+                        if n >= self.n_plus_one_threshold]
+            for fp, n in repeated:
+                logger.warning("Возможный N+1 в %s: %d повторов %s", endpoint, n, fp)
+
+        with self._lock:
+            stats = self._endpoints[endpoint]
+            stats.requests += 1
+            stats.latency_sum += latency
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    stats.buckets[index] += 1
+            if sql is not None:
+                stats.sampled += 1
+                stats.queries += sql["count"]
+                stats.db_time += sql["time"]
+                if sql["slowest_time"] > stats.slowest_time:
+                    stats.slowest_time = sql["slowest_time"]
+                    stats.slowest = sql["slowest"]
+                for fp, _ in repeated:
+                    stats.n_plus_one[fp] += 1
+
+    # ---------- Экспорт ----------
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: {
+                "requests": s.requests,
+                "sampled": s.sampled,
+                "queries": s.queries,
+                "db_time": s.db_time,
+                "latency_sum": s.latency_sum,
+                "buckets": list(s.buckets),
+                "slowest": s.slowest,
+                "slowest_time": s.slowest_time,
+                "n_plus_one": dict(s.n_plus_one),
+            } for endpoint, s in self._endpoints.items()}
+
+    def render(self):
+        lines = []
+        snapshot = self.snapshot()
+
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for endpoint, s in snapshot.items():
+            label = _label(endpoint)
+            for bound, count in zip(LATENCY_BUCKETS, s["buckets"]):
+                lines.append(f'http_request_duration_seconds_bucket{{endpoint="{label}",le="{bound}"}} {count}')
+            lines.append(f'http_request_duration_seconds_bucket{{endpoint="{label}",le="+Inf"}} {s["requests"]}')
+            lines.append(f'http_request_duration_seconds_sum{{endpoint="{label}"}} {s["latency_sum"]}')
+            lines.append(f'http_request_duration_seconds_count{{endpoint="{label}"}} {s["requests"]}')
+
+        # семейства метрик выводятся целиком, одно за другим
+        for name, kind, key in (("db_sampled_requests_total", "counter", "sampled"),
+                                ("db_queries_total", "counter", "queries"),
+                                ("db_time_seconds_total", "counter", "db_time")):
+            lines.append(f"# TYPE {name} {kind}")
+            for endpoint, s in snapshot.items():
+                lines.append(f'{name}{{endpoint="{_label(endpoint)}"}} {s[key]}')
+
+        lines.append("# TYPE db_slowest_query_seconds gauge")
+        for endpoint, s in snapshot.items():
+            if s["slowest"]:
+                lines.append(f'db_slowest_query_seconds{{endpoint="{_label(endpoint)}",statement="{_label(s["slowest"])}"}} {s["slowest_time"]}')
+
+        lines.append("# TYPE db_n_plus_one_total counter")
+        for endpoint, s in snapshot.items():
+            for fp, count in s["n_plus_one"].items():
+                lines.append(f'db_n_plus_one_total{{endpoint="{_label(endpoint)}",statement="{_label(fp)}"}} {count}')
+
+        pool = db.engine.pool
+        lines.append("# TYPE db_pool_connections gauge")
+        for state in ("size", "checkedin", "checkedout", "overflow"):
+            getter = getattr(pool, state, None)
+            if getter is not None:
+                lines.append(f'db_pool_connections{{state="{state}"}} {getter()}')
+
+        for name in ("catalog_cache", "principal_cache", "replicas", "reservations", "rate_limiter"):
+            cache = current_app.extensions.get(name)
+            if cache is None:
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in cache.stats().items():
+                lines.append(f'{name}{{stat="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    # /metrics отдает SQL и состояние кэшей: только адресам из
+    # METRICS_ALLOWED_IPS или с заголовком Authorization: Bearer METRICS_TOKEN
+    def allowed(self):
+        if self.token:
+            header = request.headers.get("Authorization", "")
+            if header.startswith("Bearer ") and hmac.compare_digest(header[len("Bearer "):].encode(),
+                                                                     self.token.encode()):
+                return True
+        try:
+            address = ipaddress.ip_address(request.remote_addr or "")
+        except ValueError:
+            return False
+        return any(address in network for network in self.allowed_networks)
+
+    def metrics_view(self):
+        if not self.allowed():
+            abort(403)
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+
+# =========================
+# События движка
+# =========================
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if g and "_sql" in g:
+        conn.info.setdefault("_metrics_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not g or "_sql" not in g:
+        return
+    starts = conn.info.get("_metrics_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    sql = g._sql
+    sql["count"] += 1
+    sql["time"] += elapsed
+    fp = fingerprint(statement)
+    sql["fingerprints"][fp] += 1
+    if elapsed > sql["slowest_time"]:
+        sql["slowest_time"] = elapsed
+        sql["slowest"] = fp
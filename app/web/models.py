@@ -4,7 +4,9 @@ from werkzeug.security import generate_password_hash, check_password_hash
 import datetime
 import decimal
 
-db = SQLAlchemy()
+from .replicas import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 # =========================
 # Роли
@@ -28,7 +30,7 @@ class Users(db.Model):
     username = db.Column(db.String, nullable=False)
     email = db.Column(db.String, nullable=False, unique=True)
     password_hash = db.Column(db.String, nullable=False)
-    role_id = db.Column(db.Integer, db.ForeignKey("roles.id", ondelete="CASCADE"), nullable=False)
+    role_id = db.Column(db.Integer, db.ForeignKey("roles.id", ondelete="CASCADE"), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
     role = db.relationship("Roles", back_populates="users")
@@ -48,6 +50,11 @@ class Users(db.Model):
 # =========================
 class Products(db.Model):
     __tablename__ = "products"
+    __table_args__ = (
+        # keyset-пагинация /api/products: порядок индекса совпадает с ORDER BY
+        db.Index("ix_products_created_at_id", db.text("created_at DESC"), db.text("id DESC")),
+        db.Index("ix_products_price_id", "price", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False, index=True)
@@ -55,8 +62,8 @@ class Products(db.Model):
     stock = db.Column(db.Integer, nullable=False)
     description = db.Column(db.Text)
     image_url = db.Column(db.String)
-    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, index=True)
     is_active = db.Column(db.Boolean, default=True)
 
     product_characteristics = db.relationship("ProductCharacteristics", back_populates="product")
@@ -83,8 +90,8 @@ class ProductCharacteristics(db.Model):
     __tablename__ = "product_characteristics"
 
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
-    characteristic_id = db.Column(db.Integer, db.ForeignKey("characteristics.id", ondelete="CASCADE"), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
+    characteristic_id = db.Column(db.Integer, db.ForeignKey("characteristics.id", ondelete="CASCADE"), nullable=False, index=True)
     value = db.Column(db.String, nullable=False)
 
     product = db.relationship("Products", back_populates="product_characteristics")
@@ -96,12 +103,20 @@ class ProductCharacteristics(db.Model):
 # =========================
 class Carts(db.Model):
     __tablename__ = "carts"
+    __table_args__ = (
+        db.Index("ix_carts_is_active_updated_at", "is_active", "updated_at"),
+        db.Index("ix_carts_user_id_id", "user_id", "id"),
+        # не больше одной активной корзины на пользователя
+        db.Index("ux_carts_user_id_active", "user_id", unique=True,
+                 postgresql_where=db.text("is_active"), sqlite_where=db.text("is_active")),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    is_active = db.Column(db.Boolean, default=True)
+    # NOT NULL: фильтр is_active = true использует индекс (is_active, updated_at)
+    is_active = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true())
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     user = db.relationship("Users", back_populates="carts")
     cart_items = db.relationship("CartItems", back_populates="cart")
@@ -113,10 +128,13 @@ class Carts(db.Model):
 # =========================
 class CartItems(db.Model):
     __tablename__ = "cart_items"
+    __table_args__ = (
+        db.UniqueConstraint("cart_id", "product_id", name="uq_cart_items_cart_product"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     cart_id = db.Column(db.Integer, db.ForeignKey("carts.id", ondelete="CASCADE"), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
     quantity = db.Column(db.Integer, nullable=False)
     added_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
@@ -129,11 +147,17 @@ class CartItems(db.Model):
 # =========================
 class Favorites(db.Model):
     __tablename__ = "favorites"
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "product_id", name="unique_user_product_fav"),
+        db.Index("ix_favorites_user_id_added_at_id", "user_id", "added_at", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
-    added_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
+    # NOT NULL: ключ keyset-пагинации /api/favorites
+    added_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow,
+                         server_default=db.func.now(), index=True)
 
     user = db.relationship("Users", back_populates="favorites")
     product = db.relationship("Products", back_populates="favorites")
@@ -156,15 +180,145 @@ class OrderStatuses(db.Model):
 # =========================
 class Orders(db.Model):
     __tablename__ = "orders"
+    __table_args__ = (
+        db.Index("ix_orders_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    cart_id = db.Column(db.Integer, db.ForeignKey("carts.id", ondelete="CASCADE"), nullable=False)
+    cart_id = db.Column(db.Integer, db.ForeignKey("carts.id", ondelete="CASCADE"), nullable=False, index=True)
     status_id = db.Column(db.Integer, db.ForeignKey("order_statuses.id"), nullable=False)
     total_amount = db.Column(db.Numeric(10,2), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # NOT NULL: ключ keyset-пагинации /api/orders
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow,
+                           server_default=db.func.now(), index=True)
+    # NOT NULL: инкрементальные сводки фильтруют по updated_at напрямую, по индексу
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow, server_default=db.func.now(), index=True)
 
     user = db.relationship("Users", back_populates="orders")
     cart = db.relationship("Carts", back_populates="orders")
     status = db.relationship("OrderStatuses", back_populates="orders")
+
+
+# =========================
+# Исходящие события (outbox)
+# =========================
+class OutboxEvents(db.Model):
+    __tablename__ = "outbox_events"
+    __table_args__ = (
+        # захват идет по id среди живых событий; обработанные в индекс не попадают
+        db.Index("ix_outbox_events_live", "id",
+                 postgresql_where=db.text("status IN ('pending', 'processing')"),
+                 sqlite_where=db.text("status IN ('pending', 'processing')")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String, nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String, nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    processed_at = db.Column(db.DateTime)
+
+
+# =========================
+# Сводки продаж
+# =========================
+class SalesRollups(db.Model):
+    __tablename__ = "sales_rollups"
+    __table_args__ = (
+        db.UniqueConstraint("granularity", "bucket", "status_id", "cohort", name="uq_sales_rollups_key"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String, nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    status_id = db.Column(db.Integer, db.ForeignKey("order_statuses.id", ondelete="CASCADE"), nullable=False)
+    cohort = db.Column(db.String, nullable=False)
+    orders_count = db.Column(db.Integer, nullable=False)
+    total_amount = db.Column(db.Numeric(14,2), nullable=False)
+
+
+class RollupState(db.Model):
+    __tablename__ = "rollup_state"
+
+    name = db.Column(db.String, primary_key=True)
+    high_water = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+# =========================
+# Рекомендации товаров
+# =========================
+# Соседи товара хранятся одной строкой: упакованные int32 id и float32 оценки
+class ProductRecommendations(db.Model):
+    __tablename__ = "product_recommendations"
+
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    neighbor_ids = db.Column(db.LargeBinary, nullable=False)
+    scores = db.Column(db.LargeBinary, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+
+# =========================
+# Счетчики популярности
+# =========================
+class ProductCounters(db.Model):
+    __tablename__ = "product_counters"
+
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    favorites_count = db.Column(db.Integer, nullable=False, default=0)
+    cart_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+
+# =========================
+# Резервы товара
+# =========================
+# Резерв строки корзины до expires_at; shard - строка счетчика, в которой
+# он учтен. Повторное добавление в корзину увеличивает quantity.
+class StockReservations(db.Model):
+    __tablename__ = "stock_reservations"
+    __table_args__ = (
+        db.UniqueConstraint("cart_id", "product_id", "shard", name="uq_stock_reservations_cart_product_shard"),
+        db.Index("ix_stock_reservations_product_id_shard", "product_id", "shard"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.Integer, db.ForeignKey("carts.id", ondelete="CASCADE"), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    shard = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+
+# Счетчик резервов, разбитый на несколько строк на товар: quota - доля
+# остатка products.stock, reserved - сколько из нее занято. Сумма quota
+# по товару равна stock, свободно sum(quota - reserved).
+class StockShards(db.Model):
+    __tablename__ = "stock_shards"
+
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    quota = db.Column(db.Integer, nullable=False, default=0)
+    reserved = db.Column(db.Integer, nullable=False, default=0)
+
+
+# =========================
+# Изображения товаров
+# =========================
+# Производные исходного изображения: variants = {размер: {"width", "height",
+# формат: url}}; products.image_url указывает на один из вариантов.
+class ProductImages(db.Model):
+    __tablename__ = "product_images"
+
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    source_url = db.Column(db.String, nullable=False)
+    source_hash = db.Column(db.String(64), nullable=False)
+    variants = db.Column(db.JSON, nullable=False)
+    processed_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
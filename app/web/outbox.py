@@ -0,0 +1,268 @@
+# app/web/outbox.py
+import datetime
+import json
+import logging
+import math
+import signal
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, delete, event, insert, or_, select, text, update
+
+from .models import db, Orders, OutboxEvents
+
+
+logger = logging.getLogger(__name__)
+
+outbox_cli = AppGroup("outbox", help="Фоновая обработка исходящих событий.")
+
+events = OutboxEvents.__table__
+
+
+# =========================
+# Запись событий
+# =========================
+# Событие пишется тем же соединением и в той же транзакции, что и
+# изменение заказа: либо есть и заказ, и событие, либо ничего.
+def _publish(connection, topic, payload):
+    now = datetime.datetime.utcnow()
+    connection.execute(insert(events).values(
+        topic=topic, payload=payload, status="pending", attempts=0,
+        created_at=now, available_at=now,
+    ))
+
+
+def _on_order_insert(mapper, connection, target):
+    _publish(connection, "order.created", {
+        "order_id": target.id,
+        "user_id": target.user_id,
+        "cart_id": target.cart_id,
+        "status_id": target.status_id,
+    })
+
+
+def _on_order_update(mapper, connection, target):
+    history = db.inspect(target).attrs.status_id.history
+    if not history.has_changes():
+        return
+    _publish(connection, "order.status_changed", {
+        "order_id": target.id,
+        "user_id": target.user_id,
+        "old_status_id": history.deleted[0] if history.deleted else None,
+        "status_id": target.status_id,
+    })
+
+
+# =========================
+# Обработчики
+# =========================
+# Кроме обработчиков из кода, все события могут уходить POST-запросом на
+# OUTBOX_WEBHOOK_URL. Доставка не чаще одного раза не гарантируется:
+# получатель отбрасывает повторы по id события.
+class Outbox:
+    def __init__(self, batch_size=100, workers=4, max_attempts=8, lease=60, poll_interval=1.0,
+                 webhook_url=None, webhook_timeout=10.0, retention_days=7):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.webhook_url = webhook_url
+        self.webhook_timeout = webhook_timeout
+        self.retention_days = retention_days
+        self._handlers = defaultdict(list)
+
+    def init_app(self, app):
+        self.batch_size = app.config.get("OUTBOX_BATCH_SIZE", self.batch_size)
+        self.workers = app.config.get("OUTBOX_WORKERS", self.workers)
+        self.max_attempts = app.config.get("OUTBOX_MAX_ATTEMPTS", self.max_attempts)
+        self.lease = app.config.get("OUTBOX_LEASE", self.lease)
+        self.poll_interval = app.config.get("OUTBOX_POLL_INTERVAL", self.poll_interval)
+        self.webhook_url = app.config.get("OUTBOX_WEBHOOK_URL", self.webhook_url)
+        self.webhook_timeout = app.config.get("OUTBOX_WEBHOOK_TIMEOUT", self.webhook_timeout)
+        self.retention_days = app.config.get("OUTBOX_RETENTION_DAYS", self.retention_days)
+        app.extensions["outbox"] = self
+        if not event.contains(Orders, "after_insert", _on_order_insert):
+            event.listen(Orders, "after_insert", _on_order_insert)
+            event.listen(Orders, "after_update", _on_order_update)
+
+    # @outbox.handler("order.created")
+    def handler(self, topic):
+        def decorator(fn):
+            self._handlers[topic].append(fn)
+            return fn
+        return decorator
+
+    # ---------- Захват пачки ----------
+    # Итоги пачки пишутся после обработки всех ее событий, поэтому аренда
+    # должна пережить всю пачку: batch_size / workers волн, каждая - до
+    # таймаута вебхука. Иначе на медленном получателе аренда истекает
+    # посреди пачки, и другой обработчик повторно доставляет те же события.
+    # lease - запас сверху на обработчики из кода и фиксацию.
+    def batch_lease(self):
+        waves = math.ceil(self.batch_size / max(self.workers, 1))
+        return self.lease + (waves * self.webhook_timeout if self.webhook_url else 0)
+
+    def claim(self):
+        now = datetime.datetime.utcnow()
+        lease_until = now + datetime.timedelta(seconds=self.batch_lease())
+        if db.engine.dialect.name == "postgresql":
+            rows = db.session.execute(text("""
+                UPDATE outbox_events e
+                SET status = 'processing', attempts = e.attempts + 1, locked_until = :lease_until
+                WHERE e.id IN (
+                    SELECT id FROM outbox_events
+                    WHERE (status = 'pending' AND available_at <= :now)
+                       OR (status = 'processing' AND locked_until < :now)
+                    ORDER BY id
+                    LIMIT :limit
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING e.id, e.topic, e.payload, e.attempts, e.locked_until
+            """), {"now": now, "lease_until": lease_until, "limit": self.batch_size}).all()
+        else:
+            # SQLite: запись сериализуется самой базой, условный UPDATE
+            # с RETURNING отдает только реально захваченные строки
+            claimable = or_(
+                and_(events.c.status == "pending", events.c.available_at <= now),
+                and_(events.c.status == "processing", events.c.locked_until < now),
+            )
+            ids = db.session.execute(
+                select(events.c.id).where(claimable).order_by(events.c.id).limit(self.batch_size)
+            ).scalars().all()
+            rows = []
+            if ids:
+                rows = db.session.execute(
+                    update(events)
+                    .where(events.c.id.in_(ids), claimable)
+                    .values(status="processing", attempts=events.c.attempts + 1,
+                            locked_until=lease_until)
+                    .returning(events.c.id, events.c.topic, events.c.payload, events.c.attempts,
+                               events.c.locked_until)
+                ).all()
+        db.session.commit()
+        return rows
+
+    # ---------- Обработка ----------
+    def _deliver(self, event_id, topic, payload):
+        body = json.dumps({"id": event_id, "topic": topic, "payload": payload}).encode()
+        request = urllib.request.Request(self.webhook_url, data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        # ответ не 2xx - HTTPError, событие уйдет на повтор
+        with urllib.request.urlopen(request, timeout=self.webhook_timeout) as response:
+            response.read()
+
+    def _handle(self, app, event_id, topic, payload):
+        with app.app_context():
+            for fn in self._handlers.get(topic, ()):
+                fn(payload)
+            if self.webhook_url:
+                self._deliver(event_id, topic, payload)
+
+    def process_batch(self, executor):
+        rows = self.claim()
+        if not rows:
+            return 0
+        app = current_app._get_current_object()
+        futures = [(row, executor.submit(self._handle, app, row.id, row.topic, row.payload))
+                   for row in rows]
+        now = datetime.datetime.utcnow()
+        for row, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.exception("Ошибка обработчика %s для события %s", row.topic, row.id)
+                if row.attempts >= self.max_attempts:
+                    values = {"status": "dead", "last_error": repr(e), "locked_until": None}
+                else:
+                    # экспоненциальная задержка перед следующей попыткой
+                    delay = min(3600, 2 ** row.attempts)
+                    values = {"status": "pending", "last_error": repr(e), "locked_until": None,
+                              "available_at": now + datetime.timedelta(seconds=delay)}
+            else:
+                values = {"status": "done", "processed_at": now, "locked_until": None}
+            # аренда могла истечь, а событие - уйти другому обработчику:
+            # тогда его строку меняет уже он
+            result = db.session.execute(
+                update(events)
+                .where(events.c.id == row.id, events.c.status == "processing",
+                       events.c.locked_until == row.locked_until)
+                .values(**values)
+            )
+            if not result.rowcount:
+                logger.warning("Аренда события %s потеряна, результат отброшен", row.id)
+        db.session.commit()
+        return len(rows)
+
+    # ---------- Очистка ----------
+    def purge(self, older_than_days=None, batch_size=1000):
+        days = self.retention_days if older_than_days is None else older_than_days
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+        deleted = 0
+        while True:
+            # done-строки идут почти в порядке id: пачка берется с начала PK
+            ids = db.session.execute(
+                select(events.c.id)
+                .where(events.c.status == "done", events.c.processed_at < cutoff)
+                .order_by(events.c.id)
+                .limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                return deleted
+            deleted += db.session.execute(delete(events).where(events.c.id.in_(ids))).rowcount
+            db.session.commit()
+
+    def run(self, once=False):
+        stop = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not stop.is_set():
+                processed = self.process_batch(executor)
+                if once:
+                    return processed
+                if processed < self.batch_size:
+                    stop.wait(self.poll_interval)
+
+
+# =========================
+# Команды
+# =========================
+@outbox_cli.command("worker")
+@click.option("--once", is_flag=True, help="Обработать одну пачку и выйти.")
+def worker(once):
+    """Обработчик исходящих событий; можно запускать в нескольких экземплярах."""
+    outbox = current_app.extensions["outbox"]
+    try:
+        processed = outbox.run(once=once)
+    except KeyboardInterrupt:
+        return
+    if once:
+        click.echo(f"Обработано событий: {processed}")
+
+
+@outbox_cli.command("purge")
+@click.option("--older-than", "older_than", type=int, default=None,
+              help="Дней хранения обработанных событий (по умолчанию OUTBOX_RETENTION_DAYS).")
+@click.option("--batch-size", default=1000, show_default=True)
+def purge(older_than, batch_size):
+    """Удалить обработанные события старше срока хранения."""
+    deleted = current_app.extensions["outbox"].purge(older_than, batch_size)
+    click.echo(f"Удалено событий: {deleted}")
+
+
+@outbox_cli.command("retry-dead")
+def retry_dead():
+    """Вернуть события из dead-letter в очередь."""
+    result = db.session.execute(
+        update(events).where(events.c.status == "dead")
+        .values(status="pending", attempts=0, available_at=datetime.datetime.utcnow())
+    )
+    db.session.commit()
+    click.echo(f"Возвращено событий: {result.rowcount}")
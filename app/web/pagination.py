@@ -0,0 +1,26 @@
+# app/web/pagination.py
+import base64
+import json
+
+
+# =========================
+# Курсоры для keyset-пагинации
+# =========================
+# Курсор - это значения ключа сортировки последней строки страницы,
+# упакованные в непрозрачную для клиента строку.
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        raise ValueError("Некорректный курсор")
+    if not isinstance(values, list):
+        raise ValueError("Некорректный курсор")
+    return values
@@ -0,0 +1,188 @@
+# app/web/plans.py
+import json
+import os
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import exists, func, select, text, true, tuple_
+
+from .models import (db, Users, Products, ProductCharacteristics, Carts, CartItems,
+                     Favorites, Orders)
+from .seed import seed_dataset
+
+
+plans_cli = AppGroup("plans", help="Проверка планов ключевых запросов.")
+
+
+# =========================
+# Ключевые запросы
+# =========================
+# Каждый запрос строится по образцу из данных (sample) и рендерится с
+# литералами, чтобы EXPLAIN видел те же значения, что и приложение.
+def _sample():
+    user_id, email = db.session.execute(
+        select(Users.id, Users.email).join(Orders, Orders.user_id == Users.id).limit(1)
+    ).one()
+    cart_id = db.session.execute(select(func.max(Carts.id)).where(Carts.user_id == user_id)).scalar()
+    product_id = db.session.execute(
+        select(Favorites.product_id).where(Favorites.user_id == user_id).limit(1)
+    ).scalar()
+    product = db.session.execute(
+        select(Products.created_at, Products.price).where(Products.id == product_id)
+    ).one()
+    return {"user_id": user_id, "email": email, "cart_id": cart_id, "product_id": product_id,
+            "product_created_at": product.created_at, "product_price": product.price}
+
+
+# страница /api/products: поля по умолчанию, ключ сортировки и id, на строку больше
+def _products_page(sort_column, descending, after=None):
+    query = (
+        select(Products.id, Products.name, Products.price, Products.stock, Products.image_url,
+               sort_column, Products.id)
+        .where(Products.is_active.isnot(False))
+    )
+    if after is not None:
+        key = tuple_(sort_column, Products.id)
+        query = query.where(key < after if descending else key > after)
+    if descending:
+        return query.order_by(sort_column.desc(), Products.id.desc()).limit(51)
+    return query.order_by(sort_column.asc(), Products.id.asc()).limit(51)
+
+
+KEY_QUERIES = {
+    "login_by_email": lambda s: select(Users.id, Users.password_hash).where(Users.email == s["email"]),
+    "active_cart": lambda s: (
+        select(Carts.id).where(Carts.user_id == s["user_id"], Carts.is_active == true())
+        .order_by(Carts.id.desc()).limit(1)
+    ),
+    "cart_lines": lambda s: (
+        select(CartItems.product_id, CartItems.quantity, Products.price)
+        .join(Products, Products.id == CartItems.product_id)
+        .where(CartItems.cart_id == s["cart_id"])
+    ),
+    "orders_page": lambda s: (
+        select(Orders.id, Orders.total_amount).where(Orders.user_id == s["user_id"])
+        .order_by(Orders.created_at.desc(), Orders.id.desc()).limit(50)
+    ),
+    "favorites_page": lambda s: (
+        select(Favorites.id, Favorites.product_id).where(Favorites.user_id == s["user_id"])
+        .order_by(Favorites.added_at.desc(), Favorites.id.desc()).limit(50)
+    ),
+    "product_characteristics": lambda s: (
+        select(ProductCharacteristics.characteristic_id, ProductCharacteristics.value)
+        .where(ProductCharacteristics.product_id == s["product_id"])
+    ),
+    "product_favorites_count": lambda s: (
+        select(func.count()).select_from(Favorites).where(Favorites.product_id == s["product_id"])
+    ),
+    "product_cart_items": lambda s: (
+        select(CartItems.cart_id).where(CartItems.product_id == s["product_id"])
+    ),
+    "cart_has_order": lambda s: select(exists().where(Orders.cart_id == s["cart_id"])),
+    "catalog_version": lambda s: select(func.max(Products.updated_at)),
+    "products_by_created_at": lambda s: _products_page(Products.created_at, True),
+    "products_by_created_at_after": lambda s: _products_page(
+        Products.created_at, True, (s["product_created_at"], s["product_id"])),
+    "products_by_price": lambda s: _products_page(Products.price, False),
+    "products_by_price_after": lambda s: _products_page(
+        Products.price, False, (s["product_price"], s["product_id"])),
+}
+
+
+# =========================
+# EXPLAIN
+# =========================
+def _walk(node):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from _walk(child)
+
+
+def explain(statement):
+    dialect = db.engine.dialect
+    sql = str(statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    if dialect.name == "postgresql":
+        plan = db.session.execute(text("EXPLAIN (FORMAT JSON) " + sql)).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]["Plan"]
+        nodes = list(_walk(root))
+        seq_scans = sorted({node["Relation Name"] for node in nodes if node["Node Type"] == "Seq Scan"})
+        steps = [" ".join(filter(None, (node["Node Type"], node.get("Relation Name"), node.get("Index Name"))))
+                 for node in nodes]
+        return {"cost": root["Total Cost"], "seq_scans": seq_scans, "plan": steps}
+    # SQLite: SCAN - полный проход по таблице или по всему индексу
+    # (USING COVERING INDEX), точечный доступ выглядит как SEARCH. Исключение -
+    # проход по индексу в порядке ORDER BY с LIMIT: он останавливается на
+    # LIMIT строк (первая страница keyset-пагинации).
+    steps = [row[-1] for row in db.session.execute(text("EXPLAIN QUERY PLAN " + sql)).all()]
+    ordered_limit = " LIMIT " in sql and not any("TEMP B-TREE FOR ORDER BY" in step for step in steps)
+    seq_scans = sorted({step.split()[1] for step in steps
+                        if step.startswith("SCAN ") and not step.startswith("SCAN CONSTANT ROW")
+                        and not (ordered_limit and " USING " in step and "INDEX" in step)})
+    return {"cost": None, "seq_scans": seq_scans, "plan": steps}
+
+
+def check_plans(baseline, tolerance):
+    sample = _sample()
+    results, failures = {}, []
+    for name, build in KEY_QUERIES.items():
+        result = results[name] = explain(build(sample))
+        if result["seq_scans"]:
+            failures.append(f"{name}: полный проход по {', '.join(result['seq_scans'])}")
+        expected = baseline.get(name, {})
+        if expected.get("cost") is not None and result["cost"] is not None \
+                and result["cost"] > expected["cost"] * (1 + tolerance):
+            failures.append(f"{name}: стоимость {result['cost']:.2f} > базовой {expected['cost']:.2f}")
+        # у SQLite стоимости нет: сравнивается сам план
+        if result["cost"] is None and expected.get("plan") and result["plan"] != expected["plan"]:
+            failures.append(f"{name}: план изменился: {'; '.join(result['plan'])}")
+    return results, failures
+
+
+def _baseline_path():
+    return current_app.config.get("PLAN_BASELINE_PATH") or os.path.join(
+        current_app.root_path, "..", "database", "plan_baseline.json")
+
+
+# =========================
+# Команды
+# =========================
+@plans_cli.command("check")
+@click.option("--seed", "seed_users", type=int, default=0,
+              help="Сначала засеять синтетические данные на N пользователей (только не в проде).")
+@click.option("--tolerance", default=0.2, show_default=True, help="Допустимый рост стоимости.")
+@click.option("--update-baseline", is_flag=True, help="Записать текущие стоимости как базовые.")
+def check_command(seed_users, tolerance, update_baseline):
+    """Прогнать EXPLAIN по ключевым запросам; код 1 при регрессии плана."""
+    if seed_users:
+        counts = seed_dataset(users=seed_users, products=max(seed_users // 2, 1), seed=1)
+        click.echo("Засеяно: " + ", ".join(f"{key}={value}" for key, value in counts.items()))
+    # без свежей статистики планировщик судит по пустым таблицам
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+
+    # базовые планы хранятся по диалектам: {"postgresql": {...}, "sqlite": {...}}
+    path = _baseline_path()
+    dialect = db.engine.dialect.name
+    stored = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            stored = json.load(f)
+    baseline = {} if update_baseline else stored.get(dialect, {})
+
+    results, failures = check_plans(baseline, tolerance)
+    for name, result in results.items():
+        cost = "-" if result["cost"] is None else f"{result['cost']:.2f}"
+        scans = ", ".join(result["seq_scans"]) or "-"
+        click.echo(f"{name:<30} cost={cost:<10} seq_scan={scans}")
+
+    if failures:
+        raise click.ClickException("Регрессия планов:\n" + "\n".join(failures))
+    if update_baseline:
+        stored[dialect] = results
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(stored, f, indent=2, ensure_ascii=False, sort_keys=True)
+            f.write("\n")
+        click.echo(f"Базовые планы записаны в {path}")
@@ -0,0 +1,258 @@
+# app/web/popularity.py
+import bisect
+import datetime
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict
+from operator import itemgetter
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, literal, select, true
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import db, Products, Favorites, CartItems, ProductCounters
+from .replicas import use_primary
+
+
+logger = logging.getLogger(__name__)
+
+popularity_cli = AppGroup("popularity", help="Счетчики и рейтинг популярности товаров.")
+
+counters = ProductCounters.__table__
+
+
+def _insert():
+    return postgresql.insert if db.engine.dialect.name == "postgresql" else sqlite.insert
+
+
+# =========================
+# Счетчики и рейтинг
+# =========================
+# Приращения копятся в памяти и сбрасываются одним upsert на пачку товаров.
+# Рейтинг хранит сумму весов 2^((t - t0) / half_life): порядок совпадает с
+# экспоненциально затухающим счетом, а сами веса не нужно пересчитывать.
+class Popularity:
+    def __init__(self, flush_interval=5, max_pending=1000, half_life=86400, max_age=600):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.half_life = half_life
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._pending = defaultdict(lambda: [0, 0])  # product_id -> [favorites, carts]
+        self._flushed_at = time.monotonic()
+        self._scores = {}                            # product_id -> вес
+        self._origin = None                          # t0 весов, unix time
+        self._built_at = 0.0
+        self._top = None                             # [(product_id, вес)] по убыванию веса
+        self._top_ids = set()
+        self._top_size = 0
+        self.flushes = 0
+
+    def init_app(self, app):
+        self.flush_interval = app.config.get("POPULARITY_FLUSH_INTERVAL", self.flush_interval)
+        self.max_pending = app.config.get("POPULARITY_MAX_PENDING", self.max_pending)
+        self.half_life = app.config.get("POPULARITY_HALF_LIFE", self.half_life)
+        self.max_age = app.config.get("POPULARITY_MAX_AGE", self.max_age)
+        app.extensions["popularity"] = self
+        app.after_request(self._after_request)
+
+    # ---------- Приращения ----------
+    def record(self, product_id, favorites=0, carts=0):
+        with self._lock:
+            pending = self._pending[product_id]
+            pending[0] += favorites
+            pending[1] += carts
+            # в рейтинг идут только добавления, удаления его не понижают
+            amount = max(favorites, 0) + max(carts, 0)
+            if amount:
+                self._bump(product_id, amount)
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self.flush()
+
+    def _after_request(self, response):
+        if self._pending and time.monotonic() - self._flushed_at >= self.flush_interval:
+            try:
+                self.flush()
+            except Exception:
+                # приращения вернулись в буфер, попробуем на следующем запросе
+                logger.exception("Не удалось сбросить счетчики популярности")
+        return response
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(lambda: [0, 0])
+                self._flushed_at = time.monotonic()
+            rows = [{"product_id": product_id, "favorites_count": fav, "cart_count": cart}
+                    for product_id, (fav, cart) in sorted(pending.items()) if fav or cart]
+            if not rows:
+                return 0
+            stmt = _insert()(counters).values(rows)
+            # порядок по product_id одинаков у всех воркеров - без взаимных блокировок
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["product_id"],
+                set_={
+                    "favorites_count": counters.c.favorites_count + stmt.excluded.favorites_count,
+                    "cart_count": counters.c.cart_count + stmt.excluded.cart_count,
+                    "updated_at": datetime.datetime.utcnow(),
+                },
+            )
+            try:
+                # отдельное соединение: транзакция запроса здесь ни при чем
+                with db.engine.begin() as connection:
+                    connection.execute(stmt)
+            except Exception:
+                with self._lock:
+                    for product_id, (fav, cart) in pending.items():
+                        self._pending[product_id][0] += fav
+                        self._pending[product_id][1] += cart
+                raise
+            self.flushes += 1
+            return len(rows)
+
+    def counts(self, product_id):
+        row = db.session.execute(
+            select(counters.c.favorites_count, counters.c.cart_count)
+            .where(counters.c.product_id == product_id)
+        ).first()
+        favorites, carts = row if row else (0, 0)
+        with self._lock:
+            pending = self._pending.get(product_id)
+            if pending:
+                favorites += pending[0]
+                carts += pending[1]
+        return {"favorites": max(favorites, 0), "carts": max(carts, 0)}
+
+    # ---------- Рейтинг ----------
+    def _weight(self, timestamp):
+        return 2.0 ** ((timestamp - self._origin) / self.half_life)
+
+    def _bump(self, product_id, amount):
+        if self._origin is None:
+            return
+        score = self._scores.get(product_id, 0.0) + amount * self._weight(time.time())
+        self._scores[product_id] = score
+        self._update_top(product_id, score)
+
+    # Веса только растут, поэтому топ поддерживается на месте: товар из топа
+    # переставляется выше, чужой входит, если обогнал последнего, и
+    # вытесняет его. Вытесненный - (size+1)-й, топ остается точным, полный
+    # проход по всем товарам нужен только при перестройке.
+    def _update_top(self, product_id, score):
+        top = self._top
+        if top is None:
+            return
+        if product_id in self._top_ids:
+            top.pop(next(i for i, item in enumerate(top) if item[0] == product_id))
+        elif len(top) >= self._top_size:
+            if score <= top[-1][1]:
+                return
+            self._top_ids.discard(top.pop()[0])
+        bisect.insort(top, (product_id, score), key=lambda item: -item[1])
+        self._top_ids.add(product_id)
+
+    # рейтинг общий для процесса - читается с основной базы
+    @use_primary()
+    def rebuild(self):
+        # события за последние 8 периодов полураспада, по часам: старше
+        # вклад меньше 1/256 и на порядок уже не влияет
+        now = time.time()
+        since = datetime.datetime.utcfromtimestamp(now - 8 * self.half_life)
+        scores = defaultdict(float)
+        for column, timestamp in ((Favorites.product_id, Favorites.added_at),
+                                  (CartItems.product_id, CartItems.added_at)):
+            rows = db.session.execute(
+                select(column, func.min(timestamp), func.count())
+                .where(timestamp >= since)
+                .group_by(column, _hour(timestamp))
+            )
+            for product_id, first_at, count in rows:
+                if isinstance(first_at, str):
+                    first_at = datetime.datetime.fromisoformat(first_at)
+                first_at = first_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+                scores[product_id] += count * 2.0 ** ((first_at - now) / self.half_life)
+        with self._lock:
+            self._origin = now
+            self._scores = dict(scores)
+            self._built_at = time.monotonic()
+            self._top = None
+
+    def _stale(self):
+        return time.monotonic() - self._built_at > self.max_age
+
+    # пересчет - один на процесс: пока он идет, остальные запросы отдают
+    # прежний рейтинг и ждут только самого первого построения
+    def _ensure_built(self):
+        if not self._stale():
+            return
+        if not self._rebuild_lock.acquire(blocking=self._origin is None):
+            return
+        try:
+            if self._stale():
+                self.rebuild()
+        finally:
+            self._rebuild_lock.release()
+
+    def top(self, limit=20):
+        self._ensure_built()
+        with self._lock:
+            if self._top is None or limit > self._top_size:
+                self._top_size = max(limit, 100)
+                self._top = heapq.nlargest(self._top_size, self._scores.items(), key=itemgetter(1))
+                self._top_ids = {product_id for product_id, _ in self._top}
+            origin_weight = self._weight(time.time())
+            return [(product_id, score / origin_weight) for product_id, score in self._top[:limit]]
+
+
+def _hour(column):
+    if db.engine.dialect.name == "postgresql":
+        return func.date_trunc("hour", column)
+    return func.strftime("%Y-%m-%d %H", column)
+
+
+# =========================
+# Сверка
+# =========================
+# Полный пересчет из favorites и cart_items исправляет дрейф: потерянные
+# при падении воркера приращения и каскадные удаления корзин.
+def reconcile():
+    favorites = (
+        select(func.count()).where(Favorites.product_id == Products.id).scalar_subquery()
+    )
+    carts = (
+        select(func.count()).where(CartItems.product_id == Products.id).scalar_subquery()
+    )
+    now = datetime.datetime.utcnow()
+    stmt = _insert()(counters).from_select(
+        ["product_id", "favorites_count", "cart_count", "updated_at"],
+        # WHERE нужен SQLite, чтобы разобрать INSERT ... SELECT ... ON CONFLICT
+        select(Products.id, favorites, carts, literal(now, db.DateTime)).where(true()),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["product_id"],
+        set_={
+            "favorites_count": stmt.excluded.favorites_count,
+            "cart_count": stmt.excluded.cart_count,
+            "updated_at": stmt.excluded.updated_at,
+        },
+        where=(counters.c.favorites_count != stmt.excluded.favorites_count)
+        | (counters.c.cart_count != stmt.excluded.cart_count),
+    )
+    result = db.session.execute(stmt)
+    db.session.commit()
+    return result.rowcount
+
+
+@popularity_cli.command("reconcile")
+def reconcile_command():
+    """Пересчитать счетчики избранного и корзин из исходных таблиц."""
+    current_app.extensions["popularity"].flush()
+    changed = reconcile()
+    click.echo(f"Исправлено счетчиков: {changed}")
@@ -0,0 +1,143 @@
+# app/web/principals.py
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+
+from . import after_commit
+from .models import db, Users, Roles
+from .replicas import use_primary
+
+
+# =========================
+# Пользователь для Flask-Login
+# =========================
+# Легкий объект без ссылки на ORM-строку: его можно держать в кэше
+# между запросами, не привязывая к сессии.
+class AuthUser:
+    __slots__ = ("id", "username", "email", "role_name")
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, username, email, role_name):
+        self.id = str(id)
+        self.username = username
+        self.email = email
+        self.role_name = role_name
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, getattr(user.role, "name", None))
+
+    def get_id(self):
+        return self.id
+
+    def __eq__(self, other):
+        if isinstance(other, AuthUser):
+            return self.id == other.id
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+# =========================
+# Кэш пользователей
+# =========================
+class PrincipalCache:
+    def __init__(self, ttl=60, max_items=10000):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._items = OrderedDict()  # user_id -> (expires_at, AuthUser)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.ttl = app.config.get("USER_CACHE_TTL", self.ttl)
+        self.max_items = app.config.get("USER_CACHE_MAX_ITEMS", self.max_items)
+        app.extensions["principal_cache"] = self
+        after_commit.register("principal_cache", self._apply)
+        for name in ("after_insert", "after_update", "after_delete"):
+            if not event.contains(Users, name, self._on_user):
+                event.listen(Users, name, self._on_user)
+            if not event.contains(Roles, name, self._on_role):
+                event.listen(Roles, name, self._on_role)
+
+    # как в кэше каталога: события приходят на flush, кэш чистится после
+    # commit, иначе параллельный load_user вернул бы в кэш старую строку
+    def _on_user(self, mapper, connection, target):
+        after_commit.defer(target, "principal_cache", ("user", target.id))
+
+    def _on_role(self, mapper, connection, target):
+        after_commit.defer(target, "principal_cache", ("role", target.id))
+
+    def _apply(self, items):
+        # имя роли денормализовано в кэшированных пользователях
+        if any(kind == "role" for kind, _ in items):
+            self.clear()
+            return
+        for _, user_id in items:
+            self.invalidate(user_id)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._items.pop(int(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._items.clear()
+
+    def get(self, user_id):
+        user_id = int(user_id)
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation
+            entry = self._items.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._items.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # общий кэш заполняется с основной базы, не с отстающей реплики
+        with use_primary():
+            row = db.session.execute(
+                select(Users.id, Users.username, Users.email, Roles.name)
+                .outerjoin(Roles, Roles.id == Users.role_id)
+                .where(Users.id == user_id)
+            ).first()
+        if row is None:
+            return None
+        principal = AuthUser(*row)
+        # незафиксированные изменения своей транзакции в кэш не попадают
+        if not after_commit.pending(db.session, "principal_cache"):
+            self.put(principal, generation)
+        return principal
+
+    # generation - поколение на момент чтения строки: если с тех пор был
+    # commit с инвалидацией, прочитанное могло устареть и не кладется
+    def put(self, principal, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._items[int(principal.id)] = (time.monotonic() + self.ttl, principal)
+            self._items.move_to_end(int(principal.id))
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"items": len(self._items), "hits": self.hits, "misses": self.misses}
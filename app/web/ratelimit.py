@@ -0,0 +1,329 @@
+# app/web/ratelimit.py
+import fcntl
+import functools
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import click
+from flask import current_app, request, session
+from flask.cli import AppGroup
+from werkzeug.exceptions import TooManyRequests
+
+
+logger = logging.getLogger(__name__)
+
+ratelimit_cli = AppGroup("ratelimit", help="Ограничение частоты запросов.")
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+LIMITED_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+def parse_rate(value):
+    # "20/minute" или "20/minute;burst=5"; по умолчанию burst = limit
+    rate, _, options = value.partition(";")
+    limit, _, period = rate.partition("/")
+    limit = int(limit)
+    burst = limit
+    if options.strip().startswith("burst="):
+        burst = int(options.strip()[len("burst="):])
+    return limit, PERIODS[period.strip()], burst
+
+
+def default_storage_path():
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "flask_market-ratelimit")
+
+
+# =========================
+# Общее хранилище
+# =========================
+# Файл в /dev/shm, отображенный в память всех воркеров хоста. Запись - 16
+# байт: отпечаток ключа и TAT (theoretical arrival time) алгоритма GCRA -
+# это тот же token bucket, но состояние - одно число. Записи сгруппированы
+# в корзины по WAYS штук; корзина и отпечаток берутся из blake2b с
+# секретной солью из заголовка файла, так что подобрать ключи в одну
+# корзину снаружи нельзя. Ключу без записи отдается пустая или истекшая
+# (TAT <= now) запись - ее состояние и так равно "лимит полон", вытеснение
+# ничего не теряет. Если все записи корзины живые, запрос отклоняется до
+# истечения ближайшей: переполнение не должно снимать лимит.
+# Емкость: запись ключа живет до interval * burst после последнего запроса
+# (для burst = limit - один период политики). Пока разных ключей за это
+# время меньше половины slots, полная корзина (8 живых записей) почти не
+# встречается; дальше отказы у невезучих ключей растут - RATELIMIT_SLOTS
+# подбирать по числу клиентов за период. У каждой группы политик своя
+# таблица: перебор паролей не вытесняет и не блокирует записи "write".
+# Чтение-изменение-запись корзины защищено блокировкой полосы:
+# threading.Lock между потоками процесса и fcntl-блокировкой байта между
+# процессами.
+class SharedBuckets:
+    MAGIC = b"FMRL\x02\x00\x00\x00"
+    HEADER = 64
+    SALT_SIZE = 16
+    WAYS = 8
+    ENTRY = struct.Struct("<Qd")
+    BUCKET = struct.Struct("<" + "Qd" * WAYS)
+
+    def __init__(self, path, slots=65536, stripes=256):
+        self.path = path
+        self.buckets = max(slots // self.WAYS, 1)
+        self.stripes = stripes
+        self._fd = None
+        self._map = None
+        self._salt = None
+        self._locks = None
+        self._open_lock = threading.Lock()
+        # после fork блокировки потоков и fcntl-блокировки родителя в
+        # ребенке недействительны: файл переоткрывается при первом обращении
+        os.register_at_fork(after_in_child=self._forget)
+
+    def _forget(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = None
+        self._map = None
+        self._open_lock = threading.Lock()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._forget()
+
+    def _open(self):
+        with self._open_lock:
+            if self._map is not None:
+                return
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            size = self.HEADER + self.buckets * self.BUCKET.size
+            # байт за полосами - блокировка создания заголовка
+            fcntl.lockf(fd, fcntl.LOCK_EX, 1, self.stripes)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                mapped = mmap.mmap(fd, size)
+                if mapped[:len(self.MAGIC)] != self.MAGIC:
+                    # новый файл или старый формат: свежая соль, пустые записи
+                    mapped[:] = bytes(size)
+                    mapped[len(self.MAGIC):len(self.MAGIC) + self.SALT_SIZE] = os.urandom(self.SALT_SIZE)
+                    mapped[:len(self.MAGIC)] = self.MAGIC
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, 1, self.stripes)
+            self._salt = bytes(mapped[len(self.MAGIC):len(self.MAGIC) + self.SALT_SIZE])
+            self._locks = [threading.Lock() for _ in range(self.stripes)]
+            self._fd = fd
+            self._map = mapped
+
+    def locate(self, key):
+        # hash() у каждого процесса свой; ключевой blake2b стабилен между
+        # воркерами и непредсказуем для клиента. Отпечаток 0 у пустой
+        # записи не мешает: ее TAT = 0, она истекшая при любом совпадении.
+        digest = hashlib.blake2b(key.encode(), digest_size=16, key=self._salt).digest()
+        index, fp = struct.unpack("<QQ", digest)
+        return index % self.buckets, fp
+
+    # interval - время на один запрос, tolerance - запас на всплеск.
+    # Возвращает 0, если запрос пропущен, иначе через сколько секунд повторить.
+    def hit(self, key, interval, tolerance, now=None):
+        if self._map is None:
+            self._open()
+        now = time.time() if now is None else now
+        bucket, fp = self.locate(key)
+        base = self.HEADER + bucket * self.BUCKET.size
+        stripe = bucket % self.stripes
+        with self._locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                entries = self.BUCKET.unpack_from(self._map, base)
+                way = free = None
+                for n in range(self.WAYS):
+                    stored, stored_tat = entries[2 * n], entries[2 * n + 1]
+                    if stored == fp:
+                        way = n
+                        tat = stored_tat
+                        break
+                    if free is None and stored_tat <= now:
+                        free = n
+                if way is None:
+                    if free is None:
+                        # все записи корзины живые - закрываемся, а не вытесняем
+                        return min(entries[1::2]) - now
+                    way, tat = free, now
+                tat = max(tat, now)
+                # TAT - сумма интервалов в float от эпохи: погрешность
+                # в доли микросекунды не должна съедать запрос из burst
+                if tat - now > tolerance + 1e-6:
+                    return tat - now - tolerance
+                self.ENTRY.pack_into(self._map, base + way * self.ENTRY.size, fp, tat + interval)
+                return 0
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+
+    # все полосы сразу: потоковые блокировки по порядку (hit держит одну,
+    # взаимной блокировки нет), затем fcntl на байты всех полос
+    def clear(self):
+        if self._map is None:
+            self._open()
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.stripes, 0)
+            try:
+                self._map[self.HEADER:] = bytes(len(self._map) - self.HEADER)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.stripes, 0)
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
+
+
+class Policy:
+    __slots__ = ("name", "interval", "tolerance")
+
+    def __init__(self, name, limit, period, burst):
+        self.name = name
+        self.interval = period / limit
+        self.tolerance = self.interval * (burst - 1)
+
+
+# =========================
+# Ограничитель
+# =========================
+# Политики - пары (группа, ключ): "ip" - адрес клиента, "account" -
+# email из формы входа или id пользователя из сессии. Проверка стоит до
+# тела view, поэтому отклоненный запрос не делает ни запросов к базе,
+# ни хэширования пароля.
+class RateLimiter:
+    def __init__(self):
+        self.enabled = True
+        self.trusted_proxies = 0
+        self.policies = {}
+        self.buckets = {}
+        self._lock = threading.Lock()
+        self.counters = {}
+
+    def init_app(self, app):
+        self.enabled = app.config.get("RATELIMIT_ENABLED", True)
+        self.trusted_proxies = app.config.get("RATELIMIT_TRUSTED_PROXIES", 0)
+        path = app.config.get("RATELIMIT_STORAGE") or default_storage_path()
+        self.policies = {}
+        self.buckets = {}
+        for group in ("login", "write"):
+            # RATELIMIT_STORAGE - префикс: файл на группу
+            self.buckets[group] = SharedBuckets(f"{path}-{group}",
+                                                slots=app.config.get("RATELIMIT_SLOTS", 65536))
+            for scope in ("ip", "account"):
+                value = app.config.get(f"RATELIMIT_{group.upper()}_{scope.upper()}")
+                if value:
+                    self.policies[(group, scope)] = Policy(f"{group}_{scope}", *parse_rate(value))
+        self.counters = {f"{policy.name}_{result}": 0 for policy in self.policies.values()
+                         for result in ("allowed", "rejected")}
+        self.counters["errors"] = 0
+        app.extensions["rate_limiter"] = self
+
+    def client_ip(self):
+        # за N доверенными прокси адрес клиента - N-й с конца в X-Forwarded-For
+        if self.trusted_proxies:
+            hops = [ip.strip() for ip in request.headers.get("X-Forwarded-For", "").split(",") if ip.strip()]
+            hops.append(request.remote_addr)
+            return hops[max(len(hops) - 1 - self.trusted_proxies, 0)]
+        return request.remote_addr
+
+    @staticmethod
+    def account(group):
+        if group == "login":
+            return (request.form.get("email") or "").strip().lower() or None
+        return session.get("_user_id")
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    # Возвращает 0, если запрос можно выполнять, иначе Retry-After в секундах.
+    # Первый же отказ прекращает проверку: запрос, отбитый по адресу, не
+    # расходует лимит аккаунта, в который целится.
+    def check(self, group, now=None):
+        if not self.enabled:
+            return 0
+        for scope, key in (("ip", self.client_ip), ("account", lambda: self.account(group))):
+            policy = self.policies.get((group, scope))
+            if policy is None:
+                continue
+            value = key()
+            if value is None:
+                continue
+            try:
+                wait = self.buckets[group].hit(f"{policy.name}:{value}", policy.interval, policy.tolerance, now)
+            except OSError:
+                # хранилище недоступно - пропускаем, а не роняем вход
+                logger.exception("Ограничитель частоты недоступен")
+                self._count("errors")
+                return 0
+            if wait:
+                self._count(f"{policy.name}_rejected")
+                return math.ceil(wait)
+            self._count(f"{policy.name}_allowed")
+        return 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+# @rate_limit("write") над view; GET и прочее чтение не ограничиваются
+def rate_limit(group, methods=LIMITED_METHODS):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            limiter = current_app.extensions.get("rate_limiter")
+            if limiter is not None and request.method in methods:
+                retry_after = limiter.check(group)
+                if retry_after:
+                    raise TooManyRequests("Слишком много запросов, попробуйте позже",
+                                          retry_after=retry_after)
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# =========================
+# Команды
+# =========================
+@ratelimit_cli.command("bench")
+@click.option("--iterations", default=100000, show_default=True)
+@click.option("--keys", default=1000, show_default=True, help="Разных клиентов.")
+def bench_command(iterations, keys):
+    """Замерить стоимость проверки лимита на запрос (обе политики группы).
+
+    Таблица - временный файл: счетчики живых воркеров хоста не трогаются.
+    """
+    limiter = current_app.extensions["rate_limiter"]
+    clients = [(f"10.0.{n // 256}.{n % 256}", f"user{n}@example.test") for n in range(keys)]
+    with tempfile.TemporaryDirectory() as directory:
+        for group in ("login", "write"):
+            buckets = SharedBuckets(os.path.join(directory, group),
+                                    slots=current_app.config.get("RATELIMIT_SLOTS", 65536))
+            policies = [limiter.policies[(group, scope)] for scope in ("ip", "account")
+                        if (group, scope) in limiter.policies]
+            started = time.perf_counter()
+            for n in range(iterations):
+                ip, account = clients[n % keys]
+                for policy, value in zip(policies, (ip, account)):
+                    buckets.hit(f"{policy.name}:{value}", policy.interval, policy.tolerance)
+            elapsed = time.perf_counter() - started
+            buckets.close()
+            click.echo(f"{group}: {elapsed / iterations * 1e6:.2f} мкс на запрос "
+                       f"({len(policies)} политики, {iterations} запросов)")
+
+
+@ratelimit_cli.command("reset")
+def reset_command():
+    """Сбросить все счетчики ограничителя на этом хосте."""
+    for buckets in current_app.extensions["rate_limiter"].buckets.values():
+        buckets.clear()
+        click.echo(f"Счетчики сброшены: {buckets.path}")
@@ -0,0 +1,286 @@
+# app/web/recommendations.py
+import datetime
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, insert, select
+
+from .models import db, Favorites, CartItems, Orders, ProductCounters, ProductRecommendations, RollupState
+from .replicas import use_primary
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # пакетная задача без numpy/scipy недоступна, выдача работает
+    np = None
+    sparse = None
+
+
+recommendations_cli = AppGroup("recommendations", help="Рекомендации «также добавляли в избранное».")
+
+STATE_NAME = "recommendations"
+
+recommendations = ProductRecommendations.__table__
+
+
+# =========================
+# Упаковка соседей
+# =========================
+# Формат строки: little-endian int32 id и float32 оценки, по убыванию оценки
+def pack(neighbor_ids, scores):
+    return (np.asarray(neighbor_ids, dtype="<i4").tobytes(),
+            np.asarray(scores, dtype="<f4").tobytes())
+
+
+def unpack(neighbor_ids, scores):
+    ids, values = array("i", neighbor_ids), array("f", scores)
+    if sys.byteorder == "big":
+        ids.byteswap()
+        values.byteswap()
+    return tuple(ids), tuple(values)
+
+
+# =========================
+# Матрица пользователь x товар
+# =========================
+def _read_pairs(query, batch_size):
+    chunks = []
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+    for partition in result.partitions():
+        chunks.append(np.array(partition, dtype=np.int64).reshape(-1, 2))
+    if not chunks:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.concatenate(chunks)
+
+
+def load_matrix(with_orders=False, batch_size=100000):
+    pairs = [_read_pairs(select(Favorites.user_id, Favorites.product_id), batch_size)]
+    if with_orders:
+        # купленные товары: строки корзин, по которым оформлен заказ
+        pairs.append(_read_pairs(
+            select(Orders.user_id, CartItems.product_id)
+            .join(CartItems, CartItems.cart_id == Orders.cart_id),
+            batch_size,
+        ))
+    pairs = np.concatenate(pairs)
+    user_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    product_ids, cols = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.float32), (rows, cols)),
+        shape=(len(user_ids), len(product_ids)),
+    )
+    # повторы (избранное + покупка) не усиливают связь: матрица бинарная
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+    return matrix, product_ids
+
+
+# =========================
+# Соседи по косинусу
+# =========================
+# Совместная встречаемость X^T X считается блоками по chunk_size столбцов,
+# поэтому память ограничена размером блока, а не квадратом каталога.
+def neighbors(matrix, targets, top_k=20, chunk_size=1000, min_support=1):
+    by_product = matrix.T.tocsr()
+    by_user = matrix.tocsc()
+    norms = np.sqrt(np.asarray(by_user.sum(axis=0)).ravel())
+    for start in range(0, len(targets), chunk_size):
+        block = targets[start:start + chunk_size]
+        counts = (by_product @ by_user[:, block]).tocsc()
+        for offset, column in enumerate(block):
+            lo, hi = counts.indptr[offset], counts.indptr[offset + 1]
+            rows, support = counts.indices[lo:hi], counts.data[lo:hi]
+            keep = (rows != column) & (support >= min_support)
+            rows, support = rows[keep], support[keep]
+            if not len(rows):
+                yield column, rows, support
+                continue
+            scores = support / (norms[rows] * norms[column])
+            if len(rows) > top_k:
+                # равные оценки на границе top_k берутся по возрастанию id,
+                # иначе полный и инкрементальный пересчеты расходятся
+                threshold = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+                keep = scores >= threshold
+                rows, scores = rows[keep], scores[keep]
+            order = np.lexsort((rows, -scores))[:top_k]
+            yield column, rows[order], scores[order]
+
+
+# Товары, у которых с since изменилось множество пользователей: новые
+# избранные, новые заказы и удаления из избранного. Удаления в таблице уже
+# не видны - их отражают счетчики популярности: приращение -1 сдвигает
+# product_counters.updated_at.
+def _changed_products(since, with_orders):
+    queries = [
+        select(Favorites.product_id).where(Favorites.added_at > since),
+        select(ProductCounters.product_id).where(ProductCounters.updated_at > since),
+    ]
+    if with_orders:
+        queries.append(
+            select(CartItems.product_id)
+            .join(Orders, Orders.cart_id == CartItems.cart_id)
+            .where(Orders.created_at > since)
+        )
+    changed = set()
+    for query in queries:
+        changed.update(db.session.execute(query.distinct()).scalars())
+    return np.fromiter(changed, dtype=np.int64, count=len(changed))
+
+
+def _listing(changed):
+    # товары, в сохраненных соседях которых есть измененный: связь могла
+    # держаться на удаленном избранном, и по матрице ее уже не найти
+    listing = []
+    result = db.session.execute(
+        select(recommendations.c.product_id, recommendations.c.neighbor_ids)
+        .execution_options(stream_results=True, yield_per=10000)
+    )
+    for partition in result.partitions():
+        ids = [np.frombuffer(packed, dtype="<i4") for _, packed in partition]
+        owners = np.repeat([product_id for product_id, _ in partition], [len(x) for x in ids])
+        listing.append(np.unique(owners[np.isin(np.concatenate(ids), changed)]))
+    if not listing:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(listing)).astype(np.int64)
+
+
+# Изменение товара p меняет его норму, а значит оценку p у каждого товара,
+# который встречается вместе с p хотя бы у одного пользователя: пересчету
+# подлежат p, все такие товары и все, у кого p уже записан в соседях.
+def _touched_products(matrix, product_ids, since, with_orders):
+    changed = _changed_products(since, with_orders)
+    listing = _listing(changed)
+    touched = np.intersect1d(np.union1d(changed, listing), product_ids)
+    columns = np.searchsorted(product_ids, np.intersect1d(changed, product_ids))
+    users = np.unique(matrix.tocsc()[:, columns].nonzero()[0])
+    co_occurring = np.unique(matrix[users].nonzero()[1])
+    targets = np.union1d(np.searchsorted(product_ids, touched), co_occurring)
+    # товары без единого избранного выпали из матрицы: их соседи устарели целиком
+    gone = np.setdiff1d(np.union1d(changed, listing), product_ids)
+    return targets, gone
+
+
+def _high_water():
+    state = db.session.get(RollupState, STATE_NAME)
+    return state.high_water if state else None
+
+
+def _set_high_water(value):
+    state = db.session.get(RollupState, STATE_NAME)
+    if state is None:
+        db.session.add(RollupState(name=STATE_NAME, high_water=value))
+    else:
+        state.high_water = value
+
+
+def build(full=False, with_orders=False, top_k=20, chunk_size=1000, min_support=1):
+    if np is None:
+        raise click.ClickException("Для расчета рекомендаций нужны numpy и scipy")
+    started_at = datetime.datetime.utcnow()
+    since = None if full else _high_water()
+
+    matrix, product_ids = load_matrix(with_orders)
+    if since is None:
+        targets = np.arange(len(product_ids))
+    else:
+        targets, gone = _touched_products(matrix, product_ids, since, with_orders)
+        if len(gone):
+            db.session.execute(
+                delete(recommendations).where(recommendations.c.product_id.in_(gone.tolist()))
+            )
+
+    written = 0
+    batch = []
+    for column, rows, scores in neighbors(matrix, targets, top_k, chunk_size, min_support):
+        ids, packed_scores = pack(product_ids[rows], scores)
+        batch.append({"product_id": int(product_ids[column]), "neighbor_ids": ids,
+                      "scores": packed_scores, "computed_at": started_at})
+        if len(batch) >= chunk_size:
+            written += _write(batch)
+            batch = []
+    written += _write(batch)
+    if since is None:
+        # после полного пересчета убираем строки товаров, у которых
+        # больше нет ни одного избранного
+        db.session.execute(delete(recommendations).where(recommendations.c.computed_at < started_at))
+    _set_high_water(started_at)
+    db.session.commit()
+    return written
+
+
+def _write(batch):
+    if not batch:
+        return 0
+    db.session.execute(
+        delete(recommendations)
+        .where(recommendations.c.product_id.in_([row["product_id"] for row in batch]))
+    )
+    db.session.execute(insert(recommendations), batch)
+    db.session.commit()
+    return len(batch)
+
+
+# =========================
+# Выдача
+# =========================
+class Recommendations:
+    def __init__(self, max_items=10000, ttl=600):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = OrderedDict()  # product_id -> (expires_at, neighbor_ids)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_items = app.config.get("RECOMMENDATIONS_CACHE_SIZE", self.max_items)
+        self.ttl = app.config.get("RECOMMENDATIONS_TTL", self.ttl)
+        app.extensions["recommendations"] = self
+
+    def get(self, product_id, limit=10):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(product_id)
+            if entry is not None and entry[0] > now:
+                self._items.move_to_end(product_id)
+                return entry[1][:limit]
+        # общий кэш заполняется с основной базы, не с отстающей реплики
+        with use_primary():
+            row = db.session.execute(
+                select(recommendations.c.neighbor_ids, recommendations.c.scores)
+                .where(recommendations.c.product_id == product_id)
+            ).first()
+        neighbor_ids = unpack(*row)[0] if row else ()
+        with self._lock:
+            self._items[product_id] = (now + self.ttl, neighbor_ids)
+            self._items.move_to_end(product_id)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return neighbor_ids[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+# =========================
+# Команды
+# =========================
+@recommendations_cli.command("build")
+@click.option("--full", is_flag=True, help="Пересчитать все товары, а не только затронутые.")
+@click.option("--with-orders", is_flag=True, help="Учитывать товары из оформленных заказов.")
+@click.option("--top-k", default=20, show_default=True, help="Соседей на товар.")
+@click.option("--chunk-size", default=1000, show_default=True, help="Столбцов в блоке умножения.")
+@click.option("--min-support", default=1, show_default=True,
+              help="Минимум общих пользователей у пары товаров.")
+def build_command(full, with_orders, top_k, chunk_size, min_support):
+    """Пересчитать соседей товаров по избранному."""
+    started = time.monotonic()
+    written = build(full=full, with_orders=with_orders, top_k=top_k,
+                    chunk_size=chunk_size, min_support=min_support)
+    current_app.extensions["recommendations"].clear()
+    click.echo(f"Обновлено товаров: {written} за {time.monotonic() - started:.1f} с")
@@ -0,0 +1,201 @@
+# app/web/replicas.py
+import contextlib
+import itertools
+import logging
+import threading
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.sql.selectable import Select
+
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+STICKY_KEY = "_primary_until"
+
+
+# =========================
+# Сессия с маршрутизацией
+# =========================
+# Чтение в GET-запросе уходит на реплику; запись, SELECT ... FOR UPDATE,
+# flush, CLI и фоновые задачи - на основную базу. После записи в запросе
+# все последующее чтение этого запроса тоже идет на основную.
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            router = current_app.extensions.get("replicas")
+            if router is not None and router.replicas:
+                if self._flushing or _is_write(clause):
+                    g._db_wrote = True
+                elif router.reads_from_replica():
+                    engine = router.choose()
+                    if engine is not None:
+                        return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _is_write(clause):
+    if isinstance(clause, Select):
+        return clause._for_update_arg is not None
+    if isinstance(clause, TextClause):
+        statement = clause.text.lstrip().upper()
+        return not statement.startswith("SELECT") or "FOR UPDATE" in statement
+    # DML, session.connection() без выражения и прочее - на основную
+    return True
+
+
+class Replica:
+    __slots__ = ("key", "down_until", "failures", "checked_at", "lag")
+
+    def __init__(self, key):
+        self.key = key
+        self.down_until = 0.0
+        self.failures = 0
+        self.checked_at = 0.0
+        self.lag = None
+
+
+# =========================
+# Маршрутизатор
+# =========================
+class ReplicaRouter:
+    def __init__(self, sticky_seconds=5, retry_after=30, check_interval=10, max_lag=10):
+        self.sticky_seconds = sticky_seconds
+        self.retry_after = retry_after
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.replicas = []
+        self._engines = {}  # движок -> Replica, для handle_error
+        self._counter = itertools.count()
+        self._check_lock = threading.Lock()
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    # до db.init_app: реплики добавляются в SQLALCHEMY_BINDS, движки
+    # для них создает Flask-SQLAlchemy
+    def init_app(self, app):
+        self.sticky_seconds = app.config.get("REPLICA_STICKY_SECONDS", self.sticky_seconds)
+        self.retry_after = app.config.get("REPLICA_RETRY_AFTER", self.retry_after)
+        self.check_interval = app.config.get("REPLICA_CHECK_INTERVAL", self.check_interval)
+        self.max_lag = app.config.get("REPLICA_MAX_LAG", self.max_lag)
+        binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+        self.replicas = []
+        for index, uri in enumerate(app.config.get("SQLALCHEMY_REPLICA_URIS") or ()):
+            key = f"replica_{index}"
+            binds[key] = uri
+            self.replicas.append(Replica(key))
+        app.extensions["replicas"] = self
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    # ---------- Запрос ----------
+    def _before_request(self):
+        g._db_wrote = False
+        # без реплик сессию не трогаем: иначе каждый ответ получает Vary: Cookie
+        g._db_primary = bool(self.replicas) and session.get(STICKY_KEY, 0) > time.time()
+
+    def _after_request(self, response):
+        # read-your-writes: после записи пользователь какое-то время
+        # читает с основной базы, пока реплика догоняет
+        if g.get("_db_wrote") and self.replicas:
+            session[STICKY_KEY] = time.time() + self.sticky_seconds
+        return response
+
+    def reads_from_replica(self):
+        if request.method not in READ_METHODS:
+            return False
+        if g.get("_db_wrote") or g.get("_db_primary") or g.get("_db_force_primary", 0):
+            self.primary_reads += 1
+            return False
+        return True
+
+    # ---------- Выбор реплики ----------
+    def choose(self):
+        now = time.monotonic()
+        count = len(self.replicas)
+        start = next(self._counter)
+        for offset in range(count):
+            replica = self.replicas[(start + offset) % count]
+            if replica.down_until > now:
+                continue
+            if now - replica.checked_at >= self.check_interval and not self._check(replica, now):
+                continue
+            self.replica_reads += 1
+            return self._engine(replica)
+        self.primary_reads += 1
+        return None
+
+    def _engine(self, replica):
+        from .models import db
+        engine = db.engines[replica.key]
+        if engine not in self._engines:
+            self._engines[engine] = replica
+            event.listen(engine, "handle_error", self._on_error)
+        return engine
+
+    def _check(self, replica, now):
+        # проверку делает один поток; остальные пока верят прошлому результату
+        if not self._check_lock.acquire(blocking=False):
+            return True
+        try:
+            replica.checked_at = now
+            engine = self._engine(replica)
+            with engine.connect() as connection:
+                if engine.dialect.name == "postgresql":
+                    replica.lag = connection.execute(text(
+                        "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+                    )).scalar()
+                else:
+                    connection.execute(text("SELECT 1"))
+                    replica.lag = 0
+            if replica.lag is not None and replica.lag > self.max_lag:
+                logger.warning("Реплика %s отстает на %.1f с", replica.key, replica.lag)
+                self._mark_down(replica)
+                return False
+            replica.failures = 0
+            return True
+        except Exception:
+            logger.exception("Реплика %s недоступна", replica.key)
+            self._mark_down(replica)
+            return False
+        finally:
+            self._check_lock.release()
+
+    def _mark_down(self, replica):
+        replica.failures += 1
+        replica.down_until = time.monotonic() + self.retry_after
+
+    def _on_error(self, context):
+        replica = self._engines.get(context.engine)
+        if replica is not None and context.is_disconnect:
+            logger.warning("Реплика %s отключена до повторной проверки", replica.key)
+            self._mark_down(replica)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "replicas": len(self.replicas),
+            "healthy": sum(1 for replica in self.replicas if replica.down_until <= now),
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+        }
+
+
+# =========================
+# Принудительно основная база
+# =========================
+# with use_primary(): ...  или  @use_primary() над view
+class use_primary(contextlib.ContextDecorator):
+    def __enter__(self):
+        if has_app_context():
+            g._db_force_primary = g.get("_db_force_primary", 0) + 1
+        return self
+
+    def __exit__(self, *exc):
+        if has_app_context():
+            g._db_force_primary -= 1
+        return False
@@ -0,0 +1,311 @@
+# app/web/reservations.py
+import datetime
+import logging
+import random
+import signal
+import threading
+import time
+from collections import defaultdict
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, delete, func, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import db, Products, StockReservations, StockShards
+
+
+logger = logging.getLogger(__name__)
+
+reservations_cli = AppGroup("reservations", help="Резервы товара в корзинах.")
+
+reservations = StockReservations.__table__
+shards = StockShards.__table__
+
+
+def _insert():
+    return postgresql.insert if db.engine.dialect.name == "postgresql" else sqlite.insert
+
+
+# =========================
+# Резервы
+# =========================
+# Резерв занимает одну случайную строку stock_shards условным UPDATE, строку
+# products при этом никто не блокирует: конкурентные резервы горячего товара
+# расходятся по разным строкам счетчика. Если в выбранной строке не хватает
+# квоты, rebalance под блокировкой всех строк товара пересчитывает их по
+# stock и фактическим резервам и отдает нужное количество выбранной строке.
+class Reservations:
+    def __init__(self, ttl=900, shards=8, batch_size=1000, sweep_interval=5, resync_interval=60):
+        self.ttl = ttl
+        self.shards = shards
+        self.batch_size = batch_size
+        self.sweep_interval = sweep_interval
+        self.resync_interval = resync_interval
+        self._lock = threading.Lock()
+        self.reserved = 0
+        self.rejected = 0
+        self.rebalanced = 0
+        self.expired = 0
+
+    def init_app(self, app):
+        self.ttl = app.config.get("RESERVATION_TTL", self.ttl)
+        self.shards = app.config.get("RESERVATION_SHARDS", self.shards)
+        self.batch_size = app.config.get("RESERVATION_SWEEP_BATCH", self.batch_size)
+        self.sweep_interval = app.config.get("RESERVATION_SWEEP_INTERVAL", self.sweep_interval)
+        self.resync_interval = app.config.get("RESERVATION_RESYNC_INTERVAL", self.resync_interval)
+        app.extensions["reservations"] = self
+
+    def _count(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    # ---------- Строки счетчика ----------
+    def _shift(self, product_id, shard, quota=0, reserved=0, check=None):
+        query = update(shards).where(shards.c.product_id == product_id, shards.c.shard == shard)
+        if check is not None:
+            query = query.where(shards.c.quota - shards.c.reserved >= check)
+        return db.session.execute(query.values(
+            quota=shards.c.quota + quota, reserved=shards.c.reserved + reserved,
+        )).rowcount == 1
+
+    def _ensure_shards(self, product_id):
+        stmt = _insert()(shards).values([
+            {"product_id": product_id, "shard": shard, "quota": 0, "reserved": 0}
+            for shard in range(self.shards)
+        ]).on_conflict_do_nothing(index_elements=["product_id", "shard"])
+        db.session.execute(stmt)
+
+    # Пересчет по первичным данным: reserved - сумма резервов строки,
+    # quota - reserved плюс доля свободного остатка. need единиц свободного
+    # остатка достается строке prefer; возвращает ее номер или None, если
+    # свободного меньше need.
+    def rebalance(self, product_id, prefer=None, need=0):
+        self._ensure_shards(product_id)
+        shard_ids = db.session.execute(
+            select(shards.c.shard).where(shards.c.product_id == product_id)
+            .order_by(shards.c.shard).with_for_update()
+        ).scalars().all()
+        stock = db.session.execute(select(Products.stock).where(Products.id == product_id)).scalar()
+        if stock is None:
+            return None
+        held = dict(db.session.execute(
+            select(reservations.c.shard, func.sum(reservations.c.quantity))
+            .where(reservations.c.product_id == product_id)
+            .group_by(reservations.c.shard)
+        ).all())
+        free = stock - sum(held.values())
+        target = prefer if prefer in shard_ids else shard_ids[0]
+        enough = free >= need
+        base, extra = divmod(free - need if enough else free, len(shard_ids))
+        rows = []
+        for index, shard in enumerate(shard_ids):
+            share = base + (1 if index < extra else 0) + (need if enough and shard == target else 0)
+            reserved = int(held.get(shard, 0))
+            rows.append({"b_product_id": product_id, "b_shard": shard,
+                         "b_quota": reserved + share, "b_reserved": reserved})
+        db.session.execute(
+            update(shards)
+            .where(shards.c.product_id == bindparam("b_product_id"),
+                   shards.c.shard == bindparam("b_shard"))
+            .values(quota=bindparam("b_quota"), reserved=bindparam("b_reserved")),
+            rows,
+        )
+        self._count("rebalanced")
+        return target if enough else None
+
+    # ---------- Корзина ----------
+    # Вызывается в транзакции добавления в корзину; False - не хватает товара
+    def reserve(self, cart_id, product_id, quantity):
+        shard = random.randrange(self.shards)
+        if not self._shift(product_id, shard, reserved=quantity, check=quantity):
+            shard = self.rebalance(product_id, prefer=shard, need=quantity)
+            if shard is None:
+                self._count("rejected")
+                return False
+            self._shift(product_id, shard, reserved=quantity)
+        now = datetime.datetime.utcnow()
+        stmt = _insert()(reservations).values(
+            cart_id=cart_id, product_id=product_id, shard=shard, quantity=quantity,
+            expires_at=now + datetime.timedelta(seconds=self.ttl), created_at=now,
+        )
+        # повторное добавление продлевает резерв и увеличивает его
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=["cart_id", "product_id", "shard"],
+            set_={"quantity": reservations.c.quantity + stmt.excluded.quantity,
+                  "expires_at": stmt.excluded.expires_at},
+        ))
+        self._count("reserved")
+        return True
+
+    def _unreserve(self, rows):
+        totals = defaultdict(int)
+        for product_id, shard, quantity in rows:
+            totals[(product_id, shard)] += quantity
+        # строки счетчика блокируются в одном порядке во всех транзакциях
+        for (product_id, shard), quantity in sorted(totals.items()):
+            self._shift(product_id, shard, reserved=-quantity)
+        return sum(totals.values())
+
+    # все резервы удаляемых корзин разом: счетчики блокируются в одном
+    # порядке, как при любом другом снятии резервов
+    def release_carts(self, cart_ids):
+        rows = db.session.execute(
+            delete(reservations).where(reservations.c.cart_id.in_(cart_ids))
+            .returning(reservations.c.product_id, reservations.c.shard, reservations.c.quantity)
+        ).all()
+        return self._unreserve(rows)
+
+    def release(self, cart_id, product_id=None):
+        query = delete(reservations).where(reservations.c.cart_id == cart_id)
+        if product_id is not None:
+            query = query.where(reservations.c.product_id == product_id)
+        rows = db.session.execute(query.returning(
+            reservations.c.product_id, reservations.c.shard, reservations.c.quantity,
+        )).all()
+        return self._unreserve(rows)
+
+    # ---------- Оформление ----------
+    # Резерв строки переходит в продажу: уходит и из reserved, и из quota,
+    # так сумма quota остается равной уменьшенному stock. Если резерв истек
+    # или меньше количества в корзине, недостающее берется из свободного
+    # остатка; False - свободного не хватает.
+    def consume(self, cart_id, product_id, quantity):
+        rows = db.session.execute(
+            delete(reservations)
+            .where(reservations.c.cart_id == cart_id, reservations.c.product_id == product_id)
+            .returning(reservations.c.shard, reservations.c.quantity)
+        ).all()
+        held = defaultdict(int)
+        for shard, reserved in rows:
+            held[shard] += reserved
+        remaining = quantity
+        for shard, reserved in sorted(held.items()):
+            sold = min(reserved, remaining)
+            remaining -= sold
+            self._shift(product_id, shard, quota=-sold, reserved=-reserved)
+        if not remaining:
+            return True
+        shard = random.randrange(self.shards)
+        if self._shift(product_id, shard, quota=-remaining, check=remaining):
+            return True
+        shard = self.rebalance(product_id, prefer=shard, need=remaining)
+        if shard is None:
+            return False
+        return self._shift(product_id, shard, quota=-remaining)
+
+    # ---------- Чтение ----------
+    def available(self, product_ids):
+        stock = dict(db.session.execute(
+            select(Products.id, Products.stock).where(Products.id.in_(product_ids))
+        ).all())
+        reserved = dict(db.session.execute(
+            select(shards.c.product_id, func.sum(shards.c.reserved))
+            .where(shards.c.product_id.in_(list(stock)))
+            .group_by(shards.c.product_id)
+        ).all())
+        return {
+            product_id: {"stock": value, "reserved": int(reserved.get(product_id) or 0),
+                         "available": max(value - int(reserved.get(product_id) or 0), 0)}
+            for product_id, value in stock.items()
+        }
+
+    # ---------- Очистка ----------
+    # Истекшие резервы удаляются пачками по индексу expires_at; занятые
+    # другой транзакцией (оформление, второй чистильщик) пропускаются.
+    def sweep(self, now=None):
+        now = now or datetime.datetime.utcnow()
+        expired = (
+            select(reservations.c.id)
+            .where(reservations.c.expires_at < now)
+            .order_by(reservations.c.expires_at)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        rows = db.session.execute(
+            delete(reservations).where(reservations.c.id.in_(expired))
+            .returning(reservations.c.product_id, reservations.c.shard, reservations.c.quantity)
+        ).all()
+        self._unreserve(rows)
+        db.session.commit()
+        self._count("expired", len(rows))
+        return len(rows)
+
+    # Остатки меняются и в обход резервов (админка, импорт каталога), а
+    # каскадное удаление корзин уносит резервы без пересчета счетчиков:
+    # такие товары находятся сверкой и пересчитываются rebalance.
+    def resync(self):
+        totals = (
+            select(shards.c.product_id,
+                   func.sum(shards.c.quota).label("quota"),
+                   func.sum(shards.c.reserved).label("reserved"))
+            .group_by(shards.c.product_id)
+            .subquery()
+        )
+        held = (
+            select(reservations.c.product_id, func.sum(reservations.c.quantity).label("quantity"))
+            .group_by(reservations.c.product_id)
+            .subquery()
+        )
+        product_ids = db.session.execute(
+            select(totals.c.product_id)
+            .join(Products, Products.id == totals.c.product_id)
+            .outerjoin(held, held.c.product_id == totals.c.product_id)
+            .where(or_(totals.c.quota != Products.stock,
+                       totals.c.reserved != func.coalesce(held.c.quantity, 0)))
+        ).scalars().all()
+        db.session.rollback()
+        for product_id in product_ids:
+            self.rebalance(product_id)
+            db.session.commit()
+        return len(product_ids)
+
+    def run(self, once=False, echo=None):
+        stop = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        resynced_at = 0.0
+        while not stop.is_set():
+            released = self.sweep()
+            if echo is not None and released:
+                echo(f"  снято резервов: {released}")
+            if released >= self.batch_size:
+                continue
+            if time.monotonic() - resynced_at >= self.resync_interval:
+                fixed = self.resync()
+                resynced_at = time.monotonic()
+                if fixed:
+                    logger.info("Пересчитаны счетчики резервов: %d товаров", fixed)
+            if once:
+                return
+            stop.wait(self.sweep_interval)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "reserved": self.reserved,
+                "rejected": self.rejected,
+                "rebalanced": self.rebalanced,
+                "expired": self.expired,
+            }
+
+
+# =========================
+# Команды
+# =========================
+@reservations_cli.command("sweep")
+@click.option("--once", is_flag=True, help="Снять все истекшие резервы, сверить счетчики и выйти.")
+def sweep_command(once):
+    """Снимать истекшие резервы пачками; можно запускать в нескольких экземплярах."""
+    try:
+        current_app.extensions["reservations"].run(once=once, echo=click.echo)
+    except KeyboardInterrupt:
+        return
+
+
+@reservations_cli.command("resync")
+def resync_command():
+    """Пересчитать счетчики резервов, разошедшиеся с остатками."""
+    fixed = current_app.extensions["reservations"].resync()
+    click.echo(f"Пересчитано товаров: {fixed}")
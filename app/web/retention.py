@@ -0,0 +1,151 @@
+# app/web/retention.py
+import datetime
+import json
+import logging
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, exists, false, select, text, true, tuple_
+from sqlalchemy.exc import OperationalError
+
+from .models import db, Carts, CartItems, Orders
+
+
+logger = logging.getLogger(__name__)
+
+retention_cli = AppGroup("retention", help="Очистка устаревших данных.")
+
+carts = Carts.__table__
+cart_items = CartItems.__table__
+
+
+# =========================
+# Корзины
+# =========================
+# Удаление идет пачками по индексу (is_active, updated_at) с паузой между
+# ними: каждая пачка - короткая транзакция, живой трафик не ждет долгих
+# блокировок, а автовакуум успевает за удалениями.
+def _candidates(active, cutoff, after, batch_size):
+    # без coalesce: иначе индекс по updated_at не используется;
+    # updated_at заполняется по умолчанию, NULL бывает только в старых строках
+    changed = carts.c.updated_at
+    # is_active NOT NULL: равенство, а не IS NOT FALSE, иначе первый
+    # столбец индекса (is_active, updated_at) не используется
+    state = carts.c.is_active == (true() if active else false())
+    query = (
+        select(changed, carts.c.id)
+        .where(state, changed < cutoff,
+               ~exists().where(Orders.cart_id == carts.c.id))
+        .order_by(changed, carts.c.id)
+        .limit(batch_size)
+    )
+    if after is not None:
+        query = query.where(tuple_(changed, carts.c.id) > after)
+    return db.session.execute(query).all()
+
+
+def _archive(archive, cart_ids):
+    cart_rows = db.session.execute(select(carts).where(carts.c.id.in_(cart_ids))).mappings().all()
+    item_rows = db.session.execute(
+        select(cart_items).where(cart_items.c.cart_id.in_(cart_ids))
+    ).mappings().all()
+    lines = {row["id"]: dict(row, items=[]) for row in cart_rows}
+    for item in item_rows:
+        lines[item["cart_id"]]["items"].append(dict(item))
+    for line in lines.values():
+        archive.write(json.dumps(line, default=str, ensure_ascii=False) + "\n")
+    archive.flush()
+
+
+def _delete_batch(active, cutoff, cart_ids, archive):
+    if db.engine.dialect.name == "postgresql":
+        # под нагрузкой лучше пропустить пачку, чем встать в очередь блокировок
+        db.session.execute(text("SET LOCAL lock_timeout = '2s'"))
+    changed = carts.c.updated_at
+    state = carts.c.is_active == (true() if active else false())
+    # условия повторяются: корзину могли изменить или оформить после
+    # выборки; занятые прямо сейчас строки пропускаем, а не ждем
+    locked = db.session.execute(
+        select(carts.c.id)
+        .where(carts.c.id.in_(cart_ids), state, changed < cutoff,
+               ~exists().where(Orders.cart_id == carts.c.id))
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not locked:
+        db.session.rollback()
+        return 0, 0
+    if archive is not None:
+        _archive(archive, locked)
+    # каскад унес бы резервы корзин, не уменьшив reserved в счетчиках
+    reservations = current_app.extensions.get("reservations")
+    if reservations is not None:
+        reservations.release_carts(locked)
+    # позиции удаляем явно: SQLite без PRAGMA foreign_keys каскад не выполняет
+    items = db.session.execute(
+        delete(cart_items).where(cart_items.c.cart_id.in_(locked))
+    ).rowcount
+    deleted = db.session.execute(delete(carts).where(carts.c.id.in_(locked))).rowcount
+    db.session.commit()
+    return deleted, items
+
+
+def purge_carts(active, cutoff, batch_size=1000, pause=0.1, archive=None, dry_run=False, echo=None):
+    after = None
+    total_carts = total_items = 0
+    started = time.monotonic()
+    while True:
+        rows = _candidates(active, cutoff, after, batch_size)
+        if not rows:
+            break
+        after = tuple(rows[-1])
+        cart_ids = [row[1] for row in rows]
+        if dry_run:
+            total_carts += len(cart_ids)
+            db.session.rollback()
+            continue
+        try:
+            deleted_carts, deleted_items = _delete_batch(active, cutoff, cart_ids, archive)
+        except OperationalError as e:
+            db.session.rollback()
+            logger.warning("Пачка корзин пропущена: %s", e.orig)
+            continue
+        total_carts += deleted_carts
+        total_items += deleted_items
+        if echo is not None:
+            elapsed = max(time.monotonic() - started, 1e-6)
+            echo(f"  корзин {total_carts}, позиций {total_items}, "
+                 f"{(total_carts + total_items) / elapsed:.0f} строк/с, до id {cart_ids[-1]}")
+        if pause:
+            time.sleep(pause)
+    return total_carts, total_items
+
+
+@retention_cli.command("carts")
+@click.option("--inactive-days", default=30, show_default=True,
+              help="Возраст неактивных корзин без заказа.")
+@click.option("--abandoned-days", default=90, show_default=True,
+              help="Возраст брошенных активных корзин; 0 - не трогать.")
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option("--pause", default=0.1, show_default=True, help="Пауза между пачками, секунды.")
+@click.option("--archive", type=click.File("a", encoding="utf-8"), default=None,
+              help="Дописывать удаленные корзины с позициями в файл JSON Lines.")
+@click.option("--dry-run", is_flag=True, help="Только посчитать кандидатов.")
+def carts_command(inactive_days, abandoned_days, batch_size, pause, archive, dry_run):
+    """Удалить устаревшие корзины, на которые не ссылаются заказы."""
+    now = datetime.datetime.utcnow()
+    passes = [(False, inactive_days)]
+    if abandoned_days:
+        passes.append((True, abandoned_days))
+    for active, days in passes:
+        label = "брошенные" if active else "неактивные"
+        click.echo(f"{label} корзины старше {days} дн.:")
+        started = time.monotonic()
+        deleted_carts, deleted_items = purge_carts(
+            active, now - datetime.timedelta(days=days), batch_size=batch_size,
+            pause=pause, archive=archive, dry_run=dry_run, echo=click.echo,
+        )
+        verb = "Найдено" if dry_run else "Удалено"
+        click.echo(f"{verb} корзин: {deleted_carts}, позиций: {deleted_items} "
+                   f"за {time.monotonic() - started:.1f} с")
@@ -0,0 +1,272 @@
+# app/web/search.py
+import bisect
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import event, select, text
+
+from . import after_commit
+from .models import db, Products
+from .pagination import decode_cursor
+from .replicas import use_primary
+
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(value):
+    return TOKEN_RE.findall((value or "").lower())
+
+
+# курсор поиска - (score, id) последней строки
+def decode_search_cursor(cursor):
+    after = decode_cursor(cursor)
+    if after is not None and not (
+            len(after) == 2
+            and isinstance(after[0], (int, float)) and not isinstance(after[0], bool)
+            and isinstance(after[1], int) and not isinstance(after[1], bool)):
+        raise ValueError("Некорректный курсор")
+    return after
+
+
+def _within_one_edit(a, b):
+    if abs(len(a) - len(b)) > 1:
+        return False
+    # перестановка соседних букв тоже считается одной опечаткой
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diff) == 2 and diff[1] == diff[0] + 1 \
+                and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]:
+            return True
+    if len(a) > len(b):
+        a, b = b, a
+    i = j = 0
+    edits = 0
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            i += 1
+            j += 1
+            continue
+        edits += 1
+        if edits > 1:
+            return False
+        if len(a) == len(b):
+            i += 1
+        j += 1
+    return edits + (len(b) - j) + (len(a) - i) <= 1
+
+
+# =========================
+# Поиск в Postgres (tsvector + pg_trgm)
+# =========================
+# Колонка products.search_vector и индексы создаются миграцией
+# 7c1d2e4f9a10; в модели ее нет, чтобы create_all работал и на SQLite.
+PG_SEARCH_SQL = """
+SELECT id, score FROM (
+    SELECT p.id,
+           (ts_rank(p.search_vector, q.query) + similarity(p.name, :raw))::float8 AS score
+    FROM products p, to_tsquery('simple', :tsquery) AS q(query)
+    WHERE p.is_active IS NOT FALSE
+      AND (p.search_vector @@ q.query OR p.name % :raw)
+) ranked
+WHERE (CAST(:after_score AS float8) IS NULL
+       OR (score, id) < (CAST(:after_score AS float8), CAST(:after_id AS integer)))
+ORDER BY score DESC, id DESC
+LIMIT :limit
+"""
+
+
+# =========================
+# Инвертированный индекс (SQLite и прочие базы)
+# =========================
+class InvertedIndex:
+    def __init__(self):
+        self._postings = defaultdict(dict)   # token -> {product_id: tf}
+        self._docs = {}                      # product_id -> (tokens, length)
+        self._vocab = []                     # отсортированный словарь для префиксов
+        self._by_length = defaultdict(set)   # длина -> токены, для опечаток
+
+    def add(self, product_id, name, description):
+        self.remove(product_id)
+        # слова из названия весят больше, чем из описания
+        counts = defaultdict(float)
+        for token in tokenize(name):
+            counts[token] += 2.0
+        for token in tokenize(description):
+            counts[token] += 1.0
+        if not counts:
+            return
+        for token, tf in counts.items():
+            if token not in self._postings:
+                bisect.insort(self._vocab, token)
+                self._by_length[len(token)].add(token)
+            self._postings[token][product_id] = tf
+        self._docs[product_id] = (tuple(counts), sum(counts.values()))
+
+    def remove(self, product_id):
+        doc = self._docs.pop(product_id, None)
+        if doc is None:
+            return
+        for token in doc[0]:
+            postings = self._postings[token]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+                self._vocab.pop(bisect.bisect_left(self._vocab, token))
+                self._by_length[len(token)].discard(token)
+
+    def _expand(self, token):
+        # (токен словаря, вес): точное совпадение, префикс, одна опечатка
+        expansions = {}
+        start = bisect.bisect_left(self._vocab, token)
+        for candidate in self._vocab[start:]:
+            if not candidate.startswith(token):
+                break
+            expansions[candidate] = 1.0 if candidate == token else 0.8
+        if len(token) >= 4:
+            for length in (len(token) - 1, len(token), len(token) + 1):
+                for candidate in self._by_length.get(length, ()):
+                    if candidate not in expansions and _within_one_edit(token, candidate):
+                        expansions[candidate] = 0.5
+        return expansions
+
+    def search(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        total = len(self._docs) or 1
+        scores = None
+        for token in tokens:
+            token_scores = {}
+            for candidate, weight in self._expand(token).items():
+                postings = self._postings[candidate]
+                idf = math.log(1 + total / len(postings))
+                for product_id, tf in postings.items():
+                    score = weight * idf * tf / math.sqrt(self._docs[product_id][1])
+                    if score > token_scores.get(product_id, 0.0):
+                        token_scores[product_id] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {pid: scores[pid] + s for pid, s in token_scores.items() if pid in scores}
+            if not scores:
+                return []
+        return sorted(((score, pid) for pid, score in scores.items()), reverse=True)
+
+
+# =========================
+# Сервис поиска
+# =========================
+class ProductSearch:
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.Lock()          # индекс: и запросы, и изменения
+        self._build_lock = threading.Lock()    # одна перестройка за раз
+        self._index = None
+        self._built_at = 0.0
+        self._building = None                  # изменения, пришедшие во время перестройки
+
+    def init_app(self, app):
+        self.max_age = app.config.get("SEARCH_INDEX_MAX_AGE", self.max_age)
+        app.extensions["product_search"] = self
+        after_commit.register("product_search", self._apply)
+        for name in ("after_insert", "after_update"):
+            if not event.contains(Products, name, self._on_product):
+                event.listen(Products, name, self._on_product)
+        # в after_delete inspect(target).deleted еще False - отдельный обработчик
+        if not event.contains(Products, "after_delete", self._on_product_deleted):
+            event.listen(Products, "after_delete", self._on_product_deleted)
+
+    def _uses_postgres(self):
+        return db.engine.dialect.name == "postgresql"
+
+    # в Postgres search_vector - генерируемая колонка, ее поддерживает сама база;
+    # в остальных базах индекс меняется только после commit
+    def _on_product(self, mapper, connection, target, deleted=False):
+        if connection.dialect.name == "postgresql":
+            return
+        removed = deleted or target.is_active is False
+        after_commit.defer(target, "product_search",
+                           (target.id, None if removed else (target.name, target.description)))
+
+    def _on_product_deleted(self, mapper, connection, target):
+        self._on_product(mapper, connection, target, deleted=True)
+
+    def _apply(self, items):
+        with self._lock:
+            if self._building is not None:
+                self._building.extend(items)
+            if self._index is not None:
+                self._apply_to(self._index, items)
+
+    @staticmethod
+    def _apply_to(index, items):
+        for product_id, document in items:
+            if document is None:
+                index.remove(product_id)
+            else:
+                index.add(product_id, *document)
+
+    # как и у фасетов: изменения из других процессов видны после перестройки.
+    # Индекс строится без блокировки одним потоком, остальные до подмены
+    # ищут по старому. Строится с основной базы, как и индекс фасетов.
+    @use_primary()
+    def _ensure_index(self):
+        if self._index is not None and time.monotonic() - self._built_at <= self.max_age:
+            return
+        if not self._build_lock.acquire(blocking=self._index is None):
+            return
+        try:
+            if self._index is not None and time.monotonic() - self._built_at <= self.max_age:
+                return
+            with self._lock:
+                self._building = []
+            index = InvertedIndex()
+            try:
+                result = db.session.execute(
+                    select(Products.id, Products.name, Products.description)
+                    .where(Products.is_active.isnot(False)),
+                    execution_options={"yield_per": 10000},
+                )
+                for product_id, name, description in result:
+                    index.add(product_id, name, description)
+            except BaseException:
+                with self._lock:
+                    self._building = None
+                raise
+            with self._lock:
+                # зафиксированное за время сборки могло не попасть в выборку
+                replay, self._building = self._building, None
+                self._apply_to(index, replay)
+                self._index = index
+                self._built_at = time.monotonic()
+        finally:
+            self._build_lock.release()
+
+    # after - курсор (score, id) последней строки предыдущей страницы
+    def search(self, query, after=None, limit=20):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        after_score, after_id = after if after else (None, None)
+
+        if self._uses_postgres():
+            rows = db.session.execute(text(PG_SEARCH_SQL), {
+                "tsquery": " & ".join(token + ":*" for token in tokens),
+                "raw": query,
+                "after_score": after_score,
+                "after_id": after_id,
+                "limit": limit,
+            }).all()
+            return [(row.score, row.id) for row in rows]
+
+        self._ensure_index()
+        # словарь и списки индекса меняются после commit в других потоках
+        with self._lock:
+            ranked = self._index.search(query)
+        if after:
+            ranked = [item for item in ranked if item < (after_score, after_id)]
+        return ranked[:limit]
@@ -0,0 +1,259 @@
+# app/web/seed.py
+import datetime
+import itertools
+import random
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, insert, select, text
+from werkzeug.security import generate_password_hash
+
+from .models import (db, Roles, Users, Products, Characteristics, ProductCharacteristics,
+                     Carts, CartItems, Favorites, Orders, OrderStatuses)
+from .catalog_import import _copy
+from .popularity import reconcile
+
+
+SEED_ROLE = "user"
+SEED_STATUSES = ("new", "paid", "shipped", "delivered", "cancelled")
+STATUS_WEIGHTS = (10, 15, 10, 60, 5)
+SEED_EMAIL_DOMAIN = "example.test"
+DEFAULT_PASSWORD = "loadtest"
+
+COLUMNS = {
+    Users: ("id", "username", "email", "password_hash", "role_id", "created_at"),
+    Products: ("id", "name", "price", "stock", "description", "image_url",
+               "created_at", "updated_at", "is_active"),
+    Characteristics: ("id", "name"),
+    ProductCharacteristics: ("id", "product_id", "characteristic_id", "value"),
+    Favorites: ("id", "user_id", "product_id", "added_at"),
+    Carts: ("id", "user_id", "is_active", "created_at", "updated_at"),
+    CartItems: ("id", "cart_id", "product_id", "quantity", "added_at"),
+    Orders: ("id", "user_id", "cart_id", "status_id", "total_amount", "created_at", "updated_at"),
+}
+
+
+# внешние ключи: строки ребенка пишутся только после строк родителей
+PARENTS = {
+    ProductCharacteristics: (Products, Characteristics),
+    Favorites: (Users, Products),
+    Carts: (Users,),
+    CartItems: (Carts, Products),
+    Orders: (Users, Carts),
+}
+
+
+def seed_email(user_id):
+    return f"user{user_id}@{SEED_EMAIL_DOMAIN}"
+
+
+# =========================
+# Вспомогательное
+# =========================
+def _next_id(model):
+    return (db.session.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def _lookup_id(model, name):
+    row_id = db.session.execute(select(model.id).where(model.name == name)).scalar()
+    if row_id is None:
+        row = model(name=name)
+        db.session.add(row)
+        db.session.flush()
+        row_id = row.id
+    return row_id
+
+
+class BulkWriter:
+    # Postgres - COPY (он же пишет явные id в identity-колонки),
+    # остальные базы - executemany пачками
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.copy = db.engine.dialect.name == "postgresql"
+        self._rows = {model: [] for model in COLUMNS}
+        self.counts = dict.fromkeys(COLUMNS, 0)
+
+    def add(self, model, row):
+        rows = self._rows[model]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(model)
+
+    # Буфер ребенка заполняется раньше буферов родителей: сбрасывая его,
+    # сначала сбрасываем родителей (Users -> Products -> Carts -> CartItems,
+    # Favorites, Orders), иначе строка ссылалась бы на еще не записанную.
+    # COLUMNS уже перечислены в этом порядке.
+    def flush(self, model=None):
+        models = [model] if model is not None else list(COLUMNS)
+        for model in models:
+            for parent in PARENTS.get(model, ()):
+                self.flush(parent)
+            rows, self._rows[model] = self._rows[model], []
+            if not rows:
+                continue
+            if self.copy:
+                cursor = db.session.connection().connection.cursor()
+                try:
+                    _copy(cursor, model.__tablename__, COLUMNS[model], rows)
+                finally:
+                    cursor.close()
+            else:
+                db.session.execute(insert(model.__table__), rows)
+            self.counts[model] += len(rows)
+
+    def fix_sequences(self):
+        # id выдавались явно, последовательности нужно догнать до max(id)
+        if not self.copy:
+            return
+        for model in COLUMNS:
+            table = model.__tablename__
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"(SELECT coalesce(max(id), 1) FROM {table}))"
+            ))
+
+
+class Zipf:
+    # ранг r выбирается с вероятностью ~ 1 / r^s; ранги раздаются товарам
+    # в случайном порядке, чтобы популярность не совпадала с порядком id
+    def __init__(self, items, s, rng):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(itertools.accumulate(1.0 / (rank + 1) ** s
+                                                     for rank in range(len(self.items))))
+        self.rng = rng
+
+    def sample(self, k):
+        # без повторов; при сильном перекосе может вернуть меньше k
+        return set(self.rng.choices(self.items, cum_weights=self.cum_weights, k=k))
+
+
+# =========================
+# Синтетические данные
+# =========================
+# Пользователи обрабатываются порциями по batch_size: строки избранного,
+# корзин и заказов генерируются и пишутся потоком, без накопления в памяти.
+def seed_dataset(users=1000, products=1000, characteristics=20, favorites_per_user=5,
+                 carts_per_user=2, items_per_cart=3, order_ratio=0.5, zipf=1.1,
+                 password=DEFAULT_PASSWORD, batch_size=5000, seed=None, echo=None):
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    writer = BulkWriter(batch_size)
+    role_id = _lookup_id(Roles, SEED_ROLE)
+    status_ids = [_lookup_id(OrderStatuses, name) for name in SEED_STATUSES]
+    # один хэш на всех: проверка пароля при входе остается настоящей
+    password_hash = generate_password_hash(password)
+
+    def moment(days=365, after=None):
+        start = after or now - datetime.timedelta(days=days)
+        span = max(int((now - start).total_seconds()), 1)
+        return start + datetime.timedelta(seconds=rng.randrange(span))
+
+    first_product = _next_id(Products)
+    product_ids = range(first_product, first_product + products)
+    prices = []
+    for product_id in product_ids:
+        created_at = moment()
+        price = round(rng.lognormvariate(7, 1), 2)
+        prices.append(price)
+        writer.add(Products, {
+            "id": product_id, "name": f"Товар {product_id}", "price": price,
+            "stock": rng.randrange(0, 500), "description": f"Описание товара {product_id}",
+            "image_url": None, "created_at": created_at, "updated_at": created_at,
+            "is_active": rng.random() > 0.05,
+        })
+
+    first_characteristic = _next_id(Characteristics)
+    characteristic_ids = range(first_characteristic, first_characteristic + characteristics)
+    for cid in characteristic_ids:
+        writer.add(Characteristics, {"id": cid, "name": f"Характеристика {cid}"})
+    pc_id = _next_id(ProductCharacteristics)
+    for product_id in product_ids:
+        for cid in rng.sample(characteristic_ids, min(4, characteristics)):
+            # небольшое число значений - чтобы фасеты были осмысленными
+            writer.add(ProductCharacteristics, {"id": pc_id, "product_id": product_id,
+                                                "characteristic_id": cid,
+                                                "value": str(int(rng.paretovariate(1.5)) % 12)})
+            pc_id += 1
+    writer.flush()
+
+    popularity = Zipf(product_ids, zipf, rng)
+    first_user = _next_id(Users)
+    favorite_id = _next_id(Favorites)
+    cart_id = _next_id(Carts)
+    item_id = _next_id(CartItems)
+    order_id = _next_id(Orders)
+    started = time.monotonic()
+    for user_id in range(first_user, first_user + users):
+        created_at = moment()
+        writer.add(Users, {"id": user_id, "username": f"user{user_id}", "email": seed_email(user_id),
+                           "password_hash": password_hash, "role_id": role_id,
+                           "created_at": created_at})
+        # активность пользователей тоже неравномерна
+        activity = rng.expovariate(1.0)
+        for product_id in popularity.sample(max(1, round(favorites_per_user * activity))):
+            writer.add(Favorites, {"id": favorite_id, "user_id": user_id, "product_id": product_id,
+                                   "added_at": moment(after=created_at)})
+            favorite_id += 1
+        user_carts = max(1, round(carts_per_user * activity))
+        for number in range(user_carts):
+            active = number == user_carts - 1
+            cart_created = moment(after=created_at)
+            writer.add(Carts, {"id": cart_id, "user_id": user_id, "is_active": active,
+                               "created_at": cart_created, "updated_at": cart_created})
+            total = 0
+            for product_id in popularity.sample(max(1, round(rng.expovariate(1 / items_per_cart)))):
+                quantity = rng.choice((1, 1, 1, 2, 3))
+                total += prices[product_id - first_product] * quantity
+                writer.add(CartItems, {"id": item_id, "cart_id": cart_id, "product_id": product_id,
+                                       "quantity": quantity, "added_at": cart_created})
+                item_id += 1
+            if not active and rng.random() < order_ratio:
+                ordered_at = moment(after=cart_created)
+                writer.add(Orders, {"id": order_id, "user_id": user_id, "cart_id": cart_id,
+                                    "status_id": rng.choices(status_ids, STATUS_WEIGHTS)[0],
+                                    "total_amount": round(total, 2),
+                                    "created_at": ordered_at, "updated_at": ordered_at})
+                order_id += 1
+            cart_id += 1
+        if echo is not None and (user_id - first_user + 1) % (batch_size * 10) == 0:
+            done = user_id - first_user + 1
+            echo(f"  пользователей {done}/{users}, {done / (time.monotonic() - started):.0f}/с")
+    writer.flush()
+    writer.fix_sequences()
+    db.session.commit()
+    # производные счетчики приводим в соответствие одним запросом
+    reconcile()
+    return {model.__tablename__: count for model, count in writer.counts.items()}
+
+
+@click.command("seed")
+@click.option("--users", default=10000, show_default=True)
+@click.option("--products", default=5000, show_default=True)
+@click.option("--characteristics", default=20, show_default=True)
+@click.option("--favorites-per-user", default=10, show_default=True, help="В среднем.")
+@click.option("--carts-per-user", default=3, show_default=True, help="В среднем.")
+@click.option("--items-per-cart", default=3, show_default=True, help="В среднем.")
+@click.option("--order-ratio", default=0.6, show_default=True,
+              help="Доля неактивных корзин, по которым оформлен заказ.")
+@click.option("--zipf", default=1.1, show_default=True, help="Показатель перекоса популярности.")
+@click.option("--password", default=DEFAULT_PASSWORD, show_default=True,
+              help="Пароль всех синтетических пользователей.")
+@click.option("--batch-size", default=5000, show_default=True)
+@click.option("--seed", "random_seed", type=int, default=None, help="Зерно генератора.")
+@with_appcontext
+def seed_command(users, products, characteristics, favorites_per_user, carts_per_user,
+                 items_per_cart, order_ratio, zipf, password, batch_size, random_seed):
+    """Заполнить базу синтетическими данными (не для прода)."""
+    started = time.monotonic()
+    counts = seed_dataset(users=users, products=products, characteristics=characteristics,
+                          favorites_per_user=favorites_per_user, carts_per_user=carts_per_user,
+                          items_per_cart=items_per_cart, order_ratio=order_ratio, zipf=zipf,
+                          password=password, batch_size=batch_size, seed=random_seed,
+                          echo=click.echo)
+    total = sum(counts.values())
+    elapsed = time.monotonic() - started
+    click.echo(", ".join(f"{table}={count}" for table, count in counts.items()))
+    click.echo(f"Строк: {total} за {elapsed:.1f} с ({total / max(elapsed, 1e-6):.0f}/с). "
+               f"Сводки продаж: flask rollups backfill")
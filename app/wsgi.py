@@ -1,4 +1,6 @@
-from app.web.app import app
+from app.web.app import create_app
+
+app = create_app()
 
 if __name__ == "__main__":
     app.run()
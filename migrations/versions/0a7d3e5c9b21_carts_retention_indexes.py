@@ -0,0 +1,33 @@
+"""carts retention indexes
+
+Revision ID: 0a7d3e5c9b21
+Revises: f2c9a6e3b718
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a7d3e5c9b21'
+down_revision = 'f2c9a6e3b718'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('carts', schema=None) as batch_op:
+        batch_op.create_index('ix_carts_is_active_updated_at', ['is_active', 'updated_at'], unique=False)
+
+    # проверка "на корзину ссылается заказ" - по индексу, а не перебором orders
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index('ix_orders_cart_id', ['cart_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_cart_id')
+
+    with op.batch_alter_table('carts', schema=None) as batch_op:
+        batch_op.drop_index('ix_carts_is_active_updated_at')
@@ -0,0 +1,45 @@
+"""foreign key and access path indexes
+
+Revision ID: 1c4e8b2f6a93
+Revises: 0a7d3e5c9b21
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1c4e8b2f6a93'
+down_revision = '0a7d3e5c9b21'
+branch_labels = None
+depends_on = None
+
+
+# (имя, таблица, колонки). users.email отдельный индекс не нужен:
+# UNIQUE-ограничение уже создает свой; cart_items.cart_id и
+# favorites.user_id покрыты ведущими колонками уникальных ключей.
+INDEXES = (
+    ('ix_users_role_id', 'users', ['role_id']),
+    ('ix_product_characteristics_product_id', 'product_characteristics', ['product_id']),
+    ('ix_product_characteristics_characteristic_id', 'product_characteristics', ['characteristic_id']),
+    ('ix_carts_user_id_id', 'carts', ['user_id', 'id']),
+    ('ix_cart_items_product_id', 'cart_items', ['product_id']),
+    ('ix_favorites_product_id', 'favorites', ['product_id']),
+    ('ix_favorites_user_id_added_at_id', 'favorites', ['user_id', 'added_at', 'id']),
+    ('ix_orders_user_id_created_at_id', 'orders', ['user_id', 'created_at', 'id']),
+)
+
+
+def upgrade():
+    # CONCURRENTLY не блокирует запись в таблицы, но работает только вне транзакции
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
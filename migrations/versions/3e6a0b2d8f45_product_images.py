@@ -0,0 +1,32 @@
+"""product image derivatives
+
+Revision ID: 3e6a0b2d8f45
+Revises: 2d5f9a1c7e34
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e6a0b2d8f45'
+down_revision = '2d5f9a1c7e34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_images',
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('source_url', sa.String(), nullable=False),
+        sa.Column('source_hash', sa.String(length=64), nullable=False),
+        sa.Column('variants', sa.JSON(), nullable=False),
+        sa.Column('processed_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('product_id')
+    )
+
+
+def downgrade():
+    op.drop_table('product_images')
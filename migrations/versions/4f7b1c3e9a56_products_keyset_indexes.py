@@ -0,0 +1,45 @@
+"""products keyset indexes, created_at not null
+
+Revision ID: 4f7b1c3e9a56
+Revises: 3e6a0b2d8f45
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f7b1c3e9a56'
+down_revision = '3e6a0b2d8f45'
+branch_labels = None
+depends_on = None
+
+
+# порядок колонок и направление - как в ORDER BY сортировок /api/products
+INDEXES = (
+    ('ix_products_created_at_id', [sa.text('created_at DESC'), sa.text('id DESC')]),
+    ('ix_products_price_id', ['price', 'id']),
+)
+
+
+def upgrade():
+    # курсор по created_at не может содержать NULL
+    op.execute("UPDATE products SET created_at = coalesce(updated_at, CURRENT_TIMESTAMP) "
+               "WHERE created_at IS NULL")
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES:
+            op.create_index(name, 'products', columns, unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _ in reversed(INDEXES):
+            op.drop_index(name, table_name='products', postgresql_concurrently=True, if_exists=True)
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=True)
@@ -0,0 +1,37 @@
+"""one active cart per user
+
+Revision ID: 5b2e8d4c1f67
+Revises: 4f7b1c3e9a56
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e8d4c1f67'
+down_revision = '4f7b1c3e9a56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NULL считался активной корзиной
+    op.execute("UPDATE carts SET is_active = TRUE WHERE is_active IS NULL")
+    # из нескольких активных корзин приложение всегда брало последнюю,
+    # остальные были недостижимы
+    op.execute("UPDATE carts SET is_active = FALSE WHERE is_active AND EXISTS ("
+               "SELECT 1 FROM carts AS newer WHERE newer.user_id = carts.user_id "
+               "AND newer.is_active AND newer.id > carts.id)")
+
+    with op.get_context().autocommit_block():
+        op.create_index('ux_carts_user_id_active', 'carts', ['user_id'], unique=True,
+                        postgresql_where=sa.text('is_active'), sqlite_where=sa.text('is_active'),
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ux_carts_user_id_active', table_name='carts',
+                      postgresql_concurrently=True, if_exists=True)
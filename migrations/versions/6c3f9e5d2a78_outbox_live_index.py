@@ -0,0 +1,38 @@
+"""outbox partial index on live events
+
+Revision ID: 6c3f9e5d2a78
+Revises: 5b2e8d4c1f67
+Create Date: 2026-10-20 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c3f9e5d2a78'
+down_revision = '5b2e8d4c1f67'
+branch_labels = None
+depends_on = None
+
+
+LIVE = sa.text("status IN ('pending', 'processing')")
+
+
+def upgrade():
+    # обработанные события копятся до purge и не должны раздувать индекс захвата
+    with op.get_context().autocommit_block():
+        op.create_index('ix_outbox_events_live', 'outbox_events', ['id'], unique=False,
+                        postgresql_where=LIVE, sqlite_where=LIVE,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_outbox_events_status_available_at', table_name='outbox_events',
+                      postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_outbox_events_status_available_at', 'outbox_events',
+                        ['status', 'available_at'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_outbox_events_live', table_name='outbox_events',
+                      postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,30 @@
+"""orders.updated_at not null
+
+Revision ID: 7d4a0f6e3b89
+Revises: 6c3f9e5d2a78
+Create Date: 2026-10-20 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d4a0f6e3b89'
+down_revision = '6c3f9e5d2a78'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("UPDATE orders SET updated_at = coalesce(created_at, CURRENT_TIMESTAMP) "
+               "WHERE updated_at IS NULL")
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False,
+                              server_default=sa.func.now())
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=True,
+                              server_default=None)
@@ -0,0 +1,30 @@
+"""carts.is_active not null
+
+Revision ID: 8e5b1a7f4c90
+Revises: 7d4a0f6e3b89
+Create Date: 2026-10-20 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e5b1a7f4c90'
+down_revision = '7d4a0f6e3b89'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NULL всегда означал активную корзину
+    op.execute("UPDATE carts SET is_active = TRUE WHERE is_active IS NULL")
+    with op.batch_alter_table('carts', schema=None) as batch_op:
+        batch_op.alter_column('is_active', existing_type=sa.Boolean(), nullable=False,
+                              server_default=sa.true())
+
+
+def downgrade():
+    with op.batch_alter_table('carts', schema=None) as batch_op:
+        batch_op.alter_column('is_active', existing_type=sa.Boolean(), nullable=True,
+                              server_default=None)
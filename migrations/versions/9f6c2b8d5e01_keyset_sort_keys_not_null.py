@@ -0,0 +1,38 @@
+"""favorites.added_at, orders.created_at not null
+
+Revision ID: 9f6c2b8d5e01
+Revises: 8e5b1a7f4c90
+Create Date: 2026-10-21 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9f6c2b8d5e01'
+down_revision = '8e5b1a7f4c90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ключи keyset-пагинации /api не могут содержать NULL: такие строки
+    # выпадали из сравнения (key, id) < курсор, а курсор с NULL - 400
+    op.execute("UPDATE orders SET created_at = updated_at WHERE created_at IS NULL")
+    op.execute("UPDATE favorites SET added_at = CURRENT_TIMESTAMP WHERE added_at IS NULL")
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False,
+                              server_default=sa.func.now())
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.alter_column('added_at', existing_type=sa.DateTime(), nullable=False,
+                              server_default=sa.func.now())
+
+
+def downgrade():
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.alter_column('added_at', existing_type=sa.DateTime(), nullable=True,
+                              server_default=None)
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=True,
+                              server_default=None)
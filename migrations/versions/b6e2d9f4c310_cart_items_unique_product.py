@@ -0,0 +1,45 @@
+"""cart items unique product per cart
+
+Revision ID: b6e2d9f4c310
+Revises: a3f5c8d21b47
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2d9f4c310'
+down_revision = 'a3f5c8d21b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # схлопываем накопившиеся дубли в строку с минимальным id
+    op.execute("""
+        UPDATE cart_items ci
+        SET quantity = d.total
+        FROM (
+            SELECT min(id) AS keep_id, sum(quantity) AS total
+            FROM cart_items
+            GROUP BY cart_id, product_id
+            HAVING count(*) > 1
+        ) d
+        WHERE ci.id = d.keep_id
+    """)
+    op.execute("""
+        DELETE FROM cart_items ci
+        USING cart_items keep
+        WHERE keep.cart_id = ci.cart_id
+          AND keep.product_id = ci.product_id
+          AND keep.id < ci.id
+    """)
+    with op.batch_alter_table('cart_items', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_cart_items_cart_product', ['cart_id', 'product_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('cart_items', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_cart_items_cart_product', type_='unique')
@@ -0,0 +1,48 @@
+"""sales rollups
+
+Revision ID: d4a7b1c9e063
+Revises: c81f4a7e5d92
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7b1c9e063'
+down_revision = 'c81f4a7e5d92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sales_rollups',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('granularity', sa.String(), nullable=False),
+        sa.Column('bucket', sa.DateTime(), nullable=False),
+        sa.Column('status_id', sa.Integer(), nullable=False),
+        sa.Column('cohort', sa.String(), nullable=False),
+        sa.Column('orders_count', sa.Integer(), nullable=False),
+        sa.Column('total_amount', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.ForeignKeyConstraint(['status_id'], ['order_statuses.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('granularity', 'bucket', 'status_id', 'cohort', name='uq_sales_rollups_key')
+    )
+    op.create_table('rollup_state',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('high_water', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index('ix_orders_updated_at', ['updated_at'], unique=False)
+        batch_op.create_index('ix_orders_created_at', ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_created_at')
+        batch_op.drop_index('ix_orders_updated_at')
+    op.drop_table('rollup_state')
+    op.drop_table('sales_rollups')
@@ -0,0 +1,35 @@
+"""product recommendations
+
+Revision ID: e5b8c2d7f104
+Revises: d4a7b1c9e063
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8c2d7f104'
+down_revision = 'd4a7b1c9e063'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_recommendations',
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('neighbor_ids', sa.LargeBinary(), nullable=False),
+        sa.Column('scores', sa.LargeBinary(), nullable=False),
+        sa.Column('computed_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('product_id')
+    )
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.create_index('ix_favorites_added_at', ['added_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorites_added_at')
+    op.drop_table('product_recommendations')
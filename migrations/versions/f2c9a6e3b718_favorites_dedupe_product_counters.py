@@ -0,0 +1,51 @@
+"""favorites dedupe and product counters
+
+Revision ID: f2c9a6e3b718
+Revises: e5b8c2d7f104
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c9a6e3b718'
+down_revision = 'e5b8c2d7f104'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # дубли остались после 64116c5c2cef; оставляем самую раннюю запись
+    op.execute("""
+        DELETE FROM favorites
+        WHERE id NOT IN (
+            SELECT min(id) FROM favorites GROUP BY user_id, product_id
+        )
+    """)
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.create_unique_constraint('unique_user_product_fav', ['user_id', 'product_id'])
+
+    op.create_table('product_counters',
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('favorites_count', sa.Integer(), nullable=False),
+        sa.Column('cart_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('product_id')
+    )
+    op.execute("""
+        INSERT INTO product_counters (product_id, favorites_count, cart_count, updated_at)
+        SELECT p.id,
+               (SELECT count(*) FROM favorites f WHERE f.product_id = p.id),
+               (SELECT count(*) FROM cart_items c WHERE c.product_id = p.id),
+               CURRENT_TIMESTAMP
+        FROM products p
+    """)
+
+
+def downgrade():
+    op.drop_table('product_counters')
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.drop_constraint('unique_user_product_fav', type_='unique')